@@ -0,0 +1,111 @@
+"""
+Benchmark the vectorized NumPy distance ranking against the MongoDB $geoNear aggregation.
+
+Usage:
+    python -m benchmarks.geo_benchmark [--sizes 1000 100000 1000000] [--mongo-url URL]
+
+Synthetic trucks are spread over the San Francisco area. The $geoNear part is skipped when
+MongoDB is not reachable; it uses a throwaway 'food_truck_benchmark' database.
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+from pymongo import InsertOne, MongoClient
+from pymongo.errors import PyMongoError
+
+from search.geo import CoordinateStore, GeoIndex
+
+# Bounding box of San Francisco, (min longitude, min latitude, max longitude, max latitude)
+SAN_FRANCISCO = (-122.52, 37.70, -122.35, 37.82)
+CENTER = (-122.4194, 37.7749)
+
+
+def synthetic_trucks(count, seed=0):
+    """
+    Generate count food truck documents with random points inside San Francisco.
+    """
+    rng = np.random.default_rng(seed)
+    longitudes = rng.uniform(SAN_FRANCISCO[0], SAN_FRANCISCO[2], count)
+    latitudes = rng.uniform(SAN_FRANCISCO[1], SAN_FRANCISCO[3], count)
+    return [
+        {'applicant': 'Truck {}'.format(i), 'location': {'type': 'Point', 'coordinates': [longitude, latitude]}}
+        for i, (longitude, latitude) in enumerate(zip(longitudes.tolist(), latitudes.tolist()))
+    ]
+
+
+def measure(function, repeat):
+    """
+    Run function repeat times and return the median duration in milliseconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+
+def connect(url):
+    """
+    Return the benchmark collection, or None if MongoDB is not reachable.
+    """
+    client = MongoClient(url, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command('ping')
+    except PyMongoError:
+        return None
+    return client['food_truck_benchmark']['food_truck']
+
+
+def run(sizes, limit, radius, repeat, mongo_url):
+    collection = connect(mongo_url)
+    if collection is None:
+        print('MongoDB is not reachable at {}, skipping $geoNear'.format(mongo_url))
+
+    print('{:>9} {:>14} {:>14} {:>14} {:>14}'.format('trucks', 'numpy top-k', 'numpy radius', 'grid radius', '$geoNear'))
+    for size in sizes:
+        trucks = synthetic_trucks(size)
+        store = CoordinateStore(trucks)
+        index = GeoIndex(trucks)
+        row = [
+            measure(lambda: store.nearest(*CENTER, limit=limit), repeat),
+            measure(lambda: store.nearest(*CENTER, limit=limit, radius=radius), repeat),
+            measure(lambda: index.within(*CENTER, radius, limit=limit), repeat),
+        ]
+
+        if collection is not None:
+            collection.drop()
+            collection.create_index({'location': '2dsphere'})
+            for start in range(0, size, 10000):
+                collection.bulk_write([InsertOne(dict(truck)) for truck in trucks[start:start + 10000]], ordered=False)
+            pipeline = [
+                {'$geoNear': {
+                    'near': {'type': 'Point', 'coordinates': list(CENTER)},
+                    'distanceField': 'distance',
+                    'maxDistance': radius,
+                    'spherical': True
+                }},
+                {'$limit': limit},
+                {'$project': {'_id': 0}},
+            ]
+            row.append(measure(lambda: list(collection.aggregate(pipeline)), repeat))
+            collection.drop()
+
+        print('{:>9} '.format(size) + ' '.join('{:>11.3f} ms'.format(value) for value in row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--radius', type=float, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--mongo-url', default='mongodb://localhost:27017/')
+    args = parser.parse_args()
+    run(args.sizes, args.limit, args.radius, args.repeat, args.mongo_url)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+"""
+Load test the read endpoints and the seed_data ingestion on a synthetic dataset.
+
+Usage:
+    python -m benchmarks.load_benchmark [--scale 10] [--requests 500] [--concurrency 8]
+        [--backend mongo|mongomock] [--mongo-url URL] [--parser csv|pandas] [--output results.json]
+        [--compare previous.json]
+
+The dataset is made of `scale` copies of the bundled CSV, every copy but the first moved by
+a few hundred meters, and is loaded by seed_data into a throwaway 'food_truck_benchmark'
+database. Each endpoint is then requested `requests` times by `concurrency` threads through
+the Django test client, with parameters drawn from the CSV. The response cache is turned off
+unless --cache is given, so every request reaches MongoDB or the in-memory indexes.
+
+The p50/p95/p99 latencies, requests per second and peak RSS of the process are printed as
+JSON, and written to --output to be compared with a later run through --compare.
+
+--backend mongomock runs against mongomock, an in-memory stand-in of MongoDB installed with
+the dev packages (pipenv install --dev), so no server is needed. It is much slower than
+mongod, so only compare runs of the same backend.
+
+The script can also be run by path, python benchmarks/load_benchmark.py.
+"""
+import argparse
+import csv
+import functools
+import inspect
+import io
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+
+if not __package__:
+    # Run by path, the project is imported from the repository root
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodTruck.settings')
+django.setup()
+
+import numpy as np  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+from foodTruck.db_connection import connections  # noqa: E402
+from search.ingest import DEFAULT_CSV_PATH, food_key, read_rows, split_food_items  # noqa: E402
+
+try:
+    import mongomock
+except ImportError:  # Optional, only needed by --backend mongomock
+    mongomock = None
+
+# Throwaway database the synthetic dataset is loaded into
+DATABASE_NAME = 'food_truck_benchmark'
+
+# Standard deviation in degrees of the moves of the synthetic copies, about 200 meters
+JITTER = 0.002
+
+
+def synthetic_csv(path, scale, seed=0):
+    """
+    Write scale copies of the bundled CSV to path, and return the number of rows written.
+
+    The first copy is the bundled data. The other ones get their own locationid and have
+    their coordinates moved by a random offset, so they are distinct trucks to seed_data.
+    """
+    rng = random.Random(seed)
+    rows = list(read_rows(DEFAULT_CSV_PATH))
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        for copy in range(scale):
+            for row in rows:
+                if copy:
+                    row = dict(row, locationid='{}-{}'.format(row['locationid'], copy))
+                    # Trucks without a location keep their placeholder coordinates
+                    if row['Latitude'] and float(row['Latitude']):
+                        row['Latitude'] = repr(float(row['Latitude']) + rng.gauss(0, JITTER))
+                        row['Longitude'] = repr(float(row['Longitude']) + rng.gauss(0, JITTER))
+                writer.writerow(row)
+    return len(rows) * scale
+
+
+def endpoints():
+    """
+    Return the endpoints to load, as functions drawing the path and parameters of a request.
+    """
+    rows = list(read_rows(DEFAULT_CSV_PATH))
+    points = [(float(row['Longitude']), float(row['Latitude'])) for row in rows if row['Latitude'] and float(row['Latitude'])]
+    words = sorted({word for row in rows for word in food_key(row['Applicant']).split() if len(word) > 2})
+    foods = sorted({key for row in rows for key in map(food_key, split_food_items(row['FoodItems'])) if key})
+
+    def nearby(rng):
+        longitude, latitude = rng.choice(points)
+        return '/api/foodtruck/nearby/', {'longitude': longitude, 'latitude': latitude, 'radius': 1000}
+
+    def search(rng):
+        # Partially typed words, as sent by a search box
+        word = rng.choice(words)
+        return '/api/foodtruck/search/', {'q': word[:rng.randint(3, len(word))]}
+
+    def all_trucks(rng):
+        return '/api/foodtruck/all/', {}
+
+    def food_search(rng):
+        food = rng.choice(foods)
+        return '/api/foods/search/', {'name': food[:rng.randint(1, len(food))]}
+
+    return {'nearby': nearby, 'search': search, 'all': all_trucks, 'foods': food_search}
+
+
+def peak_rss_mb():
+    """
+    Return the peak resident set size of the process in megabytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def load(request, count, concurrency, seed=0):
+    """
+    Send count requests from concurrency threads, each with its own test client.
+
+    Args:
+        request (callable): Function of a random.Random returning the path and parameters.
+        count (int): Number of requests.
+        concurrency (int): Number of threads sending requests.
+        seed (int): Seed of the parameters, the same seed sends the same requests.
+
+    Returns:
+        dict: Latency percentiles, throughput and errors of the requests.
+    """
+    local = threading.local()
+
+    def send(position):
+        if not hasattr(local, 'client'):
+            local.client = Client()
+        path, params = request(random.Random(seed * count + position))
+        start = time.perf_counter()
+        response = local.client.get(path, params)
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(count)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([duration for duration, _ in results]) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'requests': count,
+        'errors': sum(1 for _, status in results if status != 200),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'mean_ms': round(float(latencies.mean()), 3),
+        'requests_per_second': round(count / elapsed, 1),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def ingest(path, rows, workers, parser):
+    """
+    Seed the benchmark database from a CSV file and return the ingestion throughput.
+    """
+    start = time.perf_counter()
+    call_command('seed_data', path=path, workers=workers, parser=parser, stdout=io.StringIO())
+    elapsed = time.perf_counter() - start
+    return {
+        'rows': rows,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(rows / elapsed, 1),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def accept_bulk_sort(add):
+    """
+    Wrap a mongomock bulk operation method to accept the sort argument pymongo passes since 4.11.
+    """
+    @functools.wraps(add)
+    def wrapper(self, *args, sort=None, **kwargs):
+        if sort is not None:
+            raise NotImplementedError('mongomock does not sort bulk writes')
+        return add(self, *args, **kwargs)
+    return wrapper
+
+
+def patch_mongomock():
+    """
+    Make the bulk writes of seed_data work with mongomock.
+
+    mongomock 4.3, the latest release, predates the sort argument pymongo 4.11 passes to
+    the update and replace operations of bulk_write. seed_data never sorts them.
+    """
+    builder = mongomock.collection.BulkOperationBuilder
+    for name in ('add_update', 'add_replace'):
+        add = getattr(builder, name)
+        if 'sort' not in inspect.signature(add).parameters:
+            setattr(builder, name, accept_bulk_sort(add))
+
+
+def connect(backend, mongo_url):
+    """
+    Point the application at the benchmark database of a backend.
+    """
+    settings.MONGO_DB_NAME = DATABASE_NAME
+    if backend == 'mongomock':
+        if mongomock is None:
+            raise SystemExit('mongomock is not installed, run pipenv install --dev')
+        patch_mongomock()
+        connections.use_client(mongomock.MongoClient())
+        return
+    settings.MONGO_URL = mongo_url
+    connections.close()
+    try:
+        connections.get_client().admin.command('ping')
+    except PyMongoError:
+        raise SystemExit('MongoDB is not reachable at {}'.format(mongo_url))
+
+
+def compare(previous, current):
+    """
+    Print the change of the latency and throughput of each endpoint since a previous run.
+    """
+    def change(before, after):
+        return '{:+.1f}%'.format((after - before) / before * 100) if before else 'n/a'
+
+    if 'ingest' in previous:
+        before, after = previous['ingest']['rows_per_second'], current['ingest']['rows_per_second']
+        print('{:>8} {:>10.1f} rows/s ({})'.format('seed', after, change(before, after)), file=sys.stderr)
+    for name, result in current['endpoints'].items():
+        before = previous.get('endpoints', {}).get(name)
+        if before is None:
+            continue
+        print('{:>8} p95 {:>9.3f} ms ({}) {:>9.1f} req/s ({})'.format(
+            name,
+            result['p95_ms'], change(before['p95_ms'], result['p95_ms']),
+            result['requests_per_second'], change(before['requests_per_second'], result['requests_per_second']),
+        ), file=sys.stderr)
+
+
+def run(scale, requests, concurrency, backend, mongo_url, workers, parser, cache, seed):
+    connect(backend, mongo_url)
+    setup_test_environment()
+    report = {
+        'backend': backend,
+        'scale': scale,
+        'concurrency': concurrency,
+        'geo_engine': settings.GEO_ENGINE,
+        'parser': parser,
+        'response_cache': cache,
+        'python': platform.python_version(),
+    }
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'food-truck-data.csv')
+            rows = synthetic_csv(path, scale, seed=seed)
+            report['ingest'] = ingest(path, rows, workers, parser)
+
+        report['endpoints'] = {}
+        with override_settings(RESPONSE_CACHE_ENABLED=cache):
+            for name, request in endpoints().items():
+                # Warm up the in-memory indexes and the connection pool
+                load(request, concurrency, concurrency, seed=seed + 1)
+                report['endpoints'][name] = load(request, requests, concurrency, seed=seed)
+    finally:
+        connections.get_client().drop_database(DATABASE_NAME)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--backend', choices=['mongo', 'mongomock'], default='mongo')
+    parser.add_argument('--mongo-url', default='mongodb://localhost:27017/?directConnection=true')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes of seed_data')
+    parser.add_argument('--parser', choices=['csv', 'pandas'], default='csv', help='CSV parser of seed_data')
+    parser.add_argument('--cache', action='store_true', help='Keep the response cache on')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Path the JSON report is written to')
+    parser.add_argument('--compare', help='JSON report of a previous run to compare with')
+    args = parser.parse_args()
+
+    report = run(args.scale, args.requests, args.concurrency, args.backend, args.mongo_url, args.workers, args.parser, args.cache, args.seed)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), report)
+
+
+if __name__ == '__main__':
+    main()
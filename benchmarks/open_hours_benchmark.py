@@ -0,0 +1,97 @@
+"""
+Benchmark the compiled, memoized parse_open_hours against the previous string-splitting parser.
+
+Usage:
+    python -m benchmarks.open_hours_benchmark [--path data/food-truck-data.csv] [--copies 100] [--repeat 5]
+
+The 'dayshours' column of the CSV export is parsed `copies` times, like seed_data parses
+it once per row. The compiled parser is measured with an empty memo on every run (cold)
+and with the memo filled by a previous run (warm).
+"""
+import argparse
+
+from benchmarks.geo_benchmark import measure
+from search.ingest import DEFAULT_CSV_PATH, read_rows
+from search.utils import _compile_open_hours, parse_open_hours
+
+
+def legacy_parse_open_hours(open_hours_str):
+    """
+    Previous implementation of parse_open_hours, kept as the baseline.
+
+    It raises on malformed time slots, so rows are expected to be well formed.
+    """
+    day_mapping = {
+        "Mo": "Monday", "Tu": "Tuesday", "We": "Wednesday",
+        "Th": "Thursday", "Fr": "Friday", "Sa": "Saturday", "Su": "Sunday"
+    }
+    open_hours = {}
+
+    for schedule in open_hours_str.split(';'):
+        parts = schedule.split(':')
+        if len(parts) != 2:
+            continue
+
+        day_part, hour_part = parts[0].strip(), parts[1].strip()
+
+        days = set()
+        if '/' in day_part:
+            for day in day_part.split('/'):
+                days.add(day_mapping.get(day, day))
+        elif '-' in day_part:
+            start_day, end_day = day_part.split('-')
+            start_index = list(day_mapping.keys()).index(start_day)
+            end_index = list(day_mapping.keys()).index(end_day)
+            for index in range(start_index, end_index + 1):
+                days.add(list(day_mapping.values())[index])
+        else:
+            days.add(day_mapping.get(day_part, day_part))
+
+        time_slots = []
+
+        for time_slot in hour_part.split('/'):
+            start_time, end_time = time_slot.split('-')
+            time_slots.append({"start_time": start_time, "end_time": end_time})
+
+        for day in days:
+            open_hours[day] = time_slots
+
+    return open_hours
+
+
+def run(path, copies, repeat):
+    column = [row['dayshours'] for row in read_rows(path)] * copies
+
+    def legacy():
+        for value in column:
+            legacy_parse_open_hours(value)
+
+    def cold():
+        _compile_open_hours.cache_clear()
+        for value in column:
+            parse_open_hours(value)
+
+    def warm():
+        for value in column:
+            parse_open_hours(value)
+
+    rows = [('legacy', measure(legacy, repeat)), ('compiled, cold', measure(cold, repeat))]
+    warm()
+    rows.append(('compiled, warm', measure(warm, repeat)))
+
+    print('{} values, {} distinct'.format(len(column), len(set(column))))
+    for name, duration in rows:
+        print('{:>16} {:>11.3f} ms {:>7.1f}x'.format(name, duration, rows[0][1] / duration))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default=DEFAULT_CSV_PATH)
+    parser.add_argument('--copies', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.path, args.copies, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark the fast-path food truck encoder against the DRF DocumentSerializer.
+
+Usage:
+    python -m benchmarks.serializer_benchmark [--count 10000] [--repeat 5]
+
+Both paths turn raw pymongo documents into the JSON body of /all/: FoodTruckSerializer
+rendered by the DRF JSONRenderer, and DocumentEncoder rendered with orjson when it is
+installed and the standard json module otherwise.
+"""
+import argparse
+import os
+from datetime import datetime, timedelta
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodTruck.settings')
+django.setup()
+
+from bson import ObjectId  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from benchmarks.geo_benchmark import measure, synthetic_trucks  # noqa: E402
+from search import encoders  # noqa: E402
+from search.encoders import food_truck_encoder  # noqa: E402
+from search.serializers import FoodTruckSerializer  # noqa: E402
+
+
+def raw_documents(count):
+    """
+    Generate count documents shaped like the ones seed_data writes.
+    """
+    approved_at = datetime(2024, 1, 1)
+    return [
+        dict(
+            truck,
+            _id=ObjectId(),
+            facility_type='Truck',
+            location_description='{} between 1st and 2nd'.format(truck['applicant']),
+            address='{} MARKET ST'.format(i),
+            status='APPROVED',
+            food_items=['Tacos', 'Burritos', 'Quesadillas', 'Soda'],
+            approved_at=approved_at + timedelta(minutes=i),
+            open_hours={'Mo': ['10AM-2PM'], 'Tu': ['10AM-2PM']},
+            location_id=str(i),
+            permit='21MFF-{:05d}'.format(i),
+            row_hash='0' * 40,
+        )
+        for i, truck in enumerate(synthetic_trucks(count))
+    ]
+
+
+def run(count, repeat):
+    documents = raw_documents(count)
+    renderer = JSONRenderer()
+
+    def drf():
+        data = FoodTruckSerializer(documents, many=True).data
+        return renderer.render({'count': len(data), 'data': data})
+
+    def fast():
+        data = food_truck_encoder.to_list(documents)
+        return encoders.dumps({'count': len(data), 'data': data})
+
+    # Both paths must produce the same body
+    assert drf() == fast()
+
+    rows = [('DRF serializer', measure(drf, repeat))]
+    if encoders.orjson is not None:
+        rows.append(('encoder + orjson', measure(fast, repeat)))
+        orjson, encoders.orjson = encoders.orjson, None
+        rows.append(('encoder + json', measure(fast, repeat)))
+        encoders.orjson = orjson
+    else:
+        rows.append(('encoder + json', measure(fast, repeat)))
+
+    print('{} documents'.format(count))
+    for name, duration in rows:
+        print('{:>18} {:>11.3f} ms {:>7.1f}x'.format(name, duration, rows[0][1] / duration))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.count, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from foodTruck.db_connection import db
+
+logger = logging.getLogger(__name__)
+
+# Collection holding bookkeeping documents such as the data version counter.
+meta_collection = db['meta']
+
+# Id of the document of meta_collection holding the data version counter.
+DATA_VERSION_ID = 'data_version'
+
+_cached_version = None
+_checked_at = None
+
+
+def bump_data_version():
+    """
+    Increment the data version counter after the food truck data changed.
+
+    Every cache and in-memory index derived from the data is invalidated by the bump.
+
+    Returns:
+        int: The new data version.
+    """
+    global _checked_at
+    document = meta_collection.find_one_and_update(
+        {'_id': DATA_VERSION_ID},
+        {'$inc': {'value': 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    _checked_at = None
+    return document['value']
+
+
+def _is_checked(now):
+    return _checked_at is not None and now - _checked_at < settings.DATA_VERSION_CHECK_INTERVAL
+
+
+def get_data_version():
+    """
+    Return the current data version counter.
+
+    The counter is read from MongoDB at most once every DATA_VERSION_CHECK_INTERVAL seconds.
+
+    Returns:
+        int: The data version, 0 if the data was never seeded, or None if MongoDB is unreachable.
+    """
+    global _cached_version, _checked_at
+    now = time.monotonic()
+    if _is_checked(now):
+        return _cached_version
+    try:
+        document = meta_collection.find_one({'_id': DATA_VERSION_ID})
+    except PyMongoError as error:
+        logger.warning('Could not read the data version: %s', error)
+        _cached_version = None
+    else:
+        _cached_version = document['value'] if document else 0
+    _checked_at = now
+    return _cached_version
+
+
+async def aget_data_version():
+    """
+    Async variant of get_data_version for the async views.
+
+    The counter is read at most once every DATA_VERSION_CHECK_INTERVAL seconds, in a worker
+    thread, so other requests keep running on the event loop meanwhile.
+    """
+    if _is_checked(time.monotonic()):
+        return _cached_version
+    return await sync_to_async(get_data_version, thread_sensitive=False)()
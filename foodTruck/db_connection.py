@@ -1,14 +1,169 @@
-from pymongo import MongoClient
+import os
+import threading
 
-# MongoDB connection URL specifying the host and port.
-url = 'mongodb://localhost:27017/?readPreference=primary&appname=MongoDB%20Compass&directConnection=true&ssl=false'
+from django.conf import settings
+from pymongo import AsyncMongoClient, MongoClient, ReadPreference
 
-# Create a MongoClient instance to connect to the MongoDB server.
-db_client = MongoClient(url)
+from .metrics import command_listener
 
-# Select the 'food_truck_finder' database from the connected MongoDB server.
-db = db_client['food_truck_finder']
+# Read preferences accepted by the MONGO_READ_PREFERENCE and MONGO_READ_ONLY_PREFERENCE settings.
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST,
+}
 
-# Create a 2dsphere index on the 'location' field of the 'food_truck' collection.
-# This index is used for geo-spatial queries, which allow efficient querying based on geographical proximity.
-db['food_truck'].create_index({"location": '2dsphere'})
\ No newline at end of file
+
+class ConnectionManager:
+    """
+    MongoDB clients configured from the MONGO_* settings, created on first use.
+
+    Nothing connects at import time, so modules declaring collections can be imported
+    without a reachable database. pymongo clients are not fork-safe: a client created
+    before a pre-forking server forked its workers is never used by them, each process
+    creates its own.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._pid = None
+        self._lock = threading.Lock()
+        # Incremented whenever the clients are replaced, so proxies know to resolve again
+        self.generation = 0
+
+    def client_options(self, is_async=False):
+        """
+        Return the keyword arguments of the sync or async client.
+        """
+        prefix = 'MONGO_ASYNC_' if is_async else 'MONGO_'
+        options = {
+            'maxPoolSize': getattr(settings, prefix + 'MAX_POOL_SIZE'),
+            'minPoolSize': getattr(settings, prefix + 'MIN_POOL_SIZE'),
+            'waitQueueTimeoutMS': getattr(settings, prefix + 'WAIT_QUEUE_TIMEOUT_MS'),
+            'connectTimeoutMS': settings.MONGO_CONNECT_TIMEOUT_MS,
+            'serverSelectionTimeoutMS': settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            'socketTimeoutMS': settings.MONGO_SOCKET_TIMEOUT_MS,
+            'readPreference': settings.MONGO_READ_PREFERENCE,
+            'appname': settings.MONGO_APP_NAME,
+        }
+        if settings.METRICS_ENABLED:
+            options['event_listeners'] = [command_listener]
+        return options
+
+    def get_client(self, is_async=False):
+        """
+        Return the sync or async client of the current process, creating it if needed.
+        """
+        pid = os.getpid()
+        client = self._clients.get(is_async) if self._pid == pid else None
+        if client is not None:
+            return client
+        with self._lock:
+            if self._pid != pid:
+                # Forked: the inherited clients hold the sockets of the parent process
+                self._clients = {}
+                self._pid = pid
+                self.generation += 1
+            client = self._clients.get(is_async)
+            if client is None:
+                client_class = AsyncMongoClient if is_async else MongoClient
+                client = self._clients[is_async] = client_class(settings.MONGO_URL, **self.client_options(is_async))
+            return client
+
+    def use_client(self, client, is_async=False):
+        """
+        Use an existing client instead of one created from the settings, e.g. an in-memory
+        stand-in of MongoDB such as mongomock for benchmarks.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._clients = {}
+                self._pid = os.getpid()
+            self._clients[is_async] = client
+            self.generation += 1
+
+    def get_database(self, read_only=False, is_async=False):
+        """
+        Return the application database.
+
+        Args:
+            read_only (bool): Read with MONGO_READ_ONLY_PREFERENCE, e.g. from secondaries for
+                the read-only endpoints, instead of MONGO_READ_PREFERENCE.
+            is_async (bool): Go through the async client of the async views.
+        """
+        client = self.get_client(is_async)
+        if read_only:
+            return client.get_database(
+                settings.MONGO_DB_NAME, read_preference=READ_PREFERENCES[settings.MONGO_READ_ONLY_PREFERENCE]
+            )
+        return client.get_database(settings.MONGO_DB_NAME)
+
+    def close(self):
+        """
+        Close the clients of the current process. They are created again on next use.
+        """
+        with self._lock:
+            clients = list(self._clients.values()) if self._pid == os.getpid() else []
+            self._clients = {}
+            self.generation += 1
+        for client in clients:
+            if not isinstance(client, AsyncMongoClient):
+                client.close()
+
+
+connections = ConnectionManager()
+
+
+class LazyDatabase:
+    """
+    Proxy of the application database, resolved through the connection manager on use.
+    """
+
+    def __init__(self, read_only=False, is_async=False):
+        self.read_only = read_only
+        self.is_async = is_async
+
+    def resolve(self):
+        return connections.get_database(read_only=self.read_only, is_async=self.is_async)
+
+    def __getitem__(self, name):
+        return LazyCollection(self, name)
+
+    def __getattr__(self, attribute):
+        return getattr(self.resolve(), attribute)
+
+
+class LazyCollection:
+    """
+    Proxy of a collection, resolved on first use and again after the clients are replaced.
+
+    Module-level collections are declared with these proxies so importing a module never
+    creates a client, while tests can still patch their methods.
+    """
+
+    def __init__(self, database, name):
+        self.database_proxy = database
+        self.name = name
+        self._collection = None
+        self._resolved_in = None
+
+    def resolve(self):
+        # The generation alone does not tell a fork happened until a client is requested
+        resolved_in = (os.getpid(), connections.generation)
+        if self._collection is None or self._resolved_in != resolved_in:
+            self._collection = self.database_proxy.resolve()[self.name]
+            self._resolved_in = (os.getpid(), connections.generation)
+        return self._collection
+
+    def __getattr__(self, attribute):
+        return getattr(self.resolve(), attribute)
+
+
+# Database for writes and for the reads that must see them
+db = LazyDatabase()
+# Database of the read-only endpoints, read with MONGO_READ_ONLY_PREFERENCE
+read_db = LazyDatabase(read_only=True)
+# Same as read_db through the async client of the async views
+async_read_db = LazyDatabase(read_only=True, is_async=True)
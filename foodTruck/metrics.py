@@ -0,0 +1,354 @@
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from bson import json_util
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Content type of the Prometheus text exposition format
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Fields of the MongoDB commands left out of the slow query log, set by the driver
+DRIVER_FIELDS = ('lsid', '$db', '$clusterTime', '$readPreference', 'txnNumber')
+
+# Maximum length of a command in the slow query log, longer ones are truncated
+SLOW_QUERY_LOG_MAX_LENGTH = 4000
+
+
+class RequestMetrics:
+    """
+    Time spent by the request being served, reported in its Server-Timing header.
+
+    Commands of a request may run in worker threads, e.g. the queries of a batch, so the
+    counters are updated under a lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.started_at = time.perf_counter()
+        self.mongo_commands = 0
+        self.mongo_seconds = 0.0
+        self.mongo_documents = 0
+        # Seconds spent in each phase, e.g. 'serialize' or 'render', MongoDB time excluded
+        self.phases = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def add_command(self, seconds, documents):
+        with self._lock:
+            self.mongo_commands += 1
+            self.mongo_seconds += seconds
+            self.mongo_documents += documents
+
+    def add_phase(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] += seconds
+
+    def server_timing(self, total_seconds):
+        """
+        Return the value of the Server-Timing header, durations in milliseconds.
+        """
+        timings = ['mongo;dur={:.2f};desc="{} commands"'.format(self.mongo_seconds * 1000, self.mongo_commands)]
+        timings += ['{};dur={:.2f}'.format(phase, seconds * 1000) for phase, seconds in sorted(self.phases.items())]
+        timings.append('total;dur={:.2f}'.format(total_seconds * 1000))
+        return ', '.join(timings)
+
+
+_current_request = contextvars.ContextVar('request_metrics', default=None)
+
+
+def current_request():
+    """
+    Return the RequestMetrics of the request being served, or None outside of a request.
+    """
+    return _current_request.get()
+
+
+@contextmanager
+def timed(phase):
+    """
+    Add the time spent in a block to a phase of the current request.
+
+    MongoDB commands run in the block, e.g. while a lazy cursor is read, are not counted
+    in the phase since they are reported on their own.
+    """
+    request = _current_request.get()
+    if request is None:
+        yield
+        return
+    mongo_seconds = request.mongo_seconds
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started_at
+        request.add_phase(phase, max(0.0, elapsed - (request.mongo_seconds - mongo_seconds)))
+
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets, like a Prometheus histogram.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        # Observations by bucket, the last one counts the values above every bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """
+        Return the (bound, count of values less or equal) pairs, ending with '+Inf'.
+        """
+        total, pairs = 0, []
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    return '{' + ','.join('{}="{}"'.format(name, escape_label(value)) for name, value in labels) + '}'
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms of the process, served in the Prometheus text format by /metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # Histograms by label values, see the METRICS dict of render for the label names
+            self.request_durations = {}
+            self.mongo_durations = {}
+            # Counters by label values
+            self.response_bytes = defaultdict(int)
+            self.request_mongo_commands = defaultdict(int)
+            self.request_mongo_seconds = defaultdict(float)
+            self.request_mongo_documents = defaultdict(int)
+            self.request_phase_seconds = defaultdict(float)
+            self.mongo_commands = defaultdict(int)
+            self.mongo_documents = defaultdict(int)
+
+    def _histogram(self, histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(settings.METRICS_LATENCY_BUCKETS)
+        return histogram
+
+    def observe_request(self, endpoint, method, status, seconds, response_bytes, request):
+        with self._lock:
+            self._histogram(self.request_durations, (endpoint, method, status)).observe(seconds)
+            if response_bytes is not None:
+                self.response_bytes[(endpoint,)] += response_bytes
+            self.request_mongo_commands[(endpoint,)] += request.mongo_commands
+            self.request_mongo_seconds[(endpoint,)] += request.mongo_seconds
+            self.request_mongo_documents[(endpoint,)] += request.mongo_documents
+            for phase, phase_seconds in request.phases.items():
+                self.request_phase_seconds[(endpoint, phase)] += phase_seconds
+
+    def observe_command(self, command, outcome, seconds, documents):
+        with self._lock:
+            self._histogram(self.mongo_durations, (command,)).observe(seconds)
+            self.mongo_commands[(command, outcome)] += 1
+            self.mongo_documents[(command,)] += documents
+
+    def render(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+
+        def add_counter(name, help_text, label_names, values):
+            lines.extend(['# HELP {} {}'.format(name, help_text), '# TYPE {} counter'.format(name)])
+            for key, value in sorted(values.items()):
+                lines.append('{}{} {}'.format(name, format_labels(zip(label_names, key)), value))
+
+        def add_histogram(name, help_text, label_names, histograms):
+            lines.extend(['# HELP {} {}'.format(name, help_text), '# TYPE {} histogram'.format(name)])
+            for key, histogram in sorted(histograms.items()):
+                labels = list(zip(label_names, key))
+                for bound, count in histogram.cumulative_counts():
+                    lines.append('{}_bucket{} {}'.format(name, format_labels(labels + [('le', bound)]), count))
+                lines.append('{}_sum{} {}'.format(name, format_labels(labels), histogram.sum))
+                lines.append('{}_count{} {}'.format(name, format_labels(labels), histogram.count))
+
+        with self._lock:
+            add_histogram('foodtruck_request_duration_seconds', 'Duration of the requests.',
+                          ('endpoint', 'method', 'status'), self.request_durations)
+            add_counter('foodtruck_response_bytes_total', 'Bytes of the response bodies, streamed ones excluded.',
+                        ('endpoint',), self.response_bytes)
+            add_counter('foodtruck_request_mongo_commands_total', 'MongoDB commands sent while serving the requests.',
+                        ('endpoint',), self.request_mongo_commands)
+            add_counter('foodtruck_request_mongo_seconds_total', 'Time spent in MongoDB commands while serving the requests.',
+                        ('endpoint',), self.request_mongo_seconds)
+            add_counter('foodtruck_request_mongo_documents_total', 'Documents returned by MongoDB while serving the requests.',
+                        ('endpoint',), self.request_mongo_documents)
+            add_counter('foodtruck_request_phase_seconds_total', 'Time spent serializing and rendering the responses.',
+                        ('endpoint', 'phase'), self.request_phase_seconds)
+            add_histogram('foodtruck_mongo_command_duration_seconds', 'Duration of the MongoDB commands.',
+                          ('command',), self.mongo_durations)
+            add_counter('foodtruck_mongo_commands_total', 'MongoDB commands by outcome.',
+                        ('command', 'outcome'), self.mongo_commands)
+            add_counter('foodtruck_mongo_documents_total', 'Documents returned by the MongoDB commands.',
+                        ('command',), self.mongo_documents)
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def returned_documents(reply):
+    """
+    Return the number of documents in the reply of a find, aggregate or getMore command.
+    """
+    cursor = reply.get('cursor') if isinstance(reply, dict) else None
+    if not isinstance(cursor, dict):
+        return 0
+    return len(cursor.get('firstBatch') or cursor.get('nextBatch') or ())
+
+
+def format_command(command):
+    """
+    Return a command as extended JSON for the slow query log, without the fields set by the driver.
+    """
+    text = json_util.dumps({name: value for name, value in command.items() if name not in DRIVER_FIELDS})
+    if len(text) > SLOW_QUERY_LOG_MAX_LENGTH:
+        return text[:SLOW_QUERY_LOG_MAX_LENGTH] + '...'
+    return text
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """
+    pymongo listener recording the count, duration and returned documents of every command.
+
+    Commands are added to the metrics of the request they were sent for. Commands slower
+    than SLOW_QUERY_THRESHOLD_MS are logged with their filter or pipeline, so the started
+    commands are kept until they complete while the threshold is set.
+    """
+
+    def __init__(self):
+        self._started = {}
+
+    def started(self, event):
+        if settings.SLOW_QUERY_THRESHOLD_MS is not None:
+            self._started[(event.connection_id, event.request_id)] = event.command
+
+    def succeeded(self, event):
+        self._completed(event, 'succeeded', returned_documents(event.reply))
+
+    def failed(self, event):
+        self._completed(event, 'failed', 0)
+
+    def _completed(self, event, outcome, documents):
+        command = self._started.pop((event.connection_id, event.request_id), None)
+        seconds = event.duration_micros / 1e6
+        registry.observe_command(event.command_name, outcome, seconds, documents)
+        request = _current_request.get()
+        if request is not None:
+            request.add_command(seconds, documents)
+
+        threshold = settings.SLOW_QUERY_THRESHOLD_MS
+        if threshold is not None and command is not None and seconds * 1000 >= threshold:
+            logger.warning(
+                'Slow MongoDB %s (%s) took %.1f ms%s: %s',
+                event.command_name, outcome, seconds * 1000,
+                ' for ' + request.path if request is not None else '', format_command(command),
+            )
+
+
+command_listener = CommandMetricsListener()
+
+
+def endpoint_name(request):
+    """
+    Return the route of the URL pattern a request matched, the label of its metrics.
+
+    Routes keep the cardinality of the labels bounded, e.g. every tile request is counted
+    under 'api/foodtruck/tiles/<int:zoom>/<int:x>/<int:y>/'.
+    """
+    match = getattr(request, 'resolver_match', None)
+    return match.route if match is not None else 'unmatched'
+
+
+class MetricsMiddleware:
+    """
+    Record the duration, MongoDB commands and response size of every request.
+
+    With METRICS_SERVER_TIMING, the time spent in MongoDB, serializing and rendering is
+    sent in the Server-Timing header of the response. Streamed bodies are produced after
+    the middleware returns, so their time and size are not included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        token = _current_request.set(RequestMetrics(request.path))
+        try:
+            response = self.get_response(request)
+            return self.record(request, response)
+        finally:
+            _current_request.reset(token)
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+        token = _current_request.set(RequestMetrics(request.path))
+        try:
+            response = await self.get_response(request)
+            return self.record(request, response)
+        finally:
+            _current_request.reset(token)
+
+    @staticmethod
+    def record(request, response):
+        metrics = _current_request.get()
+        total_seconds = time.perf_counter() - metrics.started_at
+        response_bytes = None if response.streaming else len(response.content)
+        registry.observe_request(
+            endpoint_name(request), request.method, response.status_code, total_seconds, response_bytes, metrics
+        )
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = metrics.server_timing(total_seconds)
+        return response
+
+
+def metrics_view(request):
+    """
+    Serve the metrics of the process in the Prometheus text format.
+    """
+    if not settings.METRICS_ENABLED:
+        raise Http404('Metrics are disabled')
+    return HttpResponse(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
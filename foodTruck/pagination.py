@@ -0,0 +1,76 @@
+import base64
+import binascii
+
+from bson import json_util
+from django.conf import settings
+
+
+def encode_cursor(*values):
+    """
+    Encode the sort key of the last item of a page into an opaque cursor.
+
+    Args:
+        *values: Sort key values, e.g. an ObjectId or a (distance, ObjectId) pair.
+
+    Returns:
+        str: URL-safe cursor string.
+    """
+    return base64.urlsafe_b64encode(json_util.dumps(list(values)).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """
+    Decode a cursor built by encode_cursor.
+
+    Args:
+        cursor (str): Cursor string received from a client.
+        size (int): Number of values expected in the sort key.
+
+    Returns:
+        list: The sort key values.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json_util.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (binascii.Error, UnicodeError, ValueError, TypeError) as error:
+        raise ValueError('invalid cursor') from error
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('invalid cursor')
+    return values
+
+
+def page_params(query_params, key_size):
+    """
+    Read the keyset pagination parameters of a request.
+
+    Args:
+        query_params (QueryDict): Query parameters holding the optional 'limit' and 'cursor'.
+        key_size (int): Number of values of the sort key encoded in cursors.
+
+    Returns:
+        tuple: (limit, after) where limit is None if the request is not paginated and
+            after is the decoded sort key of the previous page, or None for the first page.
+
+    Raises:
+        ValueError: If the limit or the cursor is invalid.
+    """
+    limit = query_params.get('limit', None)
+    cursor = query_params.get('cursor', None)
+    if limit is None and cursor is None:
+        return None, None
+    limit = settings.DEFAULT_PAGE_SIZE if limit is None else int(limit)
+    if limit <= 0:
+        raise ValueError('invalid limit')
+    after = decode_cursor(cursor, key_size) if cursor else None
+    return limit, after
+
+
+def split_page(items, limit):
+    """
+    Split the limit + 1 items fetched for a page into the page and a has-more flag.
+    """
+    items = list(items)
+    return items[:limit], len(items) > limit
@@ -0,0 +1,337 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+
+from foodTruck.data_version import aget_data_version, get_data_version
+
+# Query parameters holding coordinates, rounded to RESPONSE_CACHE_COORDINATE_PRECISION decimals
+COORDINATE_PARAMS = ('latitude', 'longitude')
+
+# Query parameters, with the value, making a response depend on the current time. Their
+# requests are keyed on the current minute, the resolution of the open hours filters.
+CLOCK_PARAMS = {'open_now': '1'}
+
+# Query parameters filtering the food trucks by opening time. Clients revalidate the
+# responses filtered by them instead of reusing them for a fixed time.
+OPEN_HOURS_PARAMS = ('open_now', 'open_at')
+
+
+class CacheEntry:
+    """
+    Rendered response stored in the response cache.
+    """
+
+    def __init__(self, body, content_type, etag):
+        self.body = body
+        self.content_type = content_type
+        self.etag = etag
+
+
+class MemoryBackend:
+    """
+    In-process LRU cache of rendered responses with a TTL and a total size limit.
+    """
+
+    def __init__(self, timeout, max_entries, max_bytes):
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, entry = item
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        if len(entry.body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.timeout, entry)
+            self.size += len(entry.body)
+            # Evict the least recently used entries until both limits are met
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, entry = self._entries.pop(key)
+        self.size -= len(entry.body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class DjangoCacheBackend:
+    """
+    Response cache stored in one of the caches of the Django cache framework.
+    """
+
+    def __init__(self, alias, timeout):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, entry):
+        self.cache.set(key, entry, self.timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class ResponseCache:
+    """
+    Cache of the rendered JSON responses of the read endpoints.
+
+    Entries are keyed on the request path, the normalized query parameters and the data
+    version, so bumping the data version invalidates every entry at once. Requests with
+    one of the CLOCK_PARAMS are also keyed on the current minute.
+
+    Requests are served from several threads, so the counters are updated under a lock.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self._backend = None
+        self._backend_settings = None
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        backend_settings = (
+            settings.RESPONSE_CACHE_BACKEND,
+            settings.RESPONSE_CACHE_ALIAS,
+            settings.RESPONSE_CACHE_TIMEOUT,
+            settings.RESPONSE_CACHE_MAX_ENTRIES,
+            settings.RESPONSE_CACHE_MAX_BYTES,
+        )
+        if backend_settings != self._backend_settings:
+            name, alias, timeout, max_entries, max_bytes = backend_settings
+            if name == 'django':
+                self._backend = DjangoCacheBackend(alias, timeout)
+            else:
+                self._backend = MemoryBackend(timeout, max_entries, max_bytes)
+            self._backend_settings = backend_settings
+        return self._backend
+
+    def add_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def add_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def add_bypass(self):
+        with self._lock:
+            self.bypasses += 1
+
+    def stats(self):
+        """
+        Return the hit, miss and bypass counters of the cache.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'bypasses': self.bypasses}
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = self.bypasses = 0
+
+    def key(self, request, version):
+        """
+        Return the cache key of a request for a data version.
+
+        The Accept header is part of the key since it selects the renderer of DRF views.
+        """
+        params = '&'.join('{}={}'.format(name, value) for name, value in sorted(request.GET.lists()))
+        raw_key = '{}|{}|{}?{}'.format(version, request.headers.get('Accept', ''), request.path, params)
+        if any(request.GET.get(name) == value for name, value in CLOCK_PARAMS.items()):
+            raw_key += '|{}'.format(int(timezone.now().timestamp() // 60))
+        return 'response:' + hashlib.sha1(raw_key.encode('utf-8')).hexdigest()
+
+
+response_cache = ResponseCache()
+
+
+def round_coordinates(request):
+    """
+    Round the coordinate query parameters of a request in place.
+
+    Requests for nearby points then share one cache entry, and the view computes the
+    response for the rounded point so the entry is correct for all of them.
+    """
+    params = request.GET.copy()
+    for name in COORDINATE_PARAMS:
+        value = params.get(name)
+        try:
+            params[name] = str(round(float(value), settings.RESPONSE_CACHE_COORDINATE_PRECISION))
+        except (TypeError, ValueError):
+            continue  # Missing or invalid values are left for the view to handle
+    request.GET = params
+
+
+def not_modified(request, etag):
+    """
+    Return True if the client already holds the response with the given ETag.
+    """
+    if_none_match = request.headers.get('If-None-Match', '')
+    return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+
+
+def with_cache_headers(response, request, etag, status):
+    """
+    Add the cache headers to a response, or replace it by a 304 if the client already has it.
+    """
+    if not_modified(request, etag):
+        response = HttpResponseNotModified()
+    response['ETag'] = etag
+    response['X-Cache'] = status
+    return response
+
+
+def cached_response(request, version):
+    """
+    Look a request up in the response cache.
+
+    Returns:
+        tuple: (key, response) where response is the cached response with its cache headers,
+            or None on a miss.
+    """
+    round_coordinates(request)
+    key = response_cache.key(request, version)
+    entry = response_cache.backend.get(key)
+    if entry is None:
+        response_cache.add_miss()
+        return key, None
+    response_cache.add_hit()
+    response = HttpResponse(entry.body, content_type=entry.content_type)
+    return key, with_cache_headers(response, request, entry.etag, 'HIT')
+
+
+def store_response(request, key, response):
+    """
+    Store a response computed after a cache miss, and return it with its cache headers.
+    """
+    if response.status_code != 200 or response.streaming:
+        return response
+    if hasattr(response, 'render'):
+        response.render()
+    etag = '"{}"'.format(hashlib.sha1(response.content).hexdigest())
+    response_cache.backend.set(key, CacheEntry(response.content, response['Content-Type'], etag))
+    return with_cache_headers(response, request, etag, 'MISS')
+
+
+def bypass(response):
+    response_cache.add_bypass()
+    response['X-Cache'] = 'BYPASS'
+    return response
+
+
+def cache_response(view):
+    """
+    Decorate a view so its successful GET responses are served from the response cache.
+
+    Responses carry an ETag and an X-Cache header (HIT, MISS or BYPASS). The cache is
+    bypassed when RESPONSE_CACHE_ENABLED is False or the data version cannot be read.
+    Both sync and async views are supported.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or not settings.RESPONSE_CACHE_ENABLED:
+                return await view(request, *args, **kwargs)
+
+            version = await aget_data_version()
+            if version is None:
+                return bypass(await view(request, *args, **kwargs))
+
+            key, response = cached_response(request, version)
+            if response is not None:
+                return response
+            return store_response(request, key, await view(request, *args, **kwargs))
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'GET' or not settings.RESPONSE_CACHE_ENABLED:
+            return view(request, *args, **kwargs)
+
+        version = get_data_version()
+        if version is None:
+            return bypass(view(request, *args, **kwargs))
+
+        key, response = cached_response(request, version)
+        if response is not None:
+            return response
+        return store_response(request, key, view(request, *args, **kwargs))
+
+    return wrapper
+
+
+def client_cache_control(max_age):
+    """
+    Return a decorator letting clients reuse the responses of a view for max_age seconds.
+
+    Responses to requests with one of the OPEN_HOURS_PARAMS get no-cache instead, so the
+    client revalidates them with their ETag rather than showing trucks that have closed.
+    Both sync and async views are supported.
+    """
+    def add_headers(request, response):
+        if any(name in request.GET for name in OPEN_HOURS_PARAMS):
+            patch_cache_control(response, no_cache=True)
+        else:
+            patch_cache_control(response, max_age=max_age)
+        return response
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                return add_headers(request, await view(request, *args, **kwargs))
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            return add_headers(request, view(request, *args, **kwargs))
+
+        return wrapper
+
+    return decorator
+
+
+def cache_stats(request):
+    """
+    Return the hit, miss and bypass counters of the response cache.
+    """
+    return JsonResponse(dict(response_cache.stats(), backend=settings.RESPONSE_CACHE_BACKEND))
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the time of the other middleware is measured too
+    'foodTruck.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,6 +90,30 @@ DATABASES = {
 }
 
 
+# MongoDB
+# Connection settings of foodTruck/db_connection.py, overridable with environment variables
+# of the same name. Clients are created on first use, so nothing connects at startup.
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/?directConnection=true')
+MONGO_DB_NAME = os.environ.get('MONGO_DB_NAME', 'food_truck_finder')
+MONGO_APP_NAME = os.environ.get('MONGO_APP_NAME', 'foodTruck')
+
+# Connection pool of each process, and milliseconds a query waits for a free connection.
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000))
+
+# Timeouts in milliseconds. Server selection bounds how long a query waits for a reachable
+# server, e.g. while the database is down. No socket timeout is used by default.
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ['MONGO_SOCKET_TIMEOUT_MS']) if 'MONGO_SOCKET_TIMEOUT_MS' in os.environ else None
+
+# Read preference of every query, and of the read-only endpoints. Use 'secondaryPreferred'
+# for the latter to serve them from the secondaries of a replica set.
+MONGO_READ_PREFERENCE = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+MONGO_READ_ONLY_PREFERENCE = os.environ.get('MONGO_READ_ONLY_PREFERENCE', 'primary')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -126,3 +154,133 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Geo engine
+# Engine answering the radius queries of the nearby endpoint. Use
+# 'search.geo.MongoGeoEngine' to send every query to MongoDB instead of the in-memory index.
+GEO_ENGINE = 'search.geo.IndexGeoEngine'
+
+# Size of the in-memory index grid cells, in degrees.
+GEO_INDEX_CELL_SIZE = 0.01
+
+# Number of seconds after which the in-memory index is reloaded from MongoDB.
+GEO_INDEX_TTL = 300
+
+
+# Batch nearby endpoint
+# Maximum number of queries of a POST to /api/foodtruck/nearby/batch/.
+NEARBY_BATCH_MAX_QUERIES = 1000
+
+# Number of queries of a batch sent to MongoDB concurrently when GEO_ENGINE is MongoGeoEngine
+# or the in-memory index is not available.
+NEARBY_BATCH_CONCURRENCY = 8
+
+
+# Aggregation and map endpoints
+# Number of foods returned by /api/foodtruck/facets/ when no food_limit is given.
+FACET_FOOD_LIMIT = 20
+
+# Highest zoom level accepted by /api/foodtruck/density/, /api/foodtruck/tiles/ and clustering.
+MAP_MAX_ZOOM = 22
+
+# Seconds clients may reuse a tile of /api/foodtruck/tiles/ without asking again, sent in
+# the Cache-Control header. Tiles filtered by open_now or open_at are always revalidated.
+TILE_CACHE_MAX_AGE = 300
+
+# Distance in pixels of 256 pixel tiles under which food trucks are merged into a cluster by
+# the cluster=1 parameter of /api/foodtruck/nearby/, /api/foodtruck/bbox/ and the tiles.
+CLUSTER_RADIUS = 40
+
+
+# Columnar export
+# Directory of the Parquet and Arrow files served by /api/foodtruck/export/. A file is kept
+# per table and format, for the current data version only.
+EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'foodTruck-exports'))
+
+# Number of food truck documents read from MongoDB and written per record batch of an export.
+EXPORT_BATCH_SIZE = 5000
+
+
+# Food catalog
+# Number of seconds after which the in-memory food catalog used by the name autocomplete of
+# /api/foods/search/ is reloaded from MongoDB.
+FOOD_CATALOG_TTL = 300
+
+
+# Data version
+# Number of seconds the data version counter bumped by seed_data is cached for. Caches and
+# in-memory indexes built from older data are dropped once the new version is read.
+DATA_VERSION_CHECK_INTERVAL = 1
+
+
+# Open hours
+# Time zone of the open hours of the food trucks, in which open_now and the open_at datetimes
+# without an offset are read.
+OPEN_HOURS_TIME_ZONE = 'America/Los_Angeles'
+
+
+# Streaming responses
+# Number of documents fetched per cursor batch when a response is streamed with stream=json|ndjson.
+STREAM_BATCH_SIZE = 500
+
+
+# Async views
+# Serve the read endpoints with the async views of search/async_views.py and foods/async_views.py.
+# They only pay off under an ASGI server, e.g. uvicorn foodTruck.asgi:application.
+ASYNC_VIEWS = False
+
+# Connection pool of the async MongoDB client used by the async views, the other MONGO_*
+# settings apply to it too.
+MONGO_ASYNC_MAX_POOL_SIZE = int(os.environ.get('MONGO_ASYNC_MAX_POOL_SIZE', 100))
+MONGO_ASYNC_MIN_POOL_SIZE = int(os.environ.get('MONGO_ASYNC_MIN_POOL_SIZE', 0))
+# Milliseconds a request waits for a free connection before failing.
+MONGO_ASYNC_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_ASYNC_WAIT_QUEUE_TIMEOUT_MS', 2000))
+
+
+# Pagination
+# Page size of the list endpoints when a cursor is given without a limit.
+DEFAULT_PAGE_SIZE = 20
+
+
+# Search
+# Number of ids matched by the q parameter of /api/foodtruck/search/ sent per aggregation when
+# the results are capped by a page size or a limit and not ordered by distance.
+SEARCH_ID_BATCH_SIZE = 1000
+
+
+# Metrics
+# Record the latency, MongoDB commands and response size of every request, served in the
+# Prometheus text format by /metrics, see foodTruck/metrics.py. MongoDB commands are only
+# recorded by the clients created while this is enabled.
+METRICS_ENABLED = True
+
+# Send the time spent in MongoDB, serializing and rendering in a Server-Timing response header.
+METRICS_SERVER_TIMING = True
+
+# Upper bounds in seconds of the buckets of the latency histograms.
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# MongoDB commands slower than this many milliseconds are logged with their filter or
+# pipeline by the foodTruck.metrics logger. None disables the slow query log.
+SLOW_QUERY_THRESHOLD_MS = 100
+
+
+# Response cache
+# Cache of the rendered responses of the read endpoints, see foodTruck/response_cache.py.
+RESPONSE_CACHE_ENABLED = True
+
+# 'memory' for an in-process LRU cache, 'django' to use the RESPONSE_CACHE_ALIAS cache of CACHES.
+RESPONSE_CACHE_BACKEND = 'memory'
+RESPONSE_CACHE_ALIAS = 'default'
+
+# Number of seconds a response is cached for.
+RESPONSE_CACHE_TIMEOUT = 60
+
+# Limits of the in-process cache, the least recently used responses are evicted first.
+RESPONSE_CACHE_MAX_ENTRIES = 1024
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Number of decimals latitude and longitude are rounded to, so nearby requests share entries.
+# 4 decimals is about 11 meters.
+RESPONSE_CACHE_COORDINATE_PRECISION = 4
@@ -0,0 +1,40 @@
+from unittest.mock import patch
+from django.test import TestCase
+from foodTruck import data_version
+from foodTruck.data_version import DATA_VERSION_ID, meta_collection
+from foodTruck.response_cache import response_cache
+
+
+class APITestCase(TestCase):
+    """
+    Test case for the API endpoints.
+
+    The data version is mocked so no MongoDB server is needed, and the response cache is
+    emptied so every test sees the responses computed from its own mocks.
+    """
+
+    data_version = 1
+
+    def setUp(self):
+        patcher = patch.object(meta_collection, 'find_one', return_value={'_id': DATA_VERSION_ID, 'value': self.data_version})
+        self.mock_data_version = patcher.start()
+        self.addCleanup(patcher.stop)
+        # Forget the version read by previous tests
+        data_version._checked_at = None
+        response_cache.clear()
+
+
+class FakeAsyncCursor:
+    """
+    Stand-in for the cursors returned by the async MongoDB client, iterating over a list.
+    """
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+
+    async def __aiter__(self):
+        for document in self.documents:
+            yield document
+
+    async def to_list(self, length=None):
+        return self.documents[:length] if length else list(self.documents)
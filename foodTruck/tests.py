@@ -0,0 +1,359 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.test import Client, TestCase, override_settings
+from unittest.mock import MagicMock, patch
+from bson import ObjectId
+from pymongo import ReadPreference
+from pymongo.errors import ServerSelectionTimeoutError
+from foods.views import food_collection
+from search.views import food_truck_collection
+from . import data_version, db_connection
+from .db_connection import ConnectionManager, LazyDatabase
+from .metrics import command_listener, registry
+from .data_version import bump_data_version, get_data_version, meta_collection
+from .pagination import decode_cursor, encode_cursor, page_params, split_page
+from .response_cache import CacheEntry, MemoryBackend, response_cache
+from .testing import APITestCase
+
+
+@patch.object(db_connection, 'MongoClient')
+class ConnectionManagerTest(TestCase):
+    def setUp(self):
+        self.connections = ConnectionManager()
+        patcher = patch.object(db_connection, 'connections', self.connections)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_client_is_created_on_first_use(self, mock_client):
+        collection = LazyDatabase()['food_truck']
+        self.assertEqual(collection.name, 'food_truck')
+        mock_client.assert_not_called()
+
+        collection.find({})
+        collection.count_documents({})
+        # One client is shared by every query of the process
+        mock_client.assert_called_once()
+        mock_client.return_value.get_database.return_value.__getitem__.assert_called_once_with('food_truck')
+
+    @override_settings(MONGO_URL='mongodb://db.example:27017/', MONGO_MAX_POOL_SIZE=7, MONGO_READ_PREFERENCE='nearest')
+    def test_client_options_come_from_settings(self, mock_client):
+        self.connections.get_client()
+        self.assertEqual(mock_client.call_args.args, ('mongodb://db.example:27017/',))
+        self.assertEqual(mock_client.call_args.kwargs['maxPoolSize'], 7)
+        self.assertEqual(mock_client.call_args.kwargs['readPreference'], 'nearest')
+
+    def test_metrics_listener_is_registered_when_enabled(self, mock_client):
+        self.assertEqual(self.connections.client_options()['event_listeners'], [command_listener])
+        with override_settings(METRICS_ENABLED=False):
+            self.assertNotIn('event_listeners', self.connections.client_options(is_async=True))
+
+    @override_settings(MONGO_READ_ONLY_PREFERENCE='secondaryPreferred')
+    def test_read_only_database(self, mock_client):
+        self.connections.get_database(read_only=True)
+        mock_client.return_value.get_database.assert_called_once_with(
+            'food_truck_finder', read_preference=ReadPreference.SECONDARY_PREFERRED
+        )
+
+    def test_new_client_after_fork(self, mock_client):
+        mock_client.side_effect = lambda *args, **kwargs: MagicMock()
+        collection = LazyDatabase()['food_truck']
+        parent_collection = collection.resolve()
+
+        with patch.object(db_connection.os, 'getpid', return_value=-1):
+            self.assertIsNot(collection.resolve(), parent_collection)
+        self.assertEqual(mock_client.call_count, 2)
+
+    def test_use_client(self, mock_client):
+        collection = LazyDatabase()['food_truck']
+        collection.resolve()
+        client = MagicMock()
+
+        self.connections.use_client(client)
+
+        # Collections resolved from the previous client move to the new one
+        self.assertIs(collection.resolve(), client.get_database.return_value.__getitem__.return_value)
+        mock_client.assert_called_once()
+
+
+class PaginationTest(TestCase):
+    def test_cursor_round_trip(self):
+        key = [1234.5678901234567, ObjectId()]
+        cursor = encode_cursor(*key)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor, 2), key)
+
+    def test_invalid_cursors(self):
+        for cursor in ('', '%%%', 'bm90IGpzb24', encode_cursor(ObjectId())):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(ValueError):
+                    decode_cursor(cursor, 2)
+
+    def test_page_params(self):
+        cursor = encode_cursor(ObjectId())
+        self.assertEqual(page_params({}, 1), (None, None))
+        self.assertEqual(page_params({'limit': '5'}, 1), (5, None))
+        # A cursor alone gives pages of DEFAULT_PAGE_SIZE items
+        with override_settings(DEFAULT_PAGE_SIZE=7):
+            self.assertEqual(page_params({'cursor': cursor}, 1), (7, decode_cursor(cursor, 1)))
+        with self.assertRaises(ValueError):
+            page_params({'limit': '-1'}, 1)
+
+    def test_split_page(self):
+        self.assertEqual(split_page(iter(range(3)), 2), ([0, 1], True))
+        self.assertEqual(split_page(range(2), 2), ([0, 1], False))
+
+
+class DataVersionTest(TestCase):
+    def setUp(self):
+        # Forget the version read by previous tests
+        data_version._checked_at = None
+
+    @patch.object(meta_collection, 'find_one')
+    def test_get_data_version_is_cached(self, mock_find_one):
+        mock_find_one.return_value = {'_id': 'data_version', 'value': 3}
+        self.assertEqual(get_data_version(), 3)
+        self.assertEqual(get_data_version(), 3)
+        # MongoDB is read once per DATA_VERSION_CHECK_INTERVAL
+        mock_find_one.assert_called_once()
+
+    @patch.object(meta_collection, 'find_one')
+    def test_get_data_version_defaults(self, mock_find_one):
+        # Never seeded
+        mock_find_one.return_value = None
+        self.assertEqual(get_data_version(), 0)
+
+        # Unreachable database
+        data_version._checked_at = None
+        mock_find_one.side_effect = ServerSelectionTimeoutError('down')
+        with self.assertLogs('foodTruck.data_version', 'WARNING'):
+            self.assertIsNone(get_data_version())
+
+    @patch.object(meta_collection, 'find_one_and_update')
+    def test_bump_data_version(self, mock_find_one_and_update):
+        mock_find_one_and_update.return_value = {'_id': 'data_version', 'value': 4}
+        self.assertEqual(bump_data_version(), 4)
+        self.assertEqual(mock_find_one_and_update.call_args.args[1], {'$inc': {'value': 1}})
+
+
+class MemoryBackendTest(TestCase):
+    def test_least_recently_used_entries_are_evicted(self):
+        backend = MemoryBackend(timeout=60, max_entries=2, max_bytes=1024)
+        backend.set('a', CacheEntry(b'a', 'application/json', '"a"'))
+        backend.set('b', CacheEntry(b'b', 'application/json', '"b"'))
+        backend.get('a')
+        backend.set('c', CacheEntry(b'c', 'application/json', '"c"'))
+        # 'b' was the least recently used entry
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('a').body, b'a')
+        self.assertEqual(len(backend), 2)
+
+    def test_size_limit(self):
+        backend = MemoryBackend(timeout=60, max_entries=10, max_bytes=10)
+        backend.set('a', CacheEntry(b'x' * 6, 'application/json', '"a"'))
+        backend.set('b', CacheEntry(b'x' * 6, 'application/json', '"b"'))
+        backend.set('too big', CacheEntry(b'x' * 11, 'application/json', '"c"'))
+        self.assertIsNone(backend.get('a'))
+        self.assertIsNone(backend.get('too big'))
+        self.assertEqual(backend.size, 6)
+
+    def test_expired_entries_are_dropped(self):
+        backend = MemoryBackend(timeout=60, max_entries=10, max_bytes=1024)
+        backend.set('a', CacheEntry(b'a', 'application/json', '"a"'))
+        with patch.object(time, 'monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(backend.get('a'))
+        self.assertEqual(backend.size, 0)
+
+
+class ResponseCacheTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+
+    @patch.object(food_collection, 'find')
+    def test_identical_requests_are_served_from_cache(self, mock_find):
+        mock_find.return_value = [{'name': 'Tacos'}]
+
+        first = self.client.get('/api/foods/search/', {'name': 'taco'})
+        second = self.client.get('/api/foods/search/', {'name': 'taco'})
+
+        # The second response is the cached body of the first one
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        mock_find.assert_called_once()
+        self.assertEqual(response_cache.stats(), {'hits': 1, 'misses': 1, 'bypasses': 0})
+
+    def test_counters_are_exact_across_threads(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda _: response_cache.add_hit(), range(4000)))
+
+        self.assertEqual(response_cache.stats()['hits'], 4000)
+
+    @patch.object(food_collection, 'find')
+    def test_matching_etag_returns_not_modified(self, mock_find):
+        mock_find.return_value = [{'name': 'Tacos'}]
+        etag = self.client.get('/api/foods/search/')['ETag']
+
+        response = self.client.get('/api/foods/search/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    @patch.object(food_truck_collection, 'find')
+    def test_nearby_coordinates_share_entries(self, mock_find):
+        mock_find.return_value = []
+
+        self.client.get('/api/foodtruck/all/', {'latitude': '37.774901', 'longitude': '-122.419402'})
+        response = self.client.get('/api/foodtruck/all/', {'latitude': '37.77492', 'longitude': '-122.41938'})
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+        response = self.client.get('/api/foodtruck/all/', {'latitude': '37.7751', 'longitude': '-122.41938'})
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    @patch.object(food_collection, 'find')
+    def test_data_version_bump_invalidates_entries(self, mock_find):
+        mock_find.return_value = [{'name': 'Tacos'}]
+        self.client.get('/api/foods/search/')
+
+        # seed_data bumped the version
+        self.mock_data_version.return_value = {'_id': 'data_version', 'value': 2}
+        data_version._checked_at = None
+        mock_find.return_value = [{'name': 'Burritos'}]
+        response = self.client.get('/api/foods/search/')
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['data'], [{'name': 'Burritos'}])
+
+    @patch('django.utils.timezone.now')
+    @patch.object(food_truck_collection, 'find')
+    def test_open_now_entries_expire_with_the_minute(self, mock_find, mock_now):
+        mock_find.return_value = []
+        minute = datetime(2024, 5, 6, 12, 0, tzinfo=dt_timezone.utc)
+
+        mock_now.return_value = minute + timedelta(seconds=10)
+        self.assertEqual(self.client.get('/api/foodtruck/all/', {'open_now': '1'})['X-Cache'], 'MISS')
+        mock_now.return_value = minute + timedelta(seconds=50)
+        self.assertEqual(self.client.get('/api/foodtruck/all/', {'open_now': '1'})['X-Cache'], 'HIT')
+        # The trucks open in the next minute may differ, so the entry is not reused
+        mock_now.return_value = minute + timedelta(seconds=65)
+        self.assertEqual(self.client.get('/api/foodtruck/all/', {'open_now': '1'})['X-Cache'], 'MISS')
+        # Responses that do not depend on the clock are still shared across minutes
+        self.client.get('/api/foodtruck/all/', {'open_now': '0'})
+        mock_now.return_value = minute + timedelta(minutes=5)
+        self.assertEqual(self.client.get('/api/foodtruck/all/', {'open_now': '0'})['X-Cache'], 'HIT')
+
+    @patch.object(food_collection, 'find')
+    def test_unreadable_data_version_bypasses_cache(self, mock_find):
+        mock_find.return_value = []
+        self.mock_data_version.side_effect = ServerSelectionTimeoutError('down')
+
+        with self.assertLogs('foodTruck.data_version', 'WARNING'):
+            response = self.client.get('/api/foods/search/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], 'BYPASS')
+
+    @override_settings(RESPONSE_CACHE_ENABLED=False)
+    @patch.object(food_collection, 'find')
+    def test_disabled_cache(self, mock_find):
+        mock_find.return_value = []
+        self.client.get('/api/foods/search/')
+        response = self.client.get('/api/foods/search/')
+
+        self.assertNotIn('X-Cache', response)
+        self.assertEqual(mock_find.call_count, 2)
+
+    @override_settings(RESPONSE_CACHE_BACKEND='django')
+    @patch.object(food_collection, 'find')
+    def test_django_cache_backend(self, mock_find):
+        mock_find.return_value = [{'name': 'Tacos'}]
+        response_cache.clear()
+
+        self.client.get('/api/foods/search/')
+        response = self.client.get('/api/foods/search/')
+
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.json()['data'], [{'name': 'Tacos'}])
+
+    @patch.object(food_collection, 'find')
+    def test_cache_stats(self, mock_find):
+        mock_find.return_value = []
+        self.client.get('/api/foods/search/')
+
+        response = self.client.get('/api/cache/stats/')
+
+        self.assertEqual(response.json(), {'hits': 0, 'misses': 1, 'bypasses': 0, 'backend': 'memory'})
+
+
+class MetricsTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        registry.reset()
+
+    def send_command(self, command, reply, duration_micros=1500):
+        """
+        Publish the events of a command to the listener, as the MongoDB client does.
+        """
+        started = MagicMock(connection_id=('localhost', 27017), request_id=id(command), command=command)
+        command_listener.started(started)
+        command_listener.succeeded(MagicMock(
+            connection_id=started.connection_id, request_id=started.request_id,
+            command_name=next(iter(command)), duration_micros=duration_micros, reply=reply,
+        ))
+
+    @override_settings(GEO_ENGINE='search.geo.MongoGeoEngine')
+    @patch.object(food_truck_collection, 'find')
+    def test_requests_are_measured(self, mock_find):
+        document = {'applicant': 'tacos', 'location': {'type': 'Point', 'coordinates': [0, 0]}}
+
+        def find(*args, **kwargs):
+            self.send_command({'find': 'food_truck'}, {'cursor': {'firstBatch': [document, document]}})
+            return [document, document]
+
+        mock_find.side_effect = find
+        response = self.client.get('/api/foodtruck/nearby/', {'latitude': 0, 'longitude': 0})
+
+        timings = dict(timing.split(';', 1) for timing in response['Server-Timing'].split(', '))
+        self.assertEqual(timings['mongo'], 'dur=1.50;desc="1 commands"')
+        self.assertEqual(set(timings), {'mongo', 'serialize', 'render', 'total'})
+
+        metrics = self.client.get('/metrics')
+        self.assertEqual(metrics['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = metrics.content.decode('utf-8').splitlines()
+        endpoint = 'endpoint="api/foodtruck/nearby/"'
+        self.assertIn('foodtruck_request_duration_seconds_count{{{},method="GET",status="200"}} 1'.format(endpoint), lines)
+        self.assertIn('foodtruck_request_mongo_commands_total{{{}}} 1'.format(endpoint), lines)
+        self.assertIn('foodtruck_request_mongo_documents_total{{{}}} 2'.format(endpoint), lines)
+        self.assertIn('foodtruck_response_bytes_total{{{}}} {}'.format(endpoint, len(response.content)), lines)
+        self.assertIn('foodtruck_mongo_commands_total{command="find",outcome="succeeded"} 1', lines)
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=10)
+    def test_slow_commands_are_logged_with_their_pipeline(self):
+        pipeline = [{'$match': {'status': 'APPROVED'}}]
+        with self.assertLogs('foodTruck.metrics', 'WARNING') as logs:
+            self.send_command({'aggregate': 'food_truck', 'pipeline': pipeline, 'lsid': {'id': 1}}, {'ok': 1}, duration_micros=25000)
+            self.send_command({'find': 'food_truck'}, {'ok': 1}, duration_micros=5000)
+
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('Slow MongoDB aggregate (succeeded) took 25.0 ms', logs.output[0])
+        self.assertIn('"pipeline": [{"$match": {"status": "APPROVED"}}]', logs.output[0])
+        self.assertNotIn('lsid', logs.output[0])
+
+    @override_settings(METRICS_ENABLED=False)
+    @patch.object(food_collection, 'find')
+    def test_disabled_metrics(self, mock_find):
+        mock_find.return_value = []
+
+        response = self.client.get('/api/foods/search/')
+
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    async def test_async_requests_are_measured(self):
+        response = await self.async_client.get('/api/cache/stats/')
+
+        self.assertIn('total;dur=', response['Server-Timing'])
+        self.assertEqual(registry.request_durations[('api/cache/stats/', 'GET', 200)].count, 1)
@@ -16,10 +16,14 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path,include
+from .metrics import metrics_view
+from .response_cache import cache_stats
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls')),
     path('api/foodtruck/',include('search.urls')),
     path('api/foods/',include('foods.urls')),
+    path('api/cache/stats/', cache_stats, name='cacheStats'),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -0,0 +1,26 @@
+from django.http import JsonResponse
+from django.views import View
+from foodTruck.db_connection import async_read_db
+from .views import FoodQuery, food_catalog
+
+# Get the food collection through the async client
+async_food_collection = async_read_db['food']
+
+
+class SearchFoods(View):
+    """
+    Async variant of views.SearchFoods, taking the same query parameters.
+    """
+
+    async def get(self, request):
+        try:
+            query = FoodQuery(request.GET)
+        except ValueError:
+            return JsonResponse({'error_message': "invalid limit or cursor parameter"}, status=400)
+
+        if query.autocomplete:
+            foods = await food_catalog.acomplete(query.name, async_food_collection, query.limit)
+            return JsonResponse(query.autocomplete_data(foods))
+
+        foods = await async_food_collection.find(query.filter, **query.find_kwargs).to_list()
+        return JsonResponse(query.response_data(foods))
@@ -0,0 +1,221 @@
+import bisect
+import heapq
+import logging
+import threading
+import time
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from pymongo.errors import PyMongoError
+
+from foodTruck.data_version import aget_data_version, get_data_version
+from search.text_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before trying to load the catalog again after a failed load.
+LOAD_RETRY_INTERVAL = 30
+
+# Sorts after every character of a normalized name, which are ASCII
+_KEY_END = '\x7f'
+
+# Number of (query, limit) results memoized per catalog. Short prefixes match the most
+# names and are also the most repeated queries.
+MATCH_CACHE_SIZE = 1024
+
+
+def normalize(name):
+    """
+    Return the key a food name is matched on: lowercased words without accents or punctuation.
+    """
+    return ' '.join(tokenize(name))
+
+
+class FoodCatalog:
+    """
+    In-memory autocomplete index over food names.
+
+    Every suffix of the normalized names is kept in a sorted suffix array, so the names
+    containing a query are a contiguous range found by binary search, and the ones starting
+    with it are the matches on a suffix at offset 0. The array only holds the name and the
+    offset of each suffix, suffixes are sliced from the names while searching. Matches are ranked prefix matches first, then
+    by number of trucks serving the food, most first, then by name.
+    """
+
+    def __init__(self, foods):
+        foods = [food for food in foods if food.get('name')]
+        self.names = [food['name'] for food in foods]
+        self.truck_counts = [int(food.get('truck_count') or 0) for food in foods]
+        # Position of each food in the catalog ordered by popularity, used as ranking key
+        popularity = sorted(range(len(foods)), key=lambda index: (-self.truck_counts[index], self.names[index]))
+        self.ranks = [0] * len(foods)
+        for rank, index in enumerate(popularity):
+            self.ranks[index] = rank
+        self.by_popularity = popularity
+
+        self.keys = [normalize(name) for name in self.names]
+        suffixes = sorted(
+            (
+                (index, offset)
+                for index, key in enumerate(self.keys)
+                for offset in range(len(key))
+                if key[offset] != ' '  # Queries never start with a space
+            ),
+            key=self._suffix,
+        )
+        self.owners = [index for index, _ in suffixes]
+        self.offsets = [offset for _, offset in suffixes]
+        self.positions = range(len(suffixes))
+        self._matches = lru_cache(maxsize=MATCH_CACHE_SIZE)(self._find_matches)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _suffix(self, suffix):
+        index, offset = suffix
+        return self.keys[index][offset:]
+
+    def _suffix_at(self, position):
+        return self.keys[self.owners[position]][self.offsets[position]:]
+
+    def complete(self, query, limit=None):
+        """
+        Return the foods whose name contains a query, best matches first.
+
+        Args:
+            query (str): Partially typed food name.
+            limit (int): Maximum number of foods to return, all of them if None.
+
+        Returns:
+            list: {'name': str, 'truck_count': int} dicts.
+        """
+        matches = self._matches(normalize(query), limit)
+        return [{'name': self.names[index], 'truck_count': self.truck_counts[index]} for index in matches]
+
+    def _find_matches(self, key, limit):
+        """
+        Return the positions of the best limit names containing a normalized key.
+        """
+        if not key:
+            return tuple(self.by_popularity[:limit])
+        start = bisect.bisect_left(self.positions, key, key=self._suffix_at)
+        end = bisect.bisect_left(self.positions, key + _KEY_END, start, key=self._suffix_at)
+        # A name may contain the key several times, it is ranked on its best match
+        best = {}
+        for position in range(start, end):
+            index = self.owners[position]
+            rank = (self.offsets[position] != 0, self.ranks[index])
+            if rank < best.get(index, (True, len(self.names))):
+                best[index] = rank
+        if limit is None:
+            return tuple(sorted(best, key=best.get))
+        return tuple(heapq.nsmallest(limit, best, key=best.get))
+
+
+class FoodCatalogEngine:
+    """
+    Food autocomplete answered from an in-memory FoodCatalog of the food collection.
+
+    The catalog is loaded on first use and reloaded once the data version changes or it is
+    older than FOOD_CATALOG_TTL seconds. While no catalog is available (for example when
+    loading it failed) queries fall back to a regex query against MongoDB.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._catalog = None
+        self._loaded_at = 0.0
+        self._version = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, version):
+        if self._catalog is None or time.monotonic() - self._loaded_at >= settings.FOOD_CATALOG_TTL:
+            return False
+        # Without a readable version, only the TTL applies
+        return version is None or version == self._version
+
+    def load(self):
+        """
+        Build a new catalog from the collection and make it the active one.
+        """
+        version = get_data_version()
+        self._catalog = FoodCatalog(self.collection.find({}, {'name': 1, 'truck_count': 1, '_id': 0}))
+        self._loaded_at = time.monotonic()
+        self._version = version
+        return self._catalog
+
+    def get_catalog(self):
+        """
+        Return a fresh catalog, loading it if needed, or None if it could not be loaded.
+        """
+        if self._is_fresh(get_data_version()):
+            return self._catalog
+        with self._lock:
+            if self._is_fresh(get_data_version()):
+                return self._catalog
+            if self._failed_at is not None and time.monotonic() - self._failed_at < LOAD_RETRY_INTERVAL:
+                return None
+            try:
+                catalog = self.load()
+            except PyMongoError as error:
+                logger.warning('Could not load the food catalog, falling back to MongoDB: %s', error)
+                self._catalog = None
+                self._failed_at = time.monotonic()
+                return None
+            self._failed_at = None
+            return catalog
+
+    async def aget_catalog(self):
+        """
+        Async variant of get_catalog. Only loading the catalog runs in a worker thread.
+        """
+        if self._is_fresh(await aget_data_version()):
+            return self._catalog
+        return await sync_to_async(self.get_catalog, thread_sensitive=False)()
+
+    def invalidate(self):
+        with self._lock:
+            self._catalog = None
+            self._failed_at = None
+
+    @staticmethod
+    def fallback_query(query, limit=None):
+        """
+        Return the find() arguments of the MongoDB query used while no catalog is available.
+
+        Like the catalog, the normalized query is searched in the normalized names, the key
+        stored on every food by seed_data, so 'jalapeno' and 'jalapeño' find 'Jalapeño Poppers'.
+        """
+        key = normalize(query)
+        # Normalized keys only hold lowercase letters, digits and spaces, never regex syntax
+        query_filter = {'key': {'$regex': key}} if key else {}
+        kwargs = {'projection': {'name': 1, 'truck_count': 1, '_id': 0}, 'sort': [('truck_count', -1), ('name', 1)]}
+        if limit is not None:
+            kwargs['limit'] = limit
+        return query_filter, kwargs
+
+    @staticmethod
+    def fallback_results(foods):
+        return [{'name': food['name'], 'truck_count': int(food.get('truck_count') or 0)} for food in foods]
+
+    def complete(self, query, limit=None):
+        """
+        Return the foods whose name contains a query, best matches first.
+        """
+        catalog = self.get_catalog()
+        if catalog is not None:
+            return catalog.complete(query, limit)
+        query_filter, kwargs = self.fallback_query(query, limit)
+        return self.fallback_results(self.collection.find(query_filter, **kwargs))
+
+    async def acomplete(self, query, async_collection, limit=None):
+        """
+        Async variant of complete, falling back to a query through the async client.
+        """
+        catalog = await self.aget_catalog()
+        if catalog is not None:
+            return catalog.complete(query, limit)
+        query_filter, kwargs = self.fallback_query(query, limit)
+        return self.fallback_results(await async_collection.find(query_filter, **kwargs).to_list())
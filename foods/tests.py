@@ -1,8 +1,18 @@
-from django.test import TestCase, Client
+import json
+from bson import ObjectId
+from django.test import Client
 from unittest.mock import patch
-from .views import food_collection
+from pymongo.errors import ServerSelectionTimeoutError
+from foodTruck.pagination import decode_cursor, encode_cursor
+from asgiref.sync import async_to_sync
+from django.test import AsyncRequestFactory
+from foodTruck.testing import APITestCase, FakeAsyncCursor
+from . import async_views
+from .async_views import async_food_collection
+from .catalog import FoodCatalog
+from .views import food_catalog, food_collection
 
-class GetAllFoodsTest(TestCase):
+class GetAllFoodsTest(APITestCase):
     """
     Test case for retrieving all foods.
     """
@@ -11,8 +21,11 @@ class GetAllFoodsTest(TestCase):
         """
         Set up the test case.
         """
+        super().setUp()
         self.mock_return_value = {'name': 'mock food'}
         self.client = Client()
+        # Make sure the food catalog is rebuilt from the mocked collection
+        food_catalog.invalidate()
         
     @patch.object(food_collection, 'find')
     def test_get_all_foods_success(self, mock_find):
@@ -50,3 +63,145 @@ class GetAllFoodsTest(TestCase):
         expected_data = {'count': 0, 'data': []}
         self.assertEqual(response.json(), expected_data)
 
+    @patch.object(food_collection, 'find')
+    def test_search_foods_paginated(self, mock_find):
+        """
+        Test reading a page of foods after a cursor.
+        """
+        ids = [ObjectId() for _ in range(3)]
+        mock_find.return_value = [{'_id': food_id, 'name': 'mock food'} for food_id in ids]
+
+        response = self.client.get('/api/foods/search/', {'name': 'mock', 'limit': 2, 'cursor': encode_cursor(ids[0])})
+
+        body = response.json()
+        self.assertEqual(body['count'], 2)
+        self.assertEqual(decode_cursor(body['next'], 1), [ids[1]])
+        query = {'name': {'$regex': 'mock', '$options': 'i'}, '_id': {'$gt': ids[0]}}
+        mock_find.assert_called_once_with(query, sort=[('_id', 1)], limit=3)
+
+    def test_search_foods_invalid_cursor(self):
+        """
+        Test that malformed cursors are rejected.
+        """
+        response = self.client.get('/api/foods/search/', {'cursor': '!!'})
+        self.assertEqual(response.status_code, 400)
+
+    @patch.object(food_collection, 'find')
+    def test_search_foods_by_name_uses_catalog(self, mock_find):
+        """
+        Test name lookups are answered from the in-memory catalog, ranked.
+        """
+        mock_find.return_value = [
+            {'name': 'Hot Dogs', 'truck_count': 2},
+            {'name': 'Bacon-Wrapped Hot Dogs', 'truck_count': 5},
+            {'name': 'Hotcakes', 'truck_count': 1},
+            {'name': 'Tacos', 'truck_count': 9},
+        ]
+
+        response = self.client.get('/api/foods/search/', {'name': 'hot'})
+        self.assertEqual([food['name'] for food in response.json()['data']], ['Hot Dogs', 'Hotcakes', 'Bacon-Wrapped Hot Dogs'])
+
+        response = self.client.get('/api/foods/search/', {'name': 'hot d', 'limit': 1})
+        self.assertEqual(response.json(), {'count': 1, 'data': [{'name': 'Hot Dogs', 'truck_count': 2}], 'next': None})
+        # The catalog was loaded once, no query is sent per lookup
+        mock_find.assert_called_once()
+
+    @patch.object(food_collection, 'find')
+    def test_search_foods_by_name_falls_back_to_mongo(self, mock_find):
+        """
+        Test name lookups query MongoDB while the catalog cannot be loaded.
+        """
+        mock_find.side_effect = [ServerSelectionTimeoutError('down'), [{'name': 'Hot Dogs', 'truck_count': 2}]]
+
+        with self.assertLogs('foods.catalog', 'WARNING'):
+            response = self.client.get('/api/foods/search/', {'name': 'hot (dogs', 'limit': 5})
+
+        self.assertEqual(response.json()['data'], [{'name': 'Hot Dogs', 'truck_count': 2}])
+        # The normalized query is matched against the normalized names, never as a regex
+        self.assertEqual(mock_find.call_args.args[0], {'key': {'$regex': 'hot dogs'}})
+        self.assertEqual(mock_find.call_args.kwargs['limit'], 5)
+
+    @patch.object(food_collection, 'find')
+    def test_search_foods_by_name_fallback_folds_accents(self, mock_find):
+        """
+        Test the MongoDB fallback matches accented names as the catalog does.
+        """
+        mock_find.side_effect = [ServerSelectionTimeoutError('down'), [{'name': 'Jalapeño Poppers', 'truck_count': 1}]]
+
+        with self.assertLogs('foods.catalog', 'WARNING'):
+            response = self.client.get('/api/foods/search/', {'name': 'Jalapeño'})
+
+        self.assertEqual(response.json()['data'], [{'name': 'Jalapeño Poppers', 'truck_count': 1}])
+        self.assertEqual(mock_find.call_args.args[0], {'key': {'$regex': 'jalapeno'}})
+
+    @patch.object(food_collection, 'find')
+    def test_search_foods_paginated_name_is_escaped(self, mock_find):
+        """
+        Test the name of paginated searches is matched literally.
+        """
+        mock_find.return_value = []
+
+        self.client.get('/api/foods/search/', {'name': 'c++', 'cursor': encode_cursor(ObjectId())})
+
+        self.assertEqual(mock_find.call_args.args[0]['name'], {'$regex': r'c\+\+', '$options': 'i'})
+
+    @patch.object(food_collection, 'find')
+    def test_async_search_foods(self, mock_find):
+        """
+        Test the async view returns the same data as the sync one.
+        """
+        mock_find.return_value = [{'name': 'mock food', 'truck_count': 1}]
+
+        request = AsyncRequestFactory().get('/api/foods/search/', {'name': 'mock'})
+        response = async_to_sync(async_views.SearchFoods.as_view())(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), self.client.get('/api/foods/search/', {'name': 'mock'}).json())
+
+    @patch.object(async_food_collection, 'find')
+    def test_async_search_foods_paginated(self, mock_find):
+        """
+        Test the async view reads pages through the async client.
+        """
+        mock_find.return_value = FakeAsyncCursor([self.mock_return_value])
+
+        request = AsyncRequestFactory().get('/api/foods/search/', {'limit': 5})
+        response = async_to_sync(async_views.SearchFoods.as_view())(request)
+
+        self.assertEqual(json.loads(response.content), {'count': 1, 'data': [self.mock_return_value], 'next': None})
+        mock_find.assert_called_once_with({}, sort=[('_id', 1)], limit=6)
+
+
+class FoodCatalogTest(APITestCase):
+    """
+    Test case for the in-memory food catalog.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.catalog = FoodCatalog([
+            {'name': 'Crêpes', 'truck_count': 1},
+            {'name': 'Sweet Crepes', 'truck_count': 4},
+            {'name': 'Coffee', 'truck_count': 7},
+            {'name': 'Iced Coffee & Tea', 'truck_count': 3},
+            {'name': 'Coffee Cake'},
+            {'name': ''},
+        ])
+
+    def test_prefix_matches_rank_first(self):
+        self.assertEqual(
+            [food['name'] for food in self.catalog.complete('coffee')],
+            ['Coffee', 'Coffee Cake', 'Iced Coffee & Tea'],
+        )
+
+    def test_accents_and_punctuation_are_ignored(self):
+        self.assertEqual([food['name'] for food in self.catalog.complete('CREPE')], ['Crêpes', 'Sweet Crepes'])
+        self.assertEqual([food['name'] for food in self.catalog.complete('coffee tea')], ['Iced Coffee & Tea'])
+
+    def test_infix_matches(self):
+        self.assertEqual([food['name'] for food in self.catalog.complete('ffe', limit=2)], ['Coffee', 'Iced Coffee & Tea'])
+        self.assertEqual(self.catalog.complete('xyz'), [])
+
+    def test_empty_query_returns_most_served_foods(self):
+        self.assertEqual(self.catalog.complete('', limit=2), [{'name': 'Coffee', 'truck_count': 7}, {'name': 'Sweet Crepes', 'truck_count': 4}])
+        self.assertEqual(len(self.catalog), 5)
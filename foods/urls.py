@@ -1,6 +1,11 @@
+from django.conf import settings
 from django.urls import path
-from .views import SearchFoods
+from foodTruck.response_cache import cache_response
+from . import async_views, views
+
+# The async view is served instead of the sync one when ASYNC_VIEWS is enabled
+read_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
-    path('search/', SearchFoods.as_view(),name='searchFoods'),
-]
\ No newline at end of file
+    path('search/', cache_response(read_views.SearchFoods.as_view()),name='searchFoods'),
+]
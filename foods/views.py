@@ -1,10 +1,70 @@
+import re
+from rest_framework import status as http_status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from foodTruck.db_connection import db
+from foodTruck.db_connection import read_db
+from foodTruck.pagination import encode_cursor, page_params, split_page
+from .catalog import FoodCatalogEngine
 from .serializers import FoodSerializer
 
 # Get the MongoDB food collection
-food_collection = db['food']
+food_collection = read_db['food']
+# Type-ahead lookups on food names, answered from memory
+food_catalog = FoodCatalogEngine(food_collection)
+
+
+class FoodQuery:
+    """
+    Parameters of a food search, shared by the sync and async views.
+
+    Raises:
+        ValueError: If the limit or the cursor is invalid.
+    """
+
+    def __init__(self, query_params):
+        self.filter = {}
+        self.name = query_params.get('name', None)
+        if self.name:
+            # Add name filter to the query using regex for case-insensitive search, the
+            # name is escaped so it is matched literally
+            self.filter["name"] = {"$regex": re.escape(self.name), "$options": "i"}
+
+        self.limit, after = page_params(query_params, 1)
+        # Name lookups without a cursor are type-ahead queries answered by the food catalog.
+        # Their results are ranked, so they have a single page.
+        self.autocomplete = bool(self.name) and 'cursor' not in query_params
+        self.find_kwargs = {}
+        if self.limit is not None:
+            if after:
+                # Seek past the previous page through the _id index instead of skipping documents
+                self.filter['_id'] = {'$gt': after[0]}
+            # Fetch one extra food to know whether there is a next page
+            self.find_kwargs = {'sort': [('_id', 1)], 'limit': self.limit + 1}
+
+    def response_data(self, foods):
+        """
+        Build the response data from the foods found with filter and find_kwargs.
+        """
+        if self.limit is None:
+            # Serialize the found foods
+            serializer = FoodSerializer(foods, many=True)
+            # Return count and serialized data
+            return {"count": len(serializer.data), "data": serializer.data}
+
+        foods, has_more = split_page(foods, self.limit)
+        next_cursor = encode_cursor(foods[-1]['_id']) if has_more else None
+        serializer = FoodSerializer(foods, many=True)
+        return {"count": len(serializer.data), "data": serializer.data, "next": next_cursor}
+
+    def autocomplete_data(self, foods):
+        """
+        Build the response data from the foods returned by the food catalog.
+        """
+        data = {"count": len(foods), "data": foods}
+        if self.limit is not None:
+            data["next"] = None
+        return data
+
 
 class SearchFoods(APIView):
     """
@@ -20,20 +80,24 @@ class SearchFoods(APIView):
         Retrieves foods from the database based on the provided query parameters.
 
         Query Parameters:
-            name (str): The name of the food to search for.
+            name (str): The name of the food to search for. Without a cursor, the foods whose
+                name contains it are returned ranked: names starting with it first, then
+                the foods served by the most trucks.
+            limit (int): Page size, in _id order, or the maximum number of ranked foods.
+            cursor (str): 'next' cursor of the previous page.
 
         Returns:
-            Response: JSON response containing the count of foods and the serialized data.
+            Response: JSON response containing the count of foods and the serialized data, and
+                the cursor of the next page (null on the last one) when paginating.
         """
-        query = {}
-        name = request.query_params.get('name', None)
-        if name:
-            # Add name filter to the query using regex for case-insensitive search
-            query["name"] = {"$regex": name, "$options": "i"}
+        try:
+            query = FoodQuery(request.query_params)
+        except ValueError:
+            return Response({'error_message': "invalid limit or cursor parameter"}, status=http_status.HTTP_400_BAD_REQUEST)
+
+        if query.autocomplete:
+            return Response(query.autocomplete_data(food_catalog.complete(query.name, query.limit)))
 
         # Find foods matching the query
-        foods = food_collection.find(query)
-        # Serialize the found foods
-        serializer = FoodSerializer(foods, many=True)
-        # Return response with count and serialized data
-        return Response({"count": len(serializer.data), "data": serializer.data})
+        foods = food_collection.find(query.filter, **query.find_kwargs)
+        return Response(query.response_data(foods))
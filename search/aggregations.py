@@ -0,0 +1,167 @@
+import numpy as np
+
+from .tiles import tile_count, tile_xy, tile_xy_expression
+
+# Fields of the food truck documents counted by value by the facets endpoint, besides the foods.
+FACET_FIELDS = ('status', 'facility_type')
+
+
+def facet_values(counts, limit=None):
+    """
+    Return the {'value': ..., 'count': int} items of the counted values of a facet.
+
+    Values are ordered by count, most first, then by value with None first, which is the
+    order of the {'count': -1, '_id': 1} sort of MongoDB. Values never counted are left out.
+
+    Args:
+        counts (iterable): (value, count) pairs.
+        limit (int): Maximum number of values to return, all of them if None.
+    """
+    items = sorted(
+        ((value, int(count)) for value, count in counts if count),
+        key=lambda item: (-item[1], item[0] is not None, item[0] or ''),
+    )
+    return [{'value': value, 'count': count} for value, count in items[:limit]]
+
+
+class FacetColumns:
+    """
+    Columnar snapshot of the faceted fields of food truck documents.
+
+    Every value of a field is replaced by an integer code, so the counts of the documents
+    selected by a boolean mask are a single bincount per field. Foods are kept as
+    (position, code) pairs of the food_keys of every document.
+    """
+
+    def __init__(self, documents):
+        self.size = len(documents)
+        self.values = {}
+        self.codes = {}
+        for field in FACET_FIELDS:
+            codes = {}
+            self.codes[field] = np.array(
+                [codes.setdefault(document.get(field), len(codes)) for document in documents], dtype=np.intp
+            )
+            self.values[field] = list(codes)
+
+        codes = {}
+        pairs = [
+            (position, codes.setdefault(key, len(codes)))
+            for position, document in enumerate(documents)
+            for key in document.get('food_keys') or ()
+        ]
+        self.foods = list(codes)
+        self.food_positions = np.array([position for position, _ in pairs], dtype=np.intp)
+        self.food_codes = np.array([code for _, code in pairs], dtype=np.intp)
+
+    def counts(self, mask, food_limit=None):
+        """
+        Count the documents selected by a mask by value of every facet.
+
+        Args:
+            mask (numpy.ndarray): Boolean mask over the documents.
+            food_limit (int): Maximum number of foods to return, all of them if None.
+
+        Returns:
+            dict: Number of selected documents as 'count', and the facet_values of the
+                FACET_FIELDS and of the foods as 'facets'.
+        """
+        facets = {}
+        for field in FACET_FIELDS:
+            counts = np.bincount(self.codes[field][mask], minlength=len(self.values[field]))
+            facets[field] = facet_values(zip(self.values[field], counts.tolist()))
+        counts = np.bincount(self.food_codes[mask[self.food_positions]], minlength=len(self.foods))
+        facets['food'] = facet_values(zip(self.foods, counts.tolist()), food_limit)
+        return {'count': int(np.count_nonzero(mask)), 'facets': facets}
+
+
+def facets_pipeline(match, food_limit=None):
+    """
+    Build the aggregation pipeline counting the food trucks matching a filter in one $facet stage.
+
+    Args:
+        match (dict): Filter of the counted food trucks, every truck if empty.
+        food_limit (int): Maximum number of foods to return, all of them if None.
+    """
+    def count_by(field):
+        return [{'$group': {'_id': '$' + field, 'count': {'$sum': 1}}}, {'$sort': {'count': -1, '_id': 1}}]
+
+    foods = [{'$unwind': '$food_keys'}] + count_by('food_keys')
+    if food_limit is not None:
+        foods.append({'$limit': food_limit})
+    facets = {field: count_by(field) for field in FACET_FIELDS}
+    facets.update({'count': [{'$count': 'count'}], 'food': foods})
+    return ([{'$match': match}] if match else []) + [{'$facet': facets}]
+
+
+def facets_result(result):
+    """
+    Build the same result as FacetColumns.counts from the document returned by facets_pipeline.
+    """
+    facets = {
+        field: facet_values((group['_id'], group['count']) for group in result[field])
+        for field in FACET_FIELDS + ('food',)
+    }
+    return {'count': result['count'][0]['count'] if result['count'] else 0, 'facets': facets}
+
+
+def density_cells(longitudes, latitudes, zoom):
+    """
+    Count points by XYZ tile of a zoom level.
+
+    Args:
+        longitudes (numpy.ndarray): Longitudes of the points in degrees.
+        latitudes (numpy.ndarray): Latitudes of the points in degrees.
+        zoom (int): Zoom level of the tiles.
+
+    Returns:
+        list: {'x', 'y', 'count', 'longitude', 'latitude'} dicts of the tiles holding at
+            least one point, in (x, y) order, with the mean coordinates of their points.
+    """
+    xs, ys = tile_xy(longitudes, latitudes, zoom)
+    cells, inverse, counts = np.unique(xs * tile_count(zoom) + ys, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    mean_longitudes = np.bincount(inverse, weights=longitudes) / counts
+    mean_latitudes = np.bincount(inverse, weights=latitudes) / counts
+    cell_xs, cell_ys = np.divmod(cells, tile_count(zoom))
+    return [
+        {'x': x, 'y': y, 'count': count, 'longitude': longitude, 'latitude': latitude}
+        for x, y, count, longitude, latitude in zip(
+            cell_xs.tolist(), cell_ys.tolist(), counts.tolist(), mean_longitudes.tolist(), mean_latitudes.tolist()
+        )
+    ]
+
+
+def density_pipeline(zoom, match):
+    """
+    Build the aggregation pipeline computing the same cells as density_cells in MongoDB.
+
+    Args:
+        zoom (int): Zoom level of the tiles.
+        match (dict): Filter of the counted food trucks, every truck if empty.
+    """
+    return ([{'$match': match}] if match else []) + [
+        {'$group': {
+            '_id': tile_xy_expression(zoom),
+            'count': {'$sum': 1},
+            'longitude': {'$avg': {'$arrayElemAt': ['$location.coordinates', 0]}},
+            'latitude': {'$avg': {'$arrayElemAt': ['$location.coordinates', 1]}},
+        }},
+        {'$sort': {'_id.x': 1, '_id.y': 1}},
+    ]
+
+
+def density_result(cells):
+    """
+    Convert the documents returned by density_pipeline to the cells of density_cells.
+    """
+    return [
+        {
+            'x': int(cell['_id']['x']),
+            'y': int(cell['_id']['y']),
+            'count': cell['count'],
+            'longitude': cell['longitude'],
+            'latitude': cell['latitude'],
+        }
+        for cell in cells
+    ]
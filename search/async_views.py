@@ -0,0 +1,196 @@
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from foodTruck.db_connection import async_read_db
+from foodTruck.metrics import timed
+from .encoders import dumps
+from .geo import get_geo_engine
+from .queries import AllQuery, BBoxQuery, DensityQuery, FacetsQuery, InvalidParameter, NearbyBatchQuery, NearbyQuery, SearchQuery, TileQuery
+from .streaming import json_encoder, streaming_response
+from .text_index import aresolve_query
+from .views import food_truck_collection
+
+# Collections read through the async client
+async_food_truck_collection = async_read_db['food_truck']
+async_food_truck_term_collection = async_read_db['food_truck_terms']
+
+
+def error_response(error):
+    return JsonResponse({'error_message': str(error)}, status=400)
+
+
+def json_response(data):
+    """
+    Return a JSON response with the same body the FastJSONRenderer of the sync views renders.
+    """
+    with timed('render'):
+        return HttpResponse(dumps(data), content_type='application/json')
+
+
+class NearbyFoodTrucks(View):
+    """
+    Async variant of views.NearbyFoodTrucks, taking the same query parameters.
+    """
+
+    async def get(self, request):
+        try:
+            query = NearbyQuery(request.GET)
+        except InvalidParameter as error:
+            return error_response(error)
+
+        geo_engine = get_geo_engine(food_truck_collection, async_food_truck_collection)
+        if query.paginated:
+            # One extra truck is fetched to know whether there is a next page
+            food_trucks = await geo_engine.apage(query.longitude, query.latitude, query.limit + 1, radius=query.radius, after=query.after, filters=query.filters, projection=query.projection)
+        else:
+            food_trucks = await geo_engine.anear(query.longitude, query.latitude, radius=query.radius, filters=query.filters, projection=query.projection)
+        clusters = None
+        if query.cluster_zoom is not None:
+            food_trucks, clusters = await geo_engine.acluster(food_trucks, query.cluster_zoom)
+        return json_response(query.response_data(food_trucks, clusters))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class NearbyFoodTrucksBatch(View):
+    """
+    Async variant of views.NearbyFoodTrucksBatch, taking the same body.
+    """
+
+    async def post(self, request):
+        try:
+            query = NearbyBatchQuery(json.loads(request.body))
+        except ValueError as error:
+            # Covers InvalidParameter and malformed JSON bodies
+            return error_response(error)
+
+        geo_engine = get_geo_engine(food_truck_collection, async_food_truck_collection)
+        return json_response(query.response_data(await geo_engine.anear_many(query.queries, projection=query.encoder.projection)))
+
+
+class BBoxFoodTrucks(View):
+    """
+    Async variant of views.BBoxFoodTrucks, taking the same query parameters.
+    """
+
+    async def get(self, request):
+        try:
+            query = BBoxQuery(request.GET)
+        except InvalidParameter as error:
+            return error_response(error)
+
+        geo_engine = get_geo_engine(food_truck_collection, async_food_truck_collection)
+        food_trucks = await geo_engine.ainside(query.bbox, **query.inside_kwargs())
+        clusters = None
+        if query.cluster_zoom is not None:
+            food_trucks, clusters = await geo_engine.acluster(food_trucks, query.cluster_zoom)
+        return json_response(query.response_data(food_trucks, clusters))
+
+
+class TileFoodTrucks(View):
+    """
+    Async variant of views.TileFoodTrucks, taking the same path and query parameters.
+    """
+
+    async def get(self, request, zoom, x, y):
+        try:
+            query = TileQuery(zoom, x, y, request.GET)
+        except InvalidParameter as error:
+            return error_response(error)
+
+        geo_engine = get_geo_engine(food_truck_collection, async_food_truck_collection)
+        food_trucks = await geo_engine.atile(query.zoom, query.x, query.y, filters=query.filters, projection=query.projection)
+        clusters = None
+        if query.cluster_zoom is not None:
+            food_trucks, clusters = await geo_engine.acluster(food_trucks, query.cluster_zoom)
+        return json_response(query.response_data(food_trucks, clusters))
+
+
+class FoodTruckFacets(View):
+    """
+    Async variant of views.FoodTruckFacets, taking the same query parameters.
+    """
+
+    async def get(self, request):
+        try:
+            query = FacetsQuery(request.GET)
+        except InvalidParameter as error:
+            return error_response(error)
+
+        geo_engine = get_geo_engine(food_truck_collection, async_food_truck_collection)
+        return json_response(await geo_engine.afacets(bbox=query.bbox, filters=query.filters, food_limit=query.food_limit))
+
+
+class FoodTruckDensity(View):
+    """
+    Async variant of views.FoodTruckDensity, taking the same query parameters.
+    """
+
+    async def get(self, request):
+        try:
+            query = DensityQuery(request.GET)
+        except InvalidParameter as error:
+            return error_response(error)
+
+        geo_engine = get_geo_engine(food_truck_collection, async_food_truck_collection)
+        return json_response(query.response_data(await geo_engine.adensity(query.zoom, bbox=query.bbox, filters=query.filters)))
+
+
+class AllFoodTrucks(View):
+    """
+    Async variant of views.AllFoodTrucks, taking the same query parameters.
+    """
+
+    async def get(self, request):
+        try:
+            query = AllQuery(request.GET)
+        except InvalidParameter as error:
+            return error_response(error)
+
+        query_filter, find_kwargs = query.find_args()
+        if query.stream_format:
+            # The count comes from a separate query so the cursor is never materialized
+            count = await async_food_truck_collection.count_documents(query_filter)
+            food_trucks = async_food_truck_collection.find(query_filter, **find_kwargs)
+            return streaming_response(query.stream_format, count, food_trucks, query.encoder.encode)
+        food_trucks = await async_food_truck_collection.find(query_filter, **find_kwargs).to_list()
+        return json_response(query.response_data(food_trucks))
+
+
+class SearchFoodTrucks(View):
+    """
+    Async variant of views.SearchFoodTrucks, taking the same query parameters.
+    """
+
+    async def get(self, request):
+        try:
+            query = SearchQuery(request.GET)
+        except InvalidParameter as error:
+            return error_response(error)
+
+        matched_ids = None
+        if query.search_query:
+            matched_ids = await aresolve_query(async_food_truck_term_collection, query.search_query)
+
+        if query.streams_from_cursor:
+            # Count with a separate aggregation, then stream the documents from the cursor
+            pipeline = query.pipeline(matched_ids)
+            counted = await (await async_food_truck_collection.aggregate(query.count_pipeline(pipeline))).to_list()
+            count = counted[0]['count'] if counted else 0
+            result = await async_food_truck_collection.aggregate(pipeline, batchSize=settings.STREAM_BATCH_SIZE)
+            return streaming_response(query.stream_format, count, result, json_encoder(DjangoJSONEncoder))
+
+        result = []
+        for pipeline in query.pipelines(matched_ids):
+            result += await (await async_food_truck_collection.aggregate(pipeline)).to_list()
+            if query.result_limit is not None and len(result) >= query.result_limit:
+                break
+        result = query.rank(result[:query.result_limit])
+        if query.stream_format:
+            return streaming_response(query.stream_format, len(result), result, json_encoder(DjangoJSONEncoder))
+        with timed('render'):
+            return JsonResponse(query.response_data(result), safe=False)
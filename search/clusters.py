@@ -0,0 +1,164 @@
+from collections import defaultdict
+
+import numpy as np
+
+from .tiles import TILE_SIZE, mercator_xy, tile_count
+
+
+def merge_clusters(xs, ys, weights, distance):
+    """
+    Merge the clusters of a zoom level into the clusters of the zoom level below.
+
+    Clusters are visited in order, and each one not merged yet absorbs the clusters not
+    merged yet within distance of it. Only clusters with a neighbor in the 3x3 grid cells
+    of the merge distance around them are visited one at a time, the isolated ones are
+    kept as they are in a single vectorized pass.
+
+    Args:
+        xs (numpy.ndarray): Web Mercator x of the clusters, see tiles.mercator_xy.
+        ys (numpy.ndarray): Web Mercator y of the clusters.
+        weights (numpy.ndarray): Number of points of the clusters.
+        distance (float): Merge distance, in Web Mercator units.
+
+    Returns:
+        tuple: The label of the merged cluster of each cluster, labels being numbered in
+            the order of their first cluster, and the xs, ys and weights of the merged
+            clusters, placed at the weighted centroid of their clusters.
+    """
+    if not len(xs):
+        return np.zeros(0, dtype=np.int32), xs, ys, weights
+    cell_xs = np.floor(xs / distance).astype(np.int64)
+    cell_ys = np.floor(ys / distance).astype(np.int64)
+    # One more column than cells, so the cells around one never wrap to another row
+    stride = int(cell_ys.max()) + 3
+    keys = (cell_xs + 1) * stride + cell_ys + 1
+    cells, cell_counts = np.unique(keys, return_counts=True)
+    neighbors = np.zeros(len(xs), dtype=np.int64)
+    offsets = [dx * stride + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+    for offset in offsets:
+        found = np.clip(np.searchsorted(cells, keys + offset), 0, len(cells) - 1)
+        neighbors += np.where(cells[found] == keys + offset, cell_counts[found], 0)
+
+    # Each cluster is first labeled with the position of the cluster absorbing it
+    leaders = np.arange(len(xs))
+    crowded = np.flatnonzero(neighbors > 1)
+    grid = defaultdict(list)
+    for position, key in zip(crowded.tolist(), keys[crowded].tolist()):
+        grid[key].append(position)
+    # The groups are small, plain Python is faster than NumPy on them
+    x_list, y_list = xs.tolist(), ys.tolist()
+    merged = set()
+    squared_distance = distance * distance
+    for position, key in zip(crowded.tolist(), keys[crowded].tolist()):
+        if position in merged:
+            continue
+        x, y = x_list[position], y_list[position]
+        for offset in offsets:
+            for candidate in grid.get(key + offset, ()):
+                if candidate not in merged and (x_list[candidate] - x) ** 2 + (y_list[candidate] - y) ** 2 <= squared_distance:
+                    # Clusters before this one were all merged already, so it leads its group
+                    leaders[candidate] = position
+                    merged.add(candidate)
+
+    _, labels = np.unique(leaders, return_inverse=True)
+    labels = labels.reshape(-1).astype(np.int32)
+    merged_weights = np.bincount(labels, weights=weights)
+    merged_xs = np.bincount(labels, weights=xs * weights) / merged_weights
+    merged_ys = np.bincount(labels, weights=ys * weights) / merged_weights
+    return labels, merged_xs, merged_ys, merged_weights
+
+
+class ClusterIndex:
+    """
+    Hierarchical clusters of points, for every zoom level from max_zoom down to min_zoom.
+
+    At each zoom level, the clusters of the level above closer than radius pixels are
+    merged, as done by supercluster, so a cluster of a zoom level is always the union of
+    clusters of the levels above. Points at the same coordinates are merged at every zoom
+    level. The cluster label of every point is kept for each zoom level, and a query only
+    groups the points it matched by label.
+
+    Args:
+        longitudes (numpy.ndarray): Longitudes of the points in degrees.
+        latitudes (numpy.ndarray): Latitudes of the points in degrees.
+        radius (float): Merge distance in pixels of TILE_SIZE pixel tiles.
+        max_zoom (int): Highest zoom level clustered.
+        min_zoom (int): Lowest zoom level clustered.
+    """
+
+    def __init__(self, longitudes, latitudes, radius, max_zoom, min_zoom=0):
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.labels = {}
+        xs, ys = mercator_xy(self.longitudes, self.latitudes)
+        weights = np.ones(len(xs))
+        # Every point starts as its own cluster
+        labels = np.arange(len(xs), dtype=np.int32)
+        for zoom in range(max_zoom, min_zoom - 1, -1):
+            parents, xs, ys, weights = merge_clusters(xs, ys, weights, radius / (TILE_SIZE * tile_count(zoom)))
+            labels = self.labels[zoom] = parents[labels]
+
+    def group(self, positions, zoom):
+        """
+        Group points by cluster of a zoom level.
+
+        Args:
+            positions (numpy.ndarray): Positions of the grouped points, e.g. the matches of
+                a query in the order of its results.
+            zoom (int): Zoom level of the clusters.
+
+        Returns:
+            tuple: The indexes in positions of the points alone in their cluster, and
+                {'count', 'longitude', 'latitude'} dicts of the clusters of several points,
+                with the mean coordinates of their points, in the order of their first point.
+        """
+        if not len(positions):
+            return [], []
+        _, first, inverse, counts = np.unique(
+            self.labels[zoom][positions], return_index=True, return_inverse=True, return_counts=True
+        )
+        inverse = inverse.reshape(-1)
+        mean_longitudes = np.bincount(inverse, weights=self.longitudes[positions]) / counts
+        mean_latitudes = np.bincount(inverse, weights=self.latitudes[positions]) / counts
+        alone = np.flatnonzero(counts[inverse] == 1)
+        grouped = np.flatnonzero(counts > 1)
+        grouped = grouped[np.argsort(first[grouped], kind='stable')]
+        clusters = [
+            {'count': count, 'longitude': longitude, 'latitude': latitude}
+            for count, longitude, latitude in zip(
+                counts[grouped].tolist(), mean_longitudes[grouped].tolist(), mean_latitudes[grouped].tolist()
+            )
+        ]
+        return alone.tolist(), clusters
+
+
+def cluster_documents(documents, zoom, radius, max_zoom):
+    """
+    Cluster food truck documents at a zoom level, building their clusters on the fly.
+
+    Documents without a usable point are never clustered.
+
+    Args:
+        documents (list): Food truck documents, in the order of the results.
+        zoom (int): Zoom level of the clusters.
+        radius (float): Merge distance in pixels, see ClusterIndex.
+        max_zoom (int): Highest zoom level clustered, see ClusterIndex.
+
+    Returns:
+        tuple: The documents alone in their cluster, in order, and the clusters of the
+            others, see ClusterIndex.group.
+    """
+    located, points, alone = [], [], []
+    for position, document in enumerate(documents):
+        try:
+            longitude, latitude = document['location']['coordinates']
+            points.append((float(longitude), float(latitude)))
+        except (KeyError, TypeError, ValueError):
+            alone.append(position)
+            continue
+        located.append(position)
+    points = np.array(points, dtype=np.float64).reshape(-1, 2)
+    index = ClusterIndex(points[:, 0], points[:, 1], radius, max_zoom, min_zoom=zoom)
+    located_alone, clusters = index.group(np.arange(len(located)), zoom)
+    alone = sorted(alone + [located[position] for position in located_alone])
+    return [documents[position] for position in alone], clusters
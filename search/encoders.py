@@ -0,0 +1,177 @@
+import json
+from datetime import date, datetime
+
+from bson import ObjectId
+from django.conf import settings
+from django.utils import timezone
+from mongoengine import fields
+from rest_framework.renderers import JSONRenderer
+
+from foodTruck.metrics import timed
+from .models import FoodTruck
+
+try:
+    import orjson
+except ImportError:  # Optional, the standard json module is used without it
+    orjson = None
+
+
+def format_datetime(value):
+    """
+    Format a datetime like the DateTimeField of DRF does, e.g. '2024-01-02T03:04:05Z'.
+
+    pymongo returns naive datetimes in UTC, which are made aware in the time zone of the
+    settings. The API never activates another time zone, so it is the current one DRF uses.
+    """
+    if settings.USE_TZ:
+        # Cached, unlike get_current_timezone() which reads a context local on every call
+        default_timezone = timezone.get_default_timezone()
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=default_timezone)
+        else:
+            value = value.astimezone(default_timezone)
+    text = value.isoformat()
+    return text[:-6] + 'Z' if text.endswith('+00:00') else text
+
+
+def geojson_point(value):
+    """
+    Return a GeoJSON point, from either a GeoJSON dict or a [longitude, latitude] pair.
+    """
+    if isinstance(value, dict):
+        return value
+    return {'type': 'Point', 'coordinates': list(value)}
+
+
+def default(value):
+    """
+    Convert the BSON values nested in dict fields to JSON compatible values.
+    """
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return format_datetime(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+def field_converter(field):
+    """
+    Return the function converting the raw MongoDB value of a model field for a response.
+    """
+    if isinstance(field, fields.StringField):
+        return str
+    if isinstance(field, fields.ObjectIdField):
+        return str
+    if isinstance(field, fields.DateTimeField):
+        return format_datetime
+    if isinstance(field, fields.PointField):
+        return geojson_point
+    if isinstance(field, fields.ListField) and field.field is not None:
+        convert = field_converter(field.field)
+        return lambda value: [None if item is None else convert(item) for item in value]
+    if isinstance(field, fields.DictField):
+        return lambda value: {str(key): item for key, item in value.items()}
+    return lambda value: value
+
+
+class DocumentEncoder:
+    """
+    Read-only encoder of raw pymongo documents, producing the same output as the DRF
+    DocumentSerializer of the model.
+
+    The fields of the model and their converters are resolved once, so encoding a document
+    is a single pass over its fields without the per-field machinery of DRF serializers.
+    Missing fields are left out and the primary key is not returned, like DocumentSerializer
+    does for dicts, unless it is one of the selected fields.
+
+    Args:
+        document_class (type): The mongoengine Document class of the documents.
+        fields (iterable): Names of the model fields to return, every field but the primary
+            key if None.
+    """
+
+    def __init__(self, document_class, fields=None):
+        self.document_class = document_class
+        self.converters = [
+            (name, field.db_field, field_converter(field))
+            for name, field in document_class._fields.items()
+            if (field.db_field != '_id' if fields is None else name in fields)
+        ]
+        self.fields = tuple(name for name, _, _ in self.converters)
+        self._selections = {}
+
+    @property
+    def projection(self):
+        """
+        Projection reading only the selected fields, _id is kept for pagination cursors.
+
+        A new dict is returned on every access, as some clients modify the projection they
+        are given, e.g. mongomock pops its _id.
+        """
+        return {db_field: 1 for _, db_field, _ in self.converters}
+
+    def select(self, fields):
+        """
+        Return the encoder of a subset of the model fields, in the order of the model.
+
+        Encoders are created once per set of fields.
+
+        Args:
+            fields (iterable): Names of the model fields to return.
+        """
+        key = frozenset(fields)
+        encoder = self._selections.get(key)
+        if encoder is None:
+            encoder = self._selections[key] = DocumentEncoder(self.document_class, key)
+        return encoder
+
+    def to_dict(self, document):
+        """
+        Convert a raw document to a dict of JSON compatible values.
+        """
+        data = {}
+        for name, db_field, convert in self.converters:
+            if db_field in document:
+                value = document[db_field]
+                data[name] = None if value is None else convert(value)
+        return data
+
+    def to_list(self, documents):
+        with timed('serialize'):
+            return [self.to_dict(document) for document in documents]
+
+    def encode(self, document):
+        """
+        Encode a raw document to JSON bytes.
+        """
+        return dumps(self.to_dict(document))
+
+
+def dumps(data):
+    """
+    Encode data to compact JSON bytes, with orjson when it is installed.
+    """
+    if orjson is not None:
+        # Datetimes go through default for the same format as the DRF serializer
+        return orjson.dumps(data, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(data, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON renderer using orjson when it is installed, for data built by DocumentEncoder.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render'):
+            if orjson is None or data is None:
+                return super().render(data, accepted_media_type, renderer_context)
+            # Indented output was asked for through the Accept header, left to the stock renderer
+            if self.get_indent(accepted_media_type, renderer_context or {}):
+                return super().render(data, accepted_media_type, renderer_context)
+            return dumps(data)
+
+
+food_truck_encoder = DocumentEncoder(FoodTruck)
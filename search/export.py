@@ -0,0 +1,230 @@
+import glob
+import os
+import tempfile
+import threading
+from functools import cache
+
+from django.conf import settings
+from django.http import FileResponse, JsonResponse
+
+from foodTruck.data_version import get_data_version
+from .ingest import batched, food_key
+from .open_hours import open_intervals
+from .views import food_truck_collection
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # Optional, the export is unavailable without it
+    pa = None
+
+# Formats of the export, with their content type and file extension
+EXPORT_FORMATS = {
+    'parquet': ('application/vnd.apache.parquet', '.parquet'),
+    'arrow': ('application/vnd.apache.arrow.file', '.arrow'),
+}
+
+# Projection of the food truck documents read by each table of the export
+EXPORT_PROJECTIONS = {
+    'trucks': {
+        'location_id': 1, 'permit': 1, 'applicant': 1, 'facility_type': 1, 'location_description': 1,
+        'address': 1, 'status': 1, 'approved_at': 1, 'location': 1, 'food_items': 1,
+    },
+    'food_items': {'food_items': 1},
+    'open_intervals': {'open_intervals': 1, 'open_hours': 1},
+}
+
+_build_lock = threading.Lock()
+
+
+@cache
+def table_schema(table):
+    """
+    Return the Arrow schema of a table of the export.
+    """
+    if table == 'trucks':
+        return pa.schema([
+            ('id', pa.string()),
+            ('location_id', pa.string()),
+            ('permit', pa.string()),
+            ('applicant', pa.string()),
+            ('facility_type', pa.string()),
+            ('location_description', pa.string()),
+            ('address', pa.string()),
+            ('status', pa.string()),
+            ('approved_at', pa.timestamp('ms')),
+            ('longitude', pa.float64()),
+            ('latitude', pa.float64()),
+            ('food_items', pa.list_(pa.string())),
+        ])
+    if table == 'food_items':
+        return pa.schema([('truck_id', pa.string()), ('food_item', pa.string()), ('food_key', pa.string())])
+    return pa.schema([('truck_id', pa.string()), ('start', pa.int32()), ('end', pa.int32())])
+
+
+def truck_rows(document):
+    """
+    Yield the row of a food truck in the trucks table, with its location flattened.
+    """
+    try:
+        longitude, latitude = document['location']['coordinates']
+    except (KeyError, TypeError, ValueError):
+        longitude = latitude = None
+    yield {
+        'id': str(document['_id']),
+        'location_id': document.get('location_id'),
+        'permit': document.get('permit'),
+        'applicant': document.get('applicant'),
+        'facility_type': document.get('facility_type'),
+        'location_description': document.get('location_description'),
+        'address': document.get('address'),
+        'status': document.get('status'),
+        'approved_at': document.get('approved_at'),
+        'longitude': longitude,
+        'latitude': latitude,
+        'food_items': document.get('food_items') or [],
+    }
+
+
+def food_item_rows(document):
+    """
+    Yield a row of the food_items table for each food item of a food truck.
+    """
+    for food_item in document.get('food_items') or []:
+        yield {'truck_id': str(document['_id']), 'food_item': food_item, 'food_key': food_key(food_item)}
+
+
+def open_interval_rows(document):
+    """
+    Yield a row of the open_intervals table for each minute-of-week interval of a food truck.
+    """
+    intervals = document.get('open_intervals')
+    if intervals is None:
+        # Seeded before open_intervals existed
+        intervals = open_intervals(document.get('open_hours') or {})
+    for interval in intervals:
+        yield {'truck_id': str(document['_id']), 'start': interval['start'], 'end': interval['end']}
+
+
+# Function turning a food truck document into the rows of each table of the export
+EXPORT_TABLES = {
+    'trucks': truck_rows,
+    'food_items': food_item_rows,
+    'open_intervals': open_interval_rows,
+}
+
+
+def open_writer(sink, schema, file_format):
+    if file_format == 'parquet':
+        return pa.parquet.ParquetWriter(sink, schema)
+    return pa.ipc.new_file(sink, schema)
+
+
+def write_export(collection, sink, table, file_format, batch_size=None):
+    """
+    Write a table of the food truck collection to a Parquet or Arrow IPC file.
+
+    Documents are read from the cursor and written batch_size at a time, one record batch
+    (a row group in Parquet) per batch, so memory use does not grow with the collection.
+
+    Args:
+        collection (Collection): The food truck collection.
+        sink (str or file): Path or binary file the export is written to.
+        table (str): 'trucks', one row per food truck, 'food_items', one row per food item
+            of each truck, or 'open_intervals', one row per minute-of-week open interval of
+            each truck.
+        file_format (str): 'parquet' or 'arrow'.
+        batch_size (int): Number of documents per batch, EXPORT_BATCH_SIZE if None.
+
+    Returns:
+        int: Number of rows written.
+    """
+    batch_size = batch_size or settings.EXPORT_BATCH_SIZE
+    schema = table_schema(table)
+    rows_of = EXPORT_TABLES[table]
+    documents = collection.find({}, projection=EXPORT_PROJECTIONS[table], sort=[('_id', 1)], batch_size=batch_size)
+    row_count = 0
+    writer = open_writer(sink, schema, file_format)
+    try:
+        for batch in batched(documents, batch_size):
+            rows = [row for document in batch for row in rows_of(document)]
+            if rows:
+                writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=schema))
+                row_count += len(rows)
+    finally:
+        writer.close()
+    return row_count
+
+
+def export_path(table, file_format, version):
+    """
+    Return the path of the cached export of a table at a data version.
+    """
+    name = 'food_truck-{}-v{}{}'.format(table, version, EXPORT_FORMATS[file_format][1])
+    return os.path.join(settings.EXPORT_CACHE_DIR, name)
+
+
+def cached_export(collection, table, file_format, version):
+    """
+    Return the path of the export of a table at a data version, writing it if needed.
+
+    The file is written under a temporary name and renamed once complete, so concurrent
+    downloads never read a partial file. Exports of older data versions are deleted.
+    """
+    path = export_path(table, file_format, version)
+    if os.path.exists(path):
+        return path
+    with _build_lock:
+        if os.path.exists(path):
+            return path
+        os.makedirs(settings.EXPORT_CACHE_DIR, exist_ok=True)
+        temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            write_export(collection, temporary_path, table, file_format)
+            os.replace(temporary_path, path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        for stale_path in glob.glob(export_path(table, file_format, '*')):
+            if stale_path != path:
+                try:
+                    os.remove(stale_path)
+                except FileNotFoundError:
+                    pass  # Removed by another process
+    return path
+
+
+def export_view(request):
+    """
+    Download a table of the food truck collection as a Parquet or Arrow IPC file.
+
+    Expected Query Parameters:
+        - table: 'trucks' (default), 'food_items' or 'open_intervals', see write_export.
+        - format: 'parquet' (default) or 'arrow'.
+
+    The file of the current data version is written on the first download and served from
+    EXPORT_CACHE_DIR afterwards, until seed_data bumps the data version.
+    """
+    table = request.GET.get('table', 'trucks')
+    file_format = request.GET.get('format', 'parquet')
+    if table not in EXPORT_TABLES:
+        return JsonResponse({'error_message': 'invalid table parameter'}, status=400)
+    if file_format not in EXPORT_FORMATS:
+        return JsonResponse({'error_message': 'invalid format parameter'}, status=400)
+    if pa is None:
+        return JsonResponse({'error_message': 'pyarrow is not installed'}, status=501)
+
+    content_type, extension = EXPORT_FORMATS[file_format]
+    version = get_data_version()
+    if version is None:
+        # Without a data version the export cannot be cached, it is written for this request only
+        file = tempfile.TemporaryFile()
+        write_export(food_truck_collection, file, table, file_format)
+        file.seek(0)
+    else:
+        file = open(cached_export(food_truck_collection, table, file_format, version), 'rb')
+    response = FileResponse(file, as_attachment=True, filename='food_truck-{}{}'.format(table, extension), content_type=content_type)
+    if version is not None:
+        response['X-Data-Version'] = str(version)
+    return response
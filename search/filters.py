@@ -0,0 +1,44 @@
+import numpy as np
+
+from .open_hours import open_filter
+
+
+class TruckFilters:
+    """
+    Filters of the food truck endpoints, applied by MongoDB or by the in-memory geo index.
+
+    Both select the same trucks: the MongoDB query reads the indexed open_intervals and
+    food_keys fields, and the mask reads the same fields of the documents of the index.
+    """
+
+    def __init__(self, open_at=None, food=None):
+        # Minute of the week the trucks must be open at
+        self.open_at = open_at
+        # Normalized food key, see search.ingest.food_key
+        self.food = food
+
+    def __bool__(self):
+        return self.open_at is not None or self.food is not None
+
+    def query(self):
+        """
+        Return the MongoDB filter of the food trucks matching the filters.
+        """
+        query = {}
+        if self.open_at is not None:
+            query.update(open_filter(self.open_at))
+        if self.food is not None:
+            # Equality on the multikey index of food_keys
+            query['food_keys'] = self.food
+        return query
+
+    def mask(self, store):
+        """
+        Return a boolean mask over the documents of a CoordinateStore matching the filters.
+        """
+        mask = np.ones(len(store), dtype=bool)
+        if self.open_at is not None:
+            mask &= store.open_hours.open_mask(self.open_at)
+        if self.food is not None:
+            mask &= store.food_mask(self.food)
+        return mask
@@ -0,0 +1,1021 @@
+import asyncio
+import bisect
+import contextvars
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+from pymongo.errors import PyMongoError
+
+from foodTruck.data_version import aget_data_version, get_data_version
+from .aggregations import FacetColumns, density_cells, density_pipeline, density_result, facets_pipeline, facets_result
+from .clusters import ClusterIndex, cluster_documents
+from .open_hours import OpenHoursIndex
+from .tiles import tile_search_bbox, tile_xy, tile_xy_expression
+
+logger = logging.getLogger(__name__)
+
+# Earth radius used by MongoDB for spherical ($near / $geoNear) distances, in meters.
+EARTH_RADIUS_METERS = 6378100.0
+
+# Seconds to wait before trying to load an index again after a failed load.
+LOAD_RETRY_INTERVAL = 30
+
+# Widest box, in degrees of longitude, matched through a polygon on the 2dsphere index.
+# Polygons must fit in a hemisphere, wider boxes are matched on the coordinates alone.
+MAX_POLYGON_WIDTH = 90
+
+# Degrees added around the polygons covering boxes, for the rounding of their edges.
+POLYGON_MARGIN = 1e-6
+
+
+def haversine(longitude1, latitude1, longitude2, latitude2):
+    """
+    Compute the great-circle distance between two points.
+
+    Args:
+        longitude1 (float): Longitude of the first point in degrees.
+        latitude1 (float): Latitude of the first point in degrees.
+        longitude2 (float): Longitude of the second point in degrees.
+        latitude2 (float): Latitude of the second point in degrees.
+
+    Returns:
+        float: Distance between the two points in meters.
+    """
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    delta_phi = phi2 - phi1
+    delta_lambda = math.radians(longitude2 - longitude1)
+    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_many(longitude, latitude, longitudes, latitudes):
+    """
+    Compute the great-circle distances between a point and many points in one vectorized pass.
+
+    Args:
+        longitude (float): Longitude of the reference point in degrees.
+        latitude (float): Latitude of the reference point in degrees.
+        longitudes (numpy.ndarray): Longitudes of the other points in degrees.
+        latitudes (numpy.ndarray): Latitudes of the other points in degrees.
+
+    Returns:
+        numpy.ndarray: Distances to the reference point in meters.
+    """
+    phi = math.radians(latitude)
+    phis = np.radians(latitudes)
+    a = np.sin((phis - phi) / 2) ** 2 + math.cos(phi) * np.cos(phis) * np.sin(np.radians(longitudes - longitude) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def top_k(distances, k):
+    """
+    Return the positions of the k smallest distances, nearest first.
+
+    Uses argpartition so only the selected distances are fully sorted. Ties are broken by position.
+    """
+    if k is None or k >= len(distances):
+        return np.argsort(distances, kind='stable')
+    if k <= 0:
+        return np.array([], dtype=np.intp)
+    threshold = distances[np.argpartition(distances, k - 1)[k - 1]]
+    # argpartition picks arbitrary positions among ties at the cut, so every position up to
+    # the k-th distance is kept and sorted by (distance, position) for a deterministic order
+    candidates = np.flatnonzero(distances <= threshold)
+    return candidates[np.lexsort((candidates, distances[candidates]))][:k]
+
+
+class CoordinateStore:
+    """
+    Columnar store of the GeoJSON points of food truck documents.
+
+    Longitudes and latitudes are kept in NumPy arrays aligned with `documents`, so the
+    distances to every truck can be computed in a single vectorized pass.
+    """
+
+    def __init__(self, documents):
+        self.documents = []
+        points = []
+        for document in documents:
+            try:
+                longitude, latitude = document['location']['coordinates']
+                point = (float(longitude), float(latitude))
+            except (KeyError, TypeError, ValueError):
+                continue  # Documents without a usable point are invisible to geo queries as well
+            self.documents.append(document)
+            points.append(point)
+        points = np.array(points, dtype=np.float64).reshape(-1, 2)
+        self.longitudes = points[:, 0]
+        self.latitudes = points[:, 1]
+        self.ids = [document.get('_id') for document in self.documents]
+
+    def __len__(self):
+        return len(self.documents)
+
+    @cached_property
+    def open_hours(self):
+        """
+        Interval index of the open hours of the documents, built on the first open_at query.
+        """
+        return OpenHoursIndex(self.documents)
+
+    @cached_property
+    def food_positions(self):
+        """
+        Positions of the documents serving each food key, built on the first food query.
+        """
+        positions = defaultdict(list)
+        for position, document in enumerate(self.documents):
+            for key in set(document.get('food_keys') or ()):
+                positions[key].append(position)
+        return positions
+
+    @cached_property
+    def facet_columns(self):
+        """
+        Columnar snapshot of the faceted fields of the documents, built on the first facets query.
+        """
+        return FacetColumns(self.documents)
+
+    @cached_property
+    def clusters(self):
+        """
+        Clusters of the documents at every zoom level up to MAP_MAX_ZOOM, see clusters.ClusterIndex.
+        """
+        return ClusterIndex(self.longitudes, self.latitudes, settings.CLUSTER_RADIUS, settings.MAP_MAX_ZOOM)
+
+    @cached_property
+    def positions(self):
+        """
+        Position of each document of the store, keyed by the id() of the document object.
+        """
+        return {id(document): position for position, document in enumerate(self.documents)}
+
+    def food_mask(self, key):
+        """
+        Return a boolean mask over the documents, True for the ones serving a food key.
+        """
+        mask = np.zeros(len(self.documents), dtype=bool)
+        mask[self.food_positions.get(key, [])] = True
+        return mask
+
+    def bbox_mask(self, bbox):
+        """
+        Return a boolean mask over the documents, True for the ones inside a bounding box.
+
+        Args:
+            bbox (tuple): (min_longitude, min_latitude, max_longitude, max_latitude), edges included.
+        """
+        min_longitude, min_latitude, max_longitude, max_latitude = bbox
+        return (
+            (self.longitudes >= min_longitude) & (self.longitudes <= max_longitude)
+            & (self.latitudes >= min_latitude) & (self.latitudes <= max_latitude)
+        )
+
+    def select(self, bbox=None, filters=None):
+        """
+        Return a boolean mask over the documents inside a bounding box and matching filters.
+        """
+        mask = np.ones(len(self.documents), dtype=bool)
+        if bbox is not None:
+            mask &= self.bbox_mask(bbox)
+        if filters:
+            mask &= filters.mask(self)
+        return mask
+
+    def facets(self, bbox=None, filters=None, food_limit=None):
+        """
+        Count the selected documents by status, facility type and food, see FacetColumns.counts.
+        """
+        return self.facet_columns.counts(self.select(bbox, filters), food_limit)
+
+    def density(self, zoom, bbox=None, filters=None):
+        """
+        Count the selected documents by XYZ tile of a zoom level, see aggregations.density_cells.
+        """
+        mask = self.select(bbox, filters)
+        return density_cells(self.longitudes[mask], self.latitudes[mask], zoom)
+
+    def inside(self, bbox, limit=None, after=None, filters=None):
+        """
+        Find the documents inside a bounding box, in load order.
+
+        Args:
+            bbox (tuple): (min_longitude, min_latitude, max_longitude, max_latitude), edges included.
+            limit (int): Maximum number of documents to return, all of them if None.
+            after (ObjectId): _id of the last document of the previous page. Documents must
+                have been loaded in _id order.
+            filters (TruckFilters): Only keep the documents matching these filters.
+
+        Returns:
+            list: The documents.
+        """
+        positions = np.flatnonzero(self.select(bbox, filters))
+        if after is not None:
+            positions = positions[positions >= bisect.bisect_right(self.ids, after)]
+        return [self.documents[position] for position in positions[:limit].tolist()]
+
+    def tile(self, zoom, x, y, filters=None):
+        """
+        Find the documents of an XYZ tile, in load order.
+
+        The box of the tile narrows the documents down before their tile is computed, so
+        every document belongs to exactly one tile of a zoom level.
+        """
+        positions = np.flatnonzero(self.select(tile_search_bbox(x, y, zoom), filters))
+        xs, ys = tile_xy(self.longitudes[positions], self.latitudes[positions], zoom)
+        positions = positions[(xs == x) & (ys == y)]
+        return [self.documents[position] for position in positions.tolist()]
+
+    def cluster(self, documents, zoom):
+        """
+        Cluster documents returned by the store at a zoom level, see GeoEngine.cluster.
+
+        The clusters of the store are restricted to the documents, so a cluster holds the
+        documents of one cluster of the whole store.
+        """
+        positions = [self.positions.get(id(document)) for document in documents]
+        if None in positions:
+            # Not read from this store, e.g. by the MongoDB fallback while it was loading
+            return cluster_documents(documents, zoom, settings.CLUSTER_RADIUS, settings.MAP_MAX_ZOOM)
+        alone, clusters = self.clusters.group(np.array(positions, dtype=np.int64), zoom)
+        return [documents[index] for index in alone], clusters
+
+    def distances(self, longitude, latitude):
+        """
+        Return the distances in meters from a point to every document of the store.
+        """
+        return haversine_many(longitude, latitude, self.longitudes, self.latitudes)
+
+    def _after(self, distances, positions, after):
+        """
+        Return a mask of the positions whose (distance, _id) key comes after a page cursor.
+
+        Documents must have been loaded in _id order for the keyset comparison to hold.
+        """
+        distance, document_id = after
+        first_after = bisect.bisect_right(self.ids, document_id)
+        return (distances > distance) | ((distances == distance) & (positions >= first_after))
+
+    def nearest(self, longitude, latitude, limit=None, radius=None, after=None, filters=None):
+        """
+        Find the documents nearest to a point.
+
+        Args:
+            longitude (float): Longitude of the center point.
+            latitude (float): Latitude of the center point.
+            limit (int): Maximum number of documents to return, all of them if None.
+            radius (float): Maximum distance in meters, unbounded if None.
+            after (tuple): (distance, _id) key of the last document of the previous page.
+            filters (TruckFilters): Only keep the documents matching these filters.
+
+        Returns:
+            list: (distance, document) pairs ordered by distance, nearest first.
+        """
+        distances = self.distances(longitude, latitude)
+        if radius is not None:
+            distances = np.where(distances <= radius, distances, np.inf)
+        if filters:
+            distances = np.where(filters.mask(self), distances, np.inf)
+        if after is not None:
+            distances = np.where(self._after(distances, np.arange(len(distances)), after), distances, np.inf)
+        positions = top_k(distances, limit)
+        return [
+            (float(distances[position]), self.documents[position])
+            for position in positions
+            if distances[position] != np.inf
+        ]
+
+
+class GeoIndex(CoordinateStore):
+    """
+    In-memory grid index over the GeoJSON points of food truck documents.
+
+    Documents are bucketed into square cells of `cell_size` degrees. A radius query only
+    visits the cells overlapping the bounding box of the search circle and then filters
+    the candidates with an exact haversine distance. Queries without a radius use the
+    vectorized scan of CoordinateStore.
+    """
+
+    def __init__(self, documents, cell_size=0.01):
+        super().__init__(documents)
+        self.cell_size = float(cell_size)
+        self._cells = defaultdict(list)
+        for position, (longitude, latitude) in enumerate(zip(self.longitudes.tolist(), self.latitudes.tolist())):
+            self._cells[self._cell(longitude, latitude)].append(position)
+
+    def _cell(self, longitude, latitude):
+        return (math.floor(longitude / self.cell_size), math.floor(latitude / self.cell_size))
+
+    def _candidates(self, longitude, latitude, radius):
+        """
+        Return the positions of the documents that may lie within radius meters of the point.
+        """
+        delta_latitude = math.degrees(radius / EARTH_RADIUS_METERS)
+        max_latitude = abs(latitude) + delta_latitude
+        if max_latitude >= 90:
+            return range(len(self.documents))  # The circle covers a pole, scan everything
+
+        delta_longitude = delta_latitude / math.cos(math.radians(max_latitude))
+        if longitude - delta_longitude < -180 or longitude + delta_longitude > 180:
+            return range(len(self.documents))  # The circle crosses the antimeridian
+
+        min_x, min_y = self._cell(longitude - delta_longitude, latitude - delta_latitude)
+        max_x, max_y = self._cell(longitude + delta_longitude, latitude + delta_latitude)
+        if (max_x - min_x + 1) * (max_y - min_y + 1) > len(self._cells):
+            # Fewer occupied cells than cells in the box: walking the occupied ones is cheaper
+            return (
+                position
+                for (x, y), positions in self._cells.items()
+                if min_x <= x <= max_x and min_y <= y <= max_y
+                for position in positions
+            )
+        return (
+            position
+            for x in range(min_x, max_x + 1)
+            for y in range(min_y, max_y + 1)
+            for position in self._cells.get((x, y), ())
+        )
+
+    def within(self, longitude, latitude, radius, limit=None, after=None, filters=None):
+        """
+        Find the documents within a radius of a point.
+
+        Args:
+            longitude (float): Longitude of the center point.
+            latitude (float): Latitude of the center point.
+            radius (float): Search radius in meters.
+            limit (int): Maximum number of documents to return, all of them if None.
+            after (tuple): (distance, _id) key of the last document of the previous page.
+            filters (TruckFilters): Only keep the documents matching these filters.
+
+        Returns:
+            list: (distance, document) pairs ordered by distance, nearest first.
+        """
+        positions = np.fromiter(self._candidates(longitude, latitude, radius), dtype=np.intp)
+        distances = haversine_many(longitude, latitude, self.longitudes[positions], self.latitudes[positions])
+        inside = distances <= radius
+        if filters:
+            inside &= filters.mask(self)[positions]
+        if after is not None:
+            inside &= self._after(distances, positions, after)
+        positions, distances = positions[inside], distances[inside]
+        # Positions follow the _id order of the load, which keeps ties deterministic
+        order = np.lexsort((positions, distances))[:limit]
+        return [(float(distances[i]), self.documents[positions[i]]) for i in order]
+
+    def nearest(self, longitude, latitude, limit=None, radius=None, after=None, filters=None):
+        if radius is not None:
+            return self.within(longitude, latitude, radius, limit=limit, after=after, filters=filters)
+        return super().nearest(longitude, latitude, limit=limit, after=after, filters=filters)
+
+
+def geo_near_stage(longitude, latitude, radius=None, after=None, query=None):
+    """
+    Build a $geoNear aggregation stage adding a 'distance' field to the food trucks.
+
+    Args:
+        longitude (float): Longitude of the center point.
+        latitude (float): Latitude of the center point.
+        radius (float): Maximum distance in meters, unbounded if None.
+        after (tuple): (distance, _id) key of the last document of the previous page. The
+            index skips every closer document through minDistance.
+        query (dict): Filter the documents must match, applied while the index is scanned.
+    """
+    geo_near = {
+        'near': {
+            'type': 'Point',
+            'coordinates': [longitude, latitude]
+        },
+        'distanceField': 'distance',
+        'spherical': True
+    }
+    if radius is not None:
+        geo_near['maxDistance'] = radius
+    if after is not None:
+        geo_near['minDistance'] = after[0]
+    if query:
+        geo_near['query'] = query
+    return {'$geoNear': geo_near}
+
+
+def covering_polygon(bbox):
+    """
+    Return a GeoJSON polygon covering a (min_longitude, min_latitude, max_longitude, max_latitude) box.
+
+    The edges of a GeoJSON polygon are great circles, which bulge toward the pole between
+    two points of the same latitude. The edge nearer to the equator is moved away from it
+    so that its great circle culminates on the edge of the box, and the polygon holds the
+    whole box. Returns None for boxes too wide or too close to a pole to be covered by a
+    polygon smaller than a hemisphere.
+    """
+    min_longitude, min_latitude, max_longitude, max_latitude = bbox
+    if max_longitude - min_longitude > MAX_POLYGON_WIDTH:
+        return None
+    cos_half_width = math.cos(math.radians(max_longitude - min_longitude) / 2)
+
+    def culminating_at(latitude):
+        # Latitude of the great circle edge of the given half width reaching the latitude
+        return math.degrees(math.atan(math.tan(math.radians(latitude)) * cos_half_width))
+
+    south = culminating_at(min_latitude) - POLYGON_MARGIN if min_latitude > 0 else min_latitude - POLYGON_MARGIN
+    north = culminating_at(max_latitude) + POLYGON_MARGIN if max_latitude < 0 else max_latitude + POLYGON_MARGIN
+    if south <= -90 or north >= 90:
+        return None
+    return {'type': 'Polygon', 'coordinates': [[
+        [min_longitude, south], [max_longitude, south], [max_longitude, north], [min_longitude, north], [min_longitude, south],
+    ]]}
+
+
+def bbox_filter(bbox):
+    """
+    Build the filter of the food trucks inside a (min_longitude, min_latitude, max_longitude, max_latitude) box.
+
+    The edges of a map viewport are lines of constant longitude and latitude, so the box is
+    matched by comparing the coordinates, like the in-memory index does. A $geoWithin on
+    a polygon covering the box lets the 2dsphere index of location select the candidates.
+    """
+    min_longitude, min_latitude, max_longitude, max_latitude = bbox
+    query = {
+        'location.coordinates.0': {'$gte': min_longitude, '$lte': max_longitude},
+        'location.coordinates.1': {'$gte': min_latitude, '$lte': max_latitude},
+    }
+    polygon = covering_polygon(bbox)
+    if polygon is not None:
+        query['location'] = {'$geoWithin': {'$geometry': polygon}}
+    return query
+
+
+def tile_filter(zoom, x, y):
+    """
+    Build the filter of the food trucks of an XYZ tile, the ones tile_xy puts in that tile.
+    """
+    query = bbox_filter(tile_search_bbox(x, y, zoom))
+    tile = tile_xy_expression(zoom)
+    query['$expr'] = {'$and': [{'$eq': [tile['x'], x]}, {'$eq': [tile['y'], y]}]}
+    return query
+
+
+def aggregation_match(bbox=None, filters=None):
+    """
+    Return the $match filter of the food trucks counted by the aggregation endpoints.
+    """
+    match = bbox_filter(bbox) if bbox is not None else {}
+    if filters:
+        match.update(filters.query())
+    return match
+
+
+def distance_page_stages(limit, after=None):
+    """
+    Build the stages keeping the page of documents following a (distance, _id) keyset cursor.
+
+    The stages go right after a $geoNear stage; ties on the distance are ordered by _id.
+    """
+    stages = []
+    if after is not None:
+        distance, document_id = after
+        stages.append({'$match': {'$or': [
+            {'distance': {'$gt': distance}},
+            {'distance': distance, '_id': {'$gt': document_id}},
+        ]}})
+    stages.append({'$sort': {'distance': 1, '_id': 1}})
+    stages.append({'$limit': limit})
+    return stages
+
+
+class GeoEngine:
+    """
+    Base class for the engines answering radius and aggregation queries over the food truck collection.
+
+    The async methods used by the async views run the sync ones in a worker thread, unless
+    an engine overrides them.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        # Same collection through the async client, set by get_geo_engine for the async views
+        self.async_collection = None
+
+    def near(self, longitude, latitude, radius=None, limit=None, filters=None, projection=None):
+        """
+        Return the food truck documents nearest to a point, nearest first.
+
+        Args:
+            longitude (float): Longitude of the center point.
+            latitude (float): Latitude of the center point.
+            radius (float): Maximum distance in meters, unbounded if None.
+            limit (int): Maximum number of documents to return, all of them if None.
+            filters (TruckFilters): Only return the food trucks matching these filters.
+            projection (dict): Fields read from MongoDB, whole documents if None. Engines
+                answering from memory return whole documents.
+        """
+        raise NotImplementedError
+
+    def page(self, longitude, latitude, limit, radius=None, after=None, filters=None, projection=None):
+        """
+        Return a page of the food truck documents nearest to a point, in (distance, _id) order.
+
+        Args:
+            longitude (float): Longitude of the center point.
+            latitude (float): Latitude of the center point.
+            limit (int): Maximum number of documents to return.
+            radius (float): Maximum distance in meters, unbounded if None.
+            after (tuple): (distance, _id) key of the last document of the previous page.
+            filters (TruckFilters): Only return the food trucks matching these filters.
+            projection (dict): Fields read from MongoDB, whole documents if None. Engines
+                answering from memory return whole documents.
+
+        Returns:
+            list: (distance, document) pairs.
+        """
+        raise NotImplementedError
+
+    async def anear(self, longitude, latitude, radius=None, limit=None, filters=None, projection=None):
+        """
+        Async variant of near.
+        """
+        near = sync_to_async(self.near, thread_sensitive=False)
+        return list(await near(longitude, latitude, radius=radius, limit=limit, filters=filters, projection=projection))
+
+    async def apage(self, longitude, latitude, limit, radius=None, after=None, filters=None, projection=None):
+        """
+        Async variant of page.
+        """
+        page = sync_to_async(self.page, thread_sensitive=False)
+        return await page(longitude, latitude, limit, radius=radius, after=after, filters=filters, projection=projection)
+
+    def near_many(self, queries, projection=None):
+        """
+        Answer a batch of near queries.
+
+        Args:
+            queries (list): Keyword arguments of near, one dict per query.
+            projection (dict): Fields read from MongoDB, as for near.
+
+        Returns:
+            list: The documents of each query, in the order of queries.
+        """
+        return [list(self.near(**query, projection=projection)) for query in queries]
+
+    async def anear_many(self, queries, projection=None):
+        """
+        Async variant of near_many.
+        """
+        return await sync_to_async(self.near_many, thread_sensitive=False)(queries, projection=projection)
+
+    def facets(self, bbox=None, filters=None, food_limit=None):
+        """
+        Count the food trucks by status, facility type and food.
+
+        Args:
+            bbox (tuple): Only count the food trucks inside this
+                (min_longitude, min_latitude, max_longitude, max_latitude) box.
+            filters (TruckFilters): Only count the food trucks matching these filters.
+            food_limit (int): Maximum number of foods to return, all of them if None.
+
+        Returns:
+            dict: Number of counted food trucks as 'count', and {'value', 'count'} lists by
+                facet as 'facets', most frequent values first.
+        """
+        raise NotImplementedError
+
+    def density(self, zoom, bbox=None, filters=None):
+        """
+        Count the food trucks by XYZ tile of a zoom level.
+
+        Args:
+            zoom (int): Zoom level of the tiles.
+            bbox (tuple): Only count the food trucks inside this
+                (min_longitude, min_latitude, max_longitude, max_latitude) box.
+            filters (TruckFilters): Only count the food trucks matching these filters.
+
+        Returns:
+            list: {'x', 'y', 'count', 'longitude', 'latitude'} dicts of the non-empty tiles in
+                (x, y) order, with the mean coordinates of their food trucks.
+        """
+        raise NotImplementedError
+
+    def inside(self, bbox, limit=None, after=None, filters=None, projection=None):
+        """
+        Return the food truck documents inside a bounding box, in _id order.
+
+        Args:
+            bbox (tuple): (min_longitude, min_latitude, max_longitude, max_latitude), edges included.
+            limit (int): Maximum number of documents to return, all of them if None.
+            after (ObjectId): _id of the last document of the previous page.
+            filters (TruckFilters): Only return the food trucks matching these filters.
+            projection (dict): Fields read from MongoDB, whole documents if None. Engines
+                answering from memory return whole documents.
+        """
+        raise NotImplementedError
+
+    def tile(self, zoom, x, y, filters=None, projection=None):
+        """
+        Return the food truck documents of an XYZ tile, in _id order.
+
+        The tiles of a zoom level split the food trucks like the cells of density.
+
+        Args:
+            zoom (int): Zoom level of the tile.
+            x (int): Column of the tile, from the west.
+            y (int): Row of the tile, from the north.
+            filters (TruckFilters): Only return the food trucks matching these filters.
+            projection (dict): Fields read from MongoDB, whole documents if None. Engines
+                answering from memory return whole documents.
+        """
+        raise NotImplementedError
+
+    def cluster(self, documents, zoom):
+        """
+        Merge the food trucks of a query closer than CLUSTER_RADIUS pixels at a zoom level.
+
+        Clusters are built on the fly from the documents, unless an engine precomputed them.
+
+        Args:
+            documents (iterable): Documents returned by near, inside or tile, with their location.
+            zoom (int): Zoom level of the map.
+
+        Returns:
+            tuple: The documents alone in their cluster, in their order, and
+                {'count', 'longitude', 'latitude'} dicts of the clusters of the others, with
+                the mean coordinates of their food trucks, in the order of their first document.
+        """
+        return cluster_documents(list(documents), zoom, settings.CLUSTER_RADIUS, settings.MAP_MAX_ZOOM)
+
+    async def acluster(self, documents, zoom):
+        """
+        Async variant of cluster.
+        """
+        return await sync_to_async(self.cluster, thread_sensitive=False)(documents, zoom)
+
+    async def ainside(self, bbox, limit=None, after=None, filters=None, projection=None):
+        """
+        Async variant of inside.
+        """
+        inside = sync_to_async(self.inside, thread_sensitive=False)
+        return await inside(bbox, limit=limit, after=after, filters=filters, projection=projection)
+
+    async def atile(self, zoom, x, y, filters=None, projection=None):
+        """
+        Async variant of tile.
+        """
+        return await sync_to_async(self.tile, thread_sensitive=False)(zoom, x, y, filters=filters, projection=projection)
+
+    async def afacets(self, bbox=None, filters=None, food_limit=None):
+        """
+        Async variant of facets.
+        """
+        return await sync_to_async(self.facets, thread_sensitive=False)(bbox=bbox, filters=filters, food_limit=food_limit)
+
+    async def adensity(self, zoom, bbox=None, filters=None):
+        """
+        Async variant of density.
+        """
+        return await sync_to_async(self.density, thread_sensitive=False)(zoom, bbox=bbox, filters=filters)
+
+    def use_async_collection(self, async_collection):
+        self.async_collection = async_collection
+
+    def invalidate(self):
+        """
+        Drop any state derived from the collection.
+        """
+
+
+class MongoGeoEngine(GeoEngine):
+    """
+    Geo engine answering every query with a `$near` query or an aggregation against MongoDB.
+    """
+
+    @staticmethod
+    def near_filter(longitude, latitude, radius=None, filters=None):
+        near = {
+            '$geometry': {
+                'type': 'Point',
+                'coordinates': [longitude, latitude]
+            }
+        }
+        if radius is not None:
+            near['$maxDistance'] = radius
+        query = {'location': {'$near': near}}
+        if filters:
+            query.update(filters.query())
+        return query
+
+    @staticmethod
+    def page_pipeline(longitude, latitude, limit, radius=None, after=None, filters=None, projection=None):
+        # $near cannot order ties by _id, so pages go through $geoNear
+        query = filters.query() if filters else None
+        pipeline = [geo_near_stage(longitude, latitude, radius=radius, after=after, query=query)]
+        pipeline += distance_page_stages(limit, after=after)
+        if projection is not None:
+            pipeline.append({'$project': dict(projection, distance=1)})
+        return pipeline
+
+    def near(self, longitude, latitude, radius=None, limit=None, filters=None, projection=None):
+        query = self.near_filter(longitude, latitude, radius, filters)
+        return self.collection.find(query, projection=projection, limit=limit or 0)
+
+    def page(self, longitude, latitude, limit, radius=None, after=None, filters=None, projection=None):
+        pipeline = self.page_pipeline(longitude, latitude, limit, radius=radius, after=after, filters=filters, projection=projection)
+        return [(document.pop('distance'), document) for document in self.collection.aggregate(pipeline)]
+
+    async def anear(self, longitude, latitude, radius=None, limit=None, filters=None, projection=None):
+        if self.async_collection is None:
+            return await super().anear(longitude, latitude, radius=radius, limit=limit, filters=filters, projection=projection)
+        query = self.near_filter(longitude, latitude, radius, filters)
+        cursor = self.async_collection.find(query, projection=projection, limit=limit or 0)
+        return await cursor.to_list()
+
+    async def apage(self, longitude, latitude, limit, radius=None, after=None, filters=None, projection=None):
+        if self.async_collection is None:
+            return await super().apage(longitude, latitude, limit, radius=radius, after=after, filters=filters, projection=projection)
+        pipeline = self.page_pipeline(longitude, latitude, limit, radius=radius, after=after, filters=filters, projection=projection)
+        return [(document.pop('distance'), document) async for document in await self.async_collection.aggregate(pipeline)]
+
+    def near_many(self, queries, projection=None):
+        # $near cannot run inside $facet, so the queries are sent concurrently instead
+        workers = min(settings.NEARBY_BATCH_CONCURRENCY, len(queries))
+        if workers <= 1:
+            return super().near_many(queries, projection=projection)
+        # Each query runs in a copy of the context of the request, which holds its metrics
+        contexts = [contextvars.copy_context() for _ in queries]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda context, query: context.run(lambda: list(self.near(**query, projection=projection))), contexts, queries))
+
+    async def anear_many(self, queries, projection=None):
+        if self.async_collection is None:
+            return await super().anear_many(queries, projection=projection)
+        semaphore = asyncio.Semaphore(settings.NEARBY_BATCH_CONCURRENCY)
+
+        async def near(query):
+            async with semaphore:
+                return await self.anear(**query, projection=projection)
+
+        return await asyncio.gather(*(near(query) for query in queries))
+
+    @staticmethod
+    def inside_args(bbox, limit=None, after=None, filters=None, projection=None):
+        query = aggregation_match(bbox, filters)
+        if after is not None:
+            query['_id'] = {'$gt': after}
+        return query, {'projection': projection, 'sort': [('_id', 1)], 'limit': limit or 0}
+
+    @staticmethod
+    def tile_args(zoom, x, y, filters=None, projection=None):
+        query = tile_filter(zoom, x, y)
+        if filters:
+            query.update(filters.query())
+        return query, {'projection': projection, 'sort': [('_id', 1)]}
+
+    def inside(self, bbox, limit=None, after=None, filters=None, projection=None):
+        query, kwargs = self.inside_args(bbox, limit=limit, after=after, filters=filters, projection=projection)
+        return self.collection.find(query, **kwargs)
+
+    def tile(self, zoom, x, y, filters=None, projection=None):
+        query, kwargs = self.tile_args(zoom, x, y, filters=filters, projection=projection)
+        return self.collection.find(query, **kwargs)
+
+    async def ainside(self, bbox, limit=None, after=None, filters=None, projection=None):
+        if self.async_collection is None:
+            return await super().ainside(bbox, limit=limit, after=after, filters=filters, projection=projection)
+        query, kwargs = self.inside_args(bbox, limit=limit, after=after, filters=filters, projection=projection)
+        return await self.async_collection.find(query, **kwargs).to_list()
+
+    async def atile(self, zoom, x, y, filters=None, projection=None):
+        if self.async_collection is None:
+            return await super().atile(zoom, x, y, filters=filters, projection=projection)
+        query, kwargs = self.tile_args(zoom, x, y, filters=filters, projection=projection)
+        return await self.async_collection.find(query, **kwargs).to_list()
+
+    def facets(self, bbox=None, filters=None, food_limit=None):
+        pipeline = facets_pipeline(aggregation_match(bbox, filters), food_limit)
+        return facets_result(list(self.collection.aggregate(pipeline))[0])
+
+    def density(self, zoom, bbox=None, filters=None):
+        return density_result(self.collection.aggregate(density_pipeline(zoom, aggregation_match(bbox, filters))))
+
+    async def afacets(self, bbox=None, filters=None, food_limit=None):
+        if self.async_collection is None:
+            return await super().afacets(bbox=bbox, filters=filters, food_limit=food_limit)
+        pipeline = facets_pipeline(aggregation_match(bbox, filters), food_limit)
+        return facets_result((await (await self.async_collection.aggregate(pipeline)).to_list())[0])
+
+    async def adensity(self, zoom, bbox=None, filters=None):
+        if self.async_collection is None:
+            return await super().adensity(zoom, bbox=bbox, filters=filters)
+        pipeline = density_pipeline(zoom, aggregation_match(bbox, filters))
+        return density_result(await (await self.async_collection.aggregate(pipeline)).to_list())
+
+
+class IndexGeoEngine(GeoEngine):
+    """
+    Geo engine answering queries from an in-memory GeoIndex of the whole collection.
+
+    The index is loaded on first use and reloaded once the data version changes or it is
+    older than GEO_INDEX_TTL seconds. While no index is available (for example when
+    loading it failed) queries fall back to MongoGeoEngine.
+    """
+
+    def __init__(self, collection):
+        super().__init__(collection)
+        self.fallback = MongoGeoEngine(collection)
+        self._index = None
+        self._loaded_at = 0.0
+        self._version = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, version):
+        if self._index is None or time.monotonic() - self._loaded_at >= settings.GEO_INDEX_TTL:
+            return False
+        # Without a readable version, only the TTL applies
+        return version is None or version == self._version
+
+    def load(self):
+        """
+        Build a new index from the collection and make it the active one.
+        """
+        version = get_data_version()
+        documents = self.collection.find({}, sort=[('_id', 1)])
+        index = GeoIndex(documents, cell_size=settings.GEO_INDEX_CELL_SIZE)
+        # Clustered at every zoom level now, so clustered queries cost about as much as the others
+        index.clusters
+        self._index = index
+        self._loaded_at = time.monotonic()
+        self._version = version
+        return self._index
+
+    def get_index(self):
+        """
+        Return a fresh index, loading it if needed, or None if it could not be loaded.
+        """
+        if self._is_fresh(get_data_version()):
+            return self._index
+        with self._lock:
+            if self._is_fresh(get_data_version()):
+                return self._index
+            if self._failed_at is not None and time.monotonic() - self._failed_at < LOAD_RETRY_INTERVAL:
+                return None
+            try:
+                index = self.load()
+            except PyMongoError as error:
+                logger.warning('Could not load the geo index, falling back to MongoDB: %s', error)
+                self._index = None
+                self._failed_at = time.monotonic()
+                return None
+            self._failed_at = None
+            return index
+
+    async def aget_index(self):
+        """
+        Async variant of get_index.
+
+        Queries on a fresh index need no I/O and run on the event loop, only loading the
+        index reads the collection in a worker thread.
+        """
+        if self._is_fresh(await aget_data_version()):
+            return self._index
+        return await sync_to_async(self.get_index, thread_sensitive=False)()
+
+    def use_async_collection(self, async_collection):
+        super().use_async_collection(async_collection)
+        self.fallback.use_async_collection(async_collection)
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+            self._failed_at = None
+
+    def near(self, longitude, latitude, radius=None, limit=None, filters=None, projection=None):
+        index = self.get_index()
+        if index is None:
+            return self.fallback.near(longitude, latitude, radius=radius, limit=limit, filters=filters, projection=projection)
+        return [document for _, document in index.nearest(longitude, latitude, limit=limit, radius=radius, filters=filters)]
+
+    def page(self, longitude, latitude, limit, radius=None, after=None, filters=None, projection=None):
+        index = self.get_index()
+        if index is None:
+            return self.fallback.page(longitude, latitude, limit, radius=radius, after=after, filters=filters, projection=projection)
+        return index.nearest(longitude, latitude, limit=limit, radius=radius, after=after, filters=filters)
+
+    async def anear(self, longitude, latitude, radius=None, limit=None, filters=None, projection=None):
+        index = await self.aget_index()
+        if index is None:
+            return await self.fallback.anear(longitude, latitude, radius=radius, limit=limit, filters=filters, projection=projection)
+        return [document for _, document in index.nearest(longitude, latitude, limit=limit, radius=radius, filters=filters)]
+
+    async def apage(self, longitude, latitude, limit, radius=None, after=None, filters=None, projection=None):
+        index = await self.aget_index()
+        if index is None:
+            return await self.fallback.apage(longitude, latitude, limit, radius=radius, after=after, filters=filters, projection=projection)
+        return index.nearest(longitude, latitude, limit=limit, radius=radius, after=after, filters=filters)
+
+    @staticmethod
+    def _near_many(index, queries):
+        # Every query of the batch is answered from the same index
+        return [[document for _, document in index.nearest(**query)] for query in queries]
+
+    def near_many(self, queries, projection=None):
+        index = self.get_index()
+        if index is None:
+            return self.fallback.near_many(queries, projection=projection)
+        return self._near_many(index, queries)
+
+    async def anear_many(self, queries, projection=None):
+        index = await self.aget_index()
+        if index is None:
+            return await self.fallback.anear_many(queries, projection=projection)
+        return self._near_many(index, queries)
+
+    def inside(self, bbox, limit=None, after=None, filters=None, projection=None):
+        index = self.get_index()
+        if index is None:
+            return self.fallback.inside(bbox, limit=limit, after=after, filters=filters, projection=projection)
+        return index.inside(bbox, limit=limit, after=after, filters=filters)
+
+    def tile(self, zoom, x, y, filters=None, projection=None):
+        index = self.get_index()
+        if index is None:
+            return self.fallback.tile(zoom, x, y, filters=filters, projection=projection)
+        return index.tile(zoom, x, y, filters=filters)
+
+    async def ainside(self, bbox, limit=None, after=None, filters=None, projection=None):
+        index = await self.aget_index()
+        if index is None:
+            return await self.fallback.ainside(bbox, limit=limit, after=after, filters=filters, projection=projection)
+        return index.inside(bbox, limit=limit, after=after, filters=filters)
+
+    async def atile(self, zoom, x, y, filters=None, projection=None):
+        index = await self.aget_index()
+        if index is None:
+            return await self.fallback.atile(zoom, x, y, filters=filters, projection=projection)
+        return index.tile(zoom, x, y, filters=filters)
+
+    def cluster(self, documents, zoom):
+        index = self.get_index()
+        if index is None:
+            return self.fallback.cluster(documents, zoom)
+        return index.cluster(list(documents), zoom)
+
+    async def acluster(self, documents, zoom):
+        index = await self.aget_index()
+        if index is None:
+            return await self.fallback.acluster(documents, zoom)
+        return index.cluster(list(documents), zoom)
+
+    def facets(self, bbox=None, filters=None, food_limit=None):
+        index = self.get_index()
+        if index is None:
+            return self.fallback.facets(bbox=bbox, filters=filters, food_limit=food_limit)
+        return index.facets(bbox=bbox, filters=filters, food_limit=food_limit)
+
+    def density(self, zoom, bbox=None, filters=None):
+        index = self.get_index()
+        if index is None:
+            return self.fallback.density(zoom, bbox=bbox, filters=filters)
+        return index.density(zoom, bbox=bbox, filters=filters)
+
+    async def afacets(self, bbox=None, filters=None, food_limit=None):
+        index = await self.aget_index()
+        if index is None:
+            return await self.fallback.afacets(bbox=bbox, filters=filters, food_limit=food_limit)
+        return index.facets(bbox=bbox, filters=filters, food_limit=food_limit)
+
+    async def adensity(self, zoom, bbox=None, filters=None):
+        index = await self.aget_index()
+        if index is None:
+            return await self.fallback.adensity(zoom, bbox=bbox, filters=filters)
+        return index.density(zoom, bbox=bbox, filters=filters)
+
+
+_engines = {}
+
+
+def get_geo_engine(collection, async_collection=None):
+    """
+    Return the geo engine configured by settings.GEO_ENGINE for a collection.
+
+    Engines are created once per collection so in-memory indexes are shared between requests.
+
+    Args:
+        collection (Collection): The food truck collection.
+        async_collection (AsyncCollection): The same collection through the async client,
+            used by the async methods of the engine.
+    """
+    key = (settings.GEO_ENGINE, id(collection))
+    engine = _engines.get(key)
+    if engine is None:
+        engine = _engines[key] = import_string(settings.GEO_ENGINE)(collection)
+    if async_collection is not None and engine.async_collection is not async_collection:
+        engine.use_async_collection(async_collection)
+    return engine
@@ -0,0 +1,54 @@
+from pymongo import ASCENDING, GEOSPHERE, IndexModel
+
+# Indexes of the collections of the application, by collection name
+INDEXES = {
+    'food_truck': [
+        # Used by the $near / $geoNear queries
+        IndexModel([('location', GEOSPHERE)]),
+        # Declared by the FoodTruck model
+        IndexModel([('applicant', ASCENDING)]),
+        # Used by incremental seeds to match rows with stored trucks
+        IndexModel([('location_id', ASCENDING)]),
+        # Multikey index answering the $elemMatch of the open_at / open_now filters
+        IndexModel([('open_intervals.start', ASCENDING), ('open_intervals.end', ASCENDING)]),
+        # Multikey index answering the food filter
+        IndexModel([('food_keys', ASCENDING)]),
+    ],
+    'food': [
+        # Food names are deduplicated by upserts
+        IndexModel([('name', ASCENDING)], unique=True),
+        # Lookups of the trucks serving a food by its normalized key
+        IndexModel([('key', ASCENDING)]),
+    ],
+    'food_truck_terms': [
+        # Prefix lookups of the q parameter are range scans on this index, the posting
+        # list of a term being split into buckets
+        IndexModel([('term', ASCENDING), ('bucket', ASCENDING)], unique=True),
+    ],
+}
+
+
+def ensure_indexes(collection, name=None):
+    """
+    Create the indexes of a collection. Existing indexes are left untouched.
+
+    Args:
+        collection (Collection): Collection to create the indexes on.
+        name (str): Name of the collection whose indexes are created, defaults to the name of
+            collection. Shadow collections use the name of the live collection they replace.
+
+    Returns:
+        list: Names of the indexes.
+    """
+    indexes = INDEXES.get(name or collection.name, [])
+    return collection.create_indexes(indexes) if indexes else []
+
+
+def ensure_all_indexes(database):
+    """
+    Create the indexes of every collection of a database.
+
+    Returns:
+        dict: Names of the indexes, by collection name.
+    """
+    return {name: ensure_indexes(database[name], name) for name in INDEXES}
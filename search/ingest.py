@@ -0,0 +1,337 @@
+import csv
+import hashlib
+import io
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from pymongo import ReplaceOne, UpdateOne
+
+from .open_hours import open_intervals
+from .text_index import INDEXED_FIELDS, tokenize
+from .utils import batched, parse_open_hours
+
+try:
+    import pandas as pd
+except ImportError:  # Optional, only needed by the pandas parser of seed_data
+    pd = None
+
+# Default location of the food truck permits CSV export
+DEFAULT_CSV_PATH = 'data/food-truck-data.csv'
+
+# Format of the 'Approved' column of the CSV export
+APPROVED_DATE_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+
+# Number of chunks the CSV is split into per worker, so faster workers pick up more chunks
+CHUNKS_PER_WORKER = 4
+
+# Fields of the stored food trucks read by incremental seeds, the foods and the term
+# index being derived from them
+SYNC_PROJECTION = dict.fromkeys(('location_id', 'food_items') + INDEXED_FIELDS, 1)
+
+# Columns of the CSV export read by the pandas parser
+CSV_COLUMNS = [
+    'locationid', 'permit', 'Applicant', 'FacilityType', 'LocationDescription', 'Address', 'Status',
+    'FoodItems', 'Approved', 'Latitude', 'Longitude', 'dayshours',
+]
+
+
+def read_rows(path):
+    """
+    Stream the rows of a food truck permits CSV file as dictionaries.
+    """
+    with open(path, 'r', newline='', encoding='utf-8') as file:
+        yield from csv.DictReader(file)
+
+
+def split_chunks(path, count):
+    """
+    Split a CSV file into byte ranges starting on line boundaries.
+
+    Rows must not contain quoted line breaks, which is the case of the permit exports.
+
+    Args:
+        path (str): Path to the CSV file.
+        count (int): Number of chunks wanted. Small files may yield fewer.
+
+    Returns:
+        tuple: The header fieldnames and a list of (start, end) byte offsets.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as file:
+        header = file.readline()
+        boundaries = [file.tell()]
+        for index in range(1, count):
+            file.seek(max(size * index // count, boundaries[-1]))
+            file.readline()  # Move to the start of the next line
+            if file.tell() > boundaries[-1]:
+                boundaries.append(file.tell())
+        if boundaries[-1] < size:
+            boundaries.append(size)
+    fieldnames = next(csv.reader([header.decode('utf-8')]))
+    return fieldnames, list(zip(boundaries, boundaries[1:]))
+
+
+def transform_chunk(path, fieldnames, start, end):
+    """
+    Build the food truck documents of the CSV rows between two byte offsets.
+    """
+    with open(path, 'rb') as file:
+        file.seek(start)
+        text = file.read(end - start).decode('utf-8')
+    return [transform_row(row) for row in csv.DictReader(io.StringIO(text, newline=''), fieldnames=fieldnames)]
+
+
+def parallel_transform(path, workers):
+    """
+    Stream the food truck documents of a CSV file, transforming its rows in a process pool.
+
+    The file is split into byte-range chunks transformed by `workers` processes. Documents
+    are yielded in file order, exactly as `map(transform_row, read_rows(path))` would.
+    """
+    fieldnames, chunks = split_chunks(path, workers * CHUNKS_PER_WORKER)
+    starts, ends = zip(*chunks) if chunks else ((), ())
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for documents in executor.map(transform_chunk, [path] * len(chunks), [fieldnames] * len(chunks), starts, ends):
+            yield from documents
+
+
+def split_food_items(value):
+    """
+    Split the ':' separated 'FoodItems' column of a CSV row into a list of stripped, non-empty food items.
+    """
+    items = str(value).split(':') if value else []
+    return [item.strip() for item in items if item.strip()]
+
+
+def food_name(food_item):
+    """
+    Return the name under which a food item is stored in the food collection.
+    """
+    return food_item.strip().title()
+
+
+def food_key(food_item):
+    """
+    Return the normalized key of a food item or food name: lowercased words without accents
+    or punctuation, so 'Tacos', ' tacos' and 'TACOS!' share the key 'tacos'.
+    """
+    return ' '.join(tokenize(food_item))
+
+
+def food_keys(food_items):
+    """
+    Return the sorted, distinct non-empty keys of a list of food items.
+    """
+    return sorted({food_key(item) for item in food_items} - {''})
+
+
+def content_hash(document):
+    """
+    Return a digest of the content of a food truck document, used to detect changes between two seeds.
+
+    Hashing the transformed document rather than the raw row means a change in the
+    transform also marks the affected documents as changed.
+    """
+    content = {key: value for key, value in document.items() if key not in ('_id', 'row_hash')}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def transform_row(row):
+    """
+    Build the food truck document of a CSV row.
+
+    Besides the FoodTruck fields, the document keeps the 'locationid' and 'permit' of the
+    row and a hash of its content so later seeds can sync it incrementally.
+
+    Args:
+        row (dict): Row of the food truck permits CSV file.
+
+    Returns:
+        dict: Food truck document ready to be inserted into the food_truck collection.
+    """
+    document = {
+        'location_id': str(row['locationid']),
+        'permit': str(row['permit']),
+        'applicant': str(row['Applicant']),
+        'facility_type': str(row['FacilityType']) if row['FacilityType'] else 'Unknown',
+        'location_description': str(row['LocationDescription']),
+        'address': str(row['Address']),
+        'status': str(row['Status']),
+        'food_items': split_food_items(row['FoodItems']),
+        'food_keys': food_keys(split_food_items(row['FoodItems'])),  # Multikey index of the food filter
+        'approved_at': datetime.strptime(str(row['Approved']), APPROVED_DATE_FORMAT) if row['Approved'] else None,
+        'location': {'type': 'Point', 'coordinates': [float(row['Longitude']), float(row['Latitude'])]},  # GeoJSON format for coordinates
+        'open_hours': parse_open_hours(row['dayshours'])
+    }
+    # Minute-of-week intervals queried by the open_at / open_now filters
+    document['open_intervals'] = open_intervals(document['open_hours'])
+    document['row_hash'] = content_hash(document)
+    return document
+
+
+def pandas_transform(path, chunk_size=10000, skipped=None):
+    """
+    Stream the food truck documents of a CSV file, transforming its columns with pandas.
+
+    The CSV is read chunk_size rows at a time, with only the columns of the transform, all as
+    strings like csv.DictReader. Dates, coordinates and food items are converted for a whole
+    chunk at once, and the open hours once per distinct 'dayshours' value of the chunk.
+    Documents are yielded in file order, exactly as `map(transform_row, read_rows(path))`
+    would, except for rows whose coordinates are missing or not numbers, which transform_row
+    fails on and are left out here. Rows at 0, 0, the placeholder of trucks without a
+    location, are kept as transform_row keeps them.
+
+    Args:
+        path (str): Path to the CSV file.
+        chunk_size (int): Number of rows converted at a time.
+        skipped (list): If given, the location id of each row left out is appended.
+    """
+    chunks = pd.read_csv(
+        path, usecols=CSV_COLUMNS, dtype=str, keep_default_na=False, encoding='utf-8', chunksize=chunk_size,
+    )
+    for chunk in chunks:
+        # Coordinates float() cannot parse are left out, the others are parsed by float() itself
+        valid = (
+            pd.to_numeric(chunk['Latitude'], errors='coerce').notna()
+            & pd.to_numeric(chunk['Longitude'], errors='coerce').notna()
+        )
+        if skipped is not None:
+            skipped.extend(chunk.loc[~valid, 'locationid'])
+        chunk = chunk[valid]
+        if chunk.empty:
+            continue
+        longitudes = chunk['Longitude'].astype(float).tolist()
+        latitudes = chunk['Latitude'].astype(float).tolist()
+
+        approved = pd.to_datetime(chunk['Approved'].where(chunk['Approved'] != ''), format=APPROVED_DATE_FORMAT)
+        approved_at = [None if pd.isna(value) else value.to_pydatetime() for value in approved]
+
+        facility_types = chunk['FacilityType'].where(chunk['FacilityType'] != '', 'Unknown')
+
+        # One row per food item, keyed by the index of the truck row
+        items = chunk['FoodItems'].str.split(':').explode().str.strip()
+        items = items[items != '']
+        keys = items.map({item: food_key(item) for item in items.unique()})
+        keys = keys[keys != '']
+        food_items = items.groupby(level=0, sort=False).agg(list).to_dict()
+        keys_by_row = {index: sorted(set(row_keys)) for index, row_keys in keys.groupby(level=0, sort=False).agg(list).items()}
+
+        # parse_open_hours is memoized, open_intervals is computed once per distinct value
+        intervals = {value: open_intervals(parse_open_hours(value)) for value in chunk['dayshours'].unique()}
+
+        columns = zip(
+            chunk.index, chunk['locationid'], chunk['permit'], chunk['Applicant'], facility_types,
+            chunk['LocationDescription'], chunk['Address'], chunk['Status'], approved_at,
+            longitudes, latitudes, chunk['dayshours'],
+        )
+        for (index, location_id, permit, applicant, facility_type, location_description, address, status,
+             approved_at_value, longitude, latitude, dayshours) in columns:
+            document = {
+                'location_id': location_id,
+                'permit': permit,
+                'applicant': applicant,
+                'facility_type': facility_type,
+                'location_description': location_description,
+                'address': address,
+                'status': status,
+                'food_items': food_items.get(index, []),
+                'food_keys': keys_by_row.get(index, []),
+                'approved_at': approved_at_value,
+                'location': {'type': 'Point', 'coordinates': [longitude, latitude]},
+                'open_hours': parse_open_hours(dayshours),
+            }
+            # Copies, documents must not share the intervals of their dayshours value
+            document['open_intervals'] = [dict(interval) for interval in intervals[dayshours]]
+            document['row_hash'] = content_hash(document)
+            yield document
+
+
+def food_names(food_trucks):
+    """
+    Return the set of non-empty food names served by a batch of food trucks.
+    """
+    names = {food_name(item) for food_truck in food_trucks for item in food_truck['food_items']}
+    names.discard('')
+    return names
+
+
+def food_truck_counts(food_trucks):
+    """
+    Return the number of food trucks serving each food name.
+    """
+    return Counter(name for food_truck in food_trucks for name in food_names([food_truck]))
+
+
+def food_upserts(food_trucks):
+    """
+    Build the upserts adding a batch of stored food trucks to the foods they serve.
+
+    Names are deduplicated within the batch; the upserts deduplicate them across batches.
+    A food gets its normalized key when inserted and its truck_count is incremented batch
+    by batch, so the food collection never has to be rebuilt from a scan of every food
+    truck. truck_count ranks the food autocomplete; the trucks serving a food are found
+    through the food_keys index of the food trucks rather than stored on the food.
+    """
+    return [
+        UpdateOne({'name': name}, {'$setOnInsert': {'key': food_key(name)}, '$inc': {'truck_count': count}}, upsert=True)
+        for name, count in sorted(food_truck_counts(food_trucks).items())
+    ]
+
+
+def food_removals(food_trucks):
+    """
+    Build the updates removing stored food trucks from the foods they serve, before the
+    trucks are replaced or deleted. Foods left with no truck are deleted by the caller.
+    """
+    return [
+        UpdateOne({'name': name}, {'$inc': {'truck_count': -count}})
+        for name, count in sorted(food_truck_counts(food_trucks).items())
+    ]
+
+
+def write_batch(food_trucks, food_truck_collection, food_collection):
+    """
+    Write a batch of food truck documents and their foods with unordered bulk writes.
+    """
+    food_truck_collection.insert_many(food_trucks, ordered=False)
+    upserts = food_upserts(food_trucks)
+    if upserts:
+        food_collection.bulk_write(upserts, ordered=False)
+
+
+def stored_hashes(food_truck_collection):
+    """
+    Return the row hash of every stored food truck, keyed by location id.
+    """
+    documents = food_truck_collection.find({'location_id': {'$exists': True}}, {'location_id': 1, 'row_hash': 1, '_id': 0})
+    return {document['location_id']: document.get('row_hash') for document in documents}
+
+
+def changed_food_trucks(food_trucks, hashes):
+    """
+    Return the food trucks that are new or changed since the last seed.
+
+    Args:
+        food_trucks (list): Food truck documents built by transform_row.
+        hashes (dict): Stored row hashes keyed by location id, as returned by stored_hashes.
+    """
+    return [food_truck for food_truck in food_trucks if hashes.get(food_truck['location_id']) != food_truck['row_hash']]
+
+
+def stored_food_trucks(food_truck_collection, location_ids):
+    """
+    Return the stored food trucks with the given location ids, keyed by location id, with
+    the fields their foods and terms are derived from.
+    """
+    documents = food_truck_collection.find({'location_id': {'$in': location_ids}}, SYNC_PROJECTION)
+    return {document['location_id']: document for document in documents}
+
+
+def sync_upserts(food_trucks):
+    """
+    Build the upserts replacing stored food trucks with the same location id, or inserting them.
+    """
+    return [ReplaceOne({'location_id': food_truck['location_id']}, food_truck, upsert=True) for food_truck in food_trucks]
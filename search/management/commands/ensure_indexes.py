@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from foodTruck.db_connection import db
+from search.indexes import ensure_all_indexes
+
+
+class Command(BaseCommand):
+    # Description of the command for manage.py help text
+    help = 'Creates the MongoDB indexes of the food truck and food collections'
+
+    def handle(self, *args, **options):
+        for name, indexes in ensure_all_indexes(db).items():
+            self.stdout.write('{}: {}'.format(name, ', '.join(indexes)))
+        self.stdout.write(self.style.SUCCESS('Indexes created'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from foodTruck.db_connection import db
+from search import export
+
+# Accessing MongoDB collections
+food_truck_collection = db['food_truck']
+
+
+class Command(BaseCommand):
+    # Description of the command for manage.py help text
+    help = 'Exports a table of the food truck data to a Parquet or Arrow IPC file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--table',
+            choices=list(export.EXPORT_TABLES),
+            default='trucks',
+            help=(
+                'trucks: one row per food truck, with its location flattened. '
+                'food_items: one row per food item of each truck. '
+                'open_intervals: one row per minute-of-week open interval of each truck.'
+            ),
+        )
+        parser.add_argument('--format', choices=list(export.EXPORT_FORMATS), default='parquet', help='Format of the file')
+        parser.add_argument('--output', help='Path of the file, food_truck-<table>.<format> by default')
+        parser.add_argument('--batch-size', type=int, default=None, help='Number of documents read and written per batch')
+
+    def handle(self, *args, **options):
+        if export.pa is None:
+            raise CommandError('pyarrow is not installed, run pip install pyarrow')
+        extension = export.EXPORT_FORMATS[options['format']][1]
+        output = options['output'] or 'food_truck-{}{}'.format(options['table'], extension)
+        row_count = export.write_export(food_truck_collection, output, options['table'], options['format'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Exported {} rows to {}'.format(row_count, output)))
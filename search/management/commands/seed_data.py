@@ -1,52 +1,187 @@
-import csv
-from datetime import datetime
-from django.core.management.base import BaseCommand
+import time
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
 from foodTruck.db_connection import db
-from search.utils import parse_open_hours
+from foodTruck.data_version import bump_data_version
+from search import ingest
+from search.ingest import (
+    DEFAULT_CSV_PATH, SYNC_PROJECTION, batched, changed_food_trucks, food_removals, food_upserts, pandas_transform,
+    parallel_transform, read_rows, stored_food_trucks, stored_hashes, sync_upserts, transform_row, write_batch,
+)
+from search.indexes import ensure_indexes
+from search.text_index import rebuild_term_index, term_additions, term_removals
 
 # Accessing MongoDB collections
 food_truck_collection = db['food_truck']
 food_collection = db['food']
+food_truck_term_collection = db['food_truck_terms']
+
+# Minimum number of seconds between two progress reports
+REPORT_INTERVAL = 2
+
+# Suffix of the collections a shadow seed is written to before they replace the live ones
+SHADOW_SUFFIX = '_shadow'
 
 class Command(BaseCommand):
     # Description of the command for manage.py help text
     help = 'Seeds the food truck data from a CSV file'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=DEFAULT_CSV_PATH, help='Path to the food truck permits CSV file')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows written per bulk write')
+        parser.add_argument('--workers', type=int, default=1, help='Number of processes transforming the CSV rows')
+        parser.add_argument(
+            '--parser',
+            choices=['csv', 'pandas'],
+            default='csv',
+            help=(
+                'csv: transform the rows one at a time. '
+                'pandas: convert the columns of chunks of rows at once, requires pandas.'
+            ),
+        )
+        parser.add_argument(
+            '--mode',
+            choices=['full', 'incremental', 'shadow'],
+            default='full',
+            help=(
+                'full: delete everything then insert all rows. '
+                'incremental: only upsert new or changed rows and delete the missing ones. '
+                'shadow: load shadow collections then swap them with the live ones.'
+            ),
+        )
+
     def handle(self, *args, **options):
-        # Clear existing data in collections
-        food_truck_collection.delete_many({})
-        food_collection.delete_many({})
-        
-        # Path to the CSV file containing food truck data
-        csv_file_path = 'data/food-truck-data.csv'
-        # Set to keep track of unique food items
-        foods_set = set()
-        
-        with open(csv_file_path, 'r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                # Split food items by ':' and strip leading/trailing whitespace
-                food_items = str(row['FoodItems']).strip().split(':') if row['FoodItems'] else []
-                # Iterate over food items and add to food collection if not already present
-                for food in food_items:
-                    if food.title() not in foods_set:
-                        foods_set.add(food.title())
-                        food_collection.insert_one({'name': food.strip().title()})
-                
-                # Construct data object for food truck document
-                data = {
-                    'applicant': str(row['Applicant']),
-                    'facility_type': str(row['FacilityType']) if row['FacilityType'] else 'Unknown',
-                    'location_description': str(row['LocationDescription']),
-                    'address': str(row['Address']),
-                    'status': str(row['Status']),
-                    'food_items': food_items, 
-                    'approved_at': datetime.strptime(str(row['Approved']), '%m/%d/%Y %I:%M:%S %p') if row['Approved'] else None,
-                    'location': {'type': 'Point', 'coordinates': [float(row['Longitude']), float(row['Latitude'])]},  # GeoJSON format for coordinates
-                    'open_hours' : parse_open_hours(row['dayshours'])
-                }
-                # Insert food truck data into MongoDB
-                food_truck_collection.insert_one(data)
-        
+        self.start = self.last_report = time.monotonic()
+        skipped = []
+        if options['parser'] == 'pandas':
+            if ingest.pd is None:
+                raise CommandError('pandas is not installed, run pip install pandas')
+            if options['workers'] > 1:
+                raise CommandError('--workers is not supported by the pandas parser')
+            food_trucks = pandas_transform(options['path'], skipped=skipped)
+        elif options['workers'] > 1:
+            food_trucks = parallel_transform(options['path'], options['workers'])
+        else:
+            food_trucks = map(transform_row, read_rows(options['path']))
+        batches = batched(food_trucks, options['batch_size'])
+
+        if options['mode'] == 'incremental':
+            # The term index is updated with the changed trucks only
+            row_count, changed = self.sync(batches, options['batch_size'])
+        else:
+            if options['mode'] == 'shadow':
+                row_count = self.load_and_swap(batches)
+            else:
+                # Clear existing data in collections
+                food_truck_collection.delete_many({})
+                food_collection.delete_many({})
+                row_count = self.load(batches, food_truck_collection, food_collection)
+            # Build the inverted index used by the q parameter of the search endpoint
+            rebuild_term_index(food_truck_collection, food_truck_term_collection)
+            changed = True
+
+        if changed:
+            # Invalidate the response caches and in-memory indexes of the running servers
+            bump_data_version()
+
         # Display success message
+        self.report(row_count, force=True)
+        if skipped:
+            self.stdout.write(self.style.WARNING('{} rows skipped for invalid coordinates'.format(len(skipped))))
         self.stdout.write(self.style.SUCCESS('Data seeded successfully'))
+
+    def load(self, batches, food_trucks, foods):
+        # Food names are deduplicated by upserts, which need the unique index on the name
+        ensure_indexes(food_trucks, food_truck_collection.name)
+        ensure_indexes(foods, food_collection.name)
+
+        # Stream the CSV rows through the transform into batched bulk writes
+        row_count = 0
+        for batch in batches:
+            write_batch(batch, food_trucks, foods)
+            row_count += len(batch)
+            self.report(row_count)
+        return row_count
+
+    def load_and_swap(self, batches):
+        # Load into empty shadow collections, the live ones keep serving reads meanwhile
+        shadow_food_trucks = db[food_truck_collection.name + SHADOW_SUFFIX]
+        shadow_foods = db[food_collection.name + SHADOW_SUFFIX]
+        shadow_food_trucks.drop()
+        shadow_foods.drop()
+        row_count = self.load(batches, shadow_food_trucks, shadow_foods)
+
+        # Each rename atomically replaces a live collection with its complete shadow
+        shadow_food_trucks.rename(food_truck_collection.name, dropTarget=True)
+        shadow_foods.rename(food_collection.name, dropTarget=True)
+        return row_count
+
+    def sync(self, batches, batch_size):
+        ensure_indexes(food_truck_collection)
+        ensure_indexes(food_collection)
+
+        hashes = stored_hashes(food_truck_collection)
+        # A missing term index, or one written before postings were bucketed, is rebuilt
+        update_terms = food_truck_term_collection.find_one({'bucket': {'$exists': True}}, {'_id': 1}) is not None
+        seen = set()
+        row_count = inserted = updated = 0
+        for batch in batches:
+            seen.update(food_truck['location_id'] for food_truck in batch)
+
+            # Only new or changed rows are written
+            changed = changed_food_trucks(batch, hashes)
+            if changed:
+                location_ids = [food_truck['location_id'] for food_truck in changed if food_truck['location_id'] in hashes]
+                stored = stored_food_trucks(food_truck_collection, location_ids)
+                # Replaced trucks keep their id, their stored version leaves its foods first
+                for food_truck in changed:
+                    stored_truck = stored.get(food_truck['location_id'])
+                    food_truck['_id'] = stored_truck['_id'] if stored_truck else ObjectId()
+                self.write_foods(food_removals(stored.values()))
+                if update_terms:
+                    self.write_terms(term_removals(stored.values()), ordered=True)
+                food_truck_collection.bulk_write(sync_upserts(changed), ordered=False)
+                self.write_foods(food_upserts(changed))
+                if update_terms:
+                    self.write_terms(term_additions(food_truck_term_collection, changed))
+                inserted += sum(1 for food_truck in changed if food_truck['location_id'] not in hashes)
+                updated += sum(1 for food_truck in changed if food_truck['location_id'] in hashes)
+
+            row_count += len(batch)
+            self.report(row_count)
+
+        # Delete the trucks missing from the CSV, including ones seeded before location ids were stored
+        removed = [location_id for location_id in hashes if location_id not in seen]
+        stale = {'$or': [{'location_id': {'$in': removed}}, {'location_id': {'$exists': False}}]}
+        deleted = 0
+        for batch in batched(food_truck_collection.find(stale, SYNC_PROJECTION), batch_size):
+            self.write_foods(food_removals(batch))
+            if update_terms:
+                self.write_terms(term_removals(batch), ordered=True)
+            deleted += food_truck_collection.delete_many({'_id': {'$in': [food_truck['_id'] for food_truck in batch]}}).deleted_count
+        if updated or deleted:
+            # Delete the foods no truck serves anymore, dropped by an updated or a deleted truck
+            food_collection.delete_many({'truck_count': {'$lte': 0}})
+        if not update_terms:
+            rebuild_term_index(food_truck_collection, food_truck_term_collection)
+
+        self.stdout.write('{} inserted, {} updated, {} deleted'.format(inserted, updated, deleted))
+        return row_count, bool(inserted or updated or deleted or not update_terms)
+
+    def write_foods(self, updates):
+        # Unordered, the updates of a batch touch distinct foods
+        if updates:
+            food_collection.bulk_write(updates, ordered=False)
+
+    def write_terms(self, requests, ordered=False):
+        if requests:
+            food_truck_term_collection.bulk_write(requests, ordered=ordered)
+
+    def report(self, row_count, force=False):
+        # Display the number of rows processed so far and the throughput, at most every REPORT_INTERVAL seconds
+        now = time.monotonic()
+        if force or now - self.last_report >= REPORT_INTERVAL:
+            elapsed = now - self.start
+            rate = row_count / elapsed if elapsed else 0
+            self.stdout.write('{} rows processed ({:.0f} rows/sec)'.format(row_count, rate))
+            self.last_report = now
@@ -0,0 +1,145 @@
+import bisect
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# Days of the week in the order of datetime.weekday(), the week starts on Monday
+DAY_NAMES = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+
+def parse_time(text):
+    """
+    Convert a time of the open hours like '10AM' or '12PM' to minutes since midnight.
+
+    Raises:
+        ValueError: If the time is not an hour from 1 to 12 followed by AM or PM.
+    """
+    text = text.strip().upper()
+    hour, meridiem = text[:-2], text[-2:]
+    if meridiem not in ('AM', 'PM') or not hour.isdigit() or not 1 <= int(hour) <= 12:
+        raise ValueError('invalid time {!r}'.format(text))
+    # 12AM is midnight and 12PM is noon
+    return (int(hour) % 12 + (12 if meridiem == 'PM' else 0)) * 60
+
+
+def open_intervals(open_hours):
+    """
+    Normalize the open hours of a food truck into minute-of-week intervals.
+
+    Slots ending at or before their start, like '8PM-2AM', end on the next day. A slot
+    running past the end of Sunday wraps to the start of the week. Overlapping and
+    adjacent intervals are merged.
+
+    Args:
+        open_hours (dict): Time slots by day name, as returned by parse_open_hours.
+
+    Returns:
+        list: Sorted, disjoint {'start': minute, 'end': minute} intervals, with minutes
+            counted from Monday midnight and end excluded.
+    """
+    intervals = []
+    for day, time_slots in open_hours.items():
+        if day not in DAY_NAMES:
+            continue
+        day_start = DAY_NAMES.index(day) * MINUTES_PER_DAY
+        for time_slot in time_slots:
+            try:
+                start, end = parse_time(time_slot['start_time']), parse_time(time_slot['end_time'])
+            except (KeyError, TypeError, ValueError):
+                continue  # Slots that cannot be read are treated as closed
+            if end <= start:
+                end += MINUTES_PER_DAY
+            start, end = day_start + start, day_start + end
+            if end > MINUTES_PER_WEEK:
+                intervals.append((0, end - MINUTES_PER_WEEK))
+                end = MINUTES_PER_WEEK
+            intervals.append((start, end))
+
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [{'start': start, 'end': end} for start, end in merged]
+
+
+def minute_of_week(moment):
+    """
+    Return the minute of the week of a datetime in the time zone of the open hours.
+
+    Naive datetimes are taken as local times of the food trucks.
+    """
+    if timezone.is_aware(moment):
+        moment = moment.astimezone(ZoneInfo(settings.OPEN_HOURS_TIME_ZONE))
+    return moment.weekday() * MINUTES_PER_DAY + moment.hour * 60 + moment.minute
+
+
+def parse_open_at(value):
+    """
+    Return the minute of the week of an ISO 8601 datetime like '2024-05-06T12:30'.
+
+    Raises:
+        ValueError: If the value is not an ISO 8601 datetime.
+    """
+    return minute_of_week(datetime.fromisoformat(value))
+
+
+def current_minute():
+    """
+    Return the current minute of the week in the time zone of the open hours.
+    """
+    return minute_of_week(timezone.now())
+
+
+def open_filter(minute):
+    """
+    Return the MongoDB filter matching the food trucks open at a minute of the week.
+
+    Both bounds apply to the same interval through $elemMatch, which the compound multikey
+    index on open_intervals.start and open_intervals.end answers with a range scan.
+    """
+    return {'open_intervals': {'$elemMatch': {'start': {'$lte': minute}, 'end': {'$gt': minute}}}}
+
+
+class OpenHoursIndex:
+    """
+    In-memory interval index of the open_intervals of food truck documents.
+
+    The intervals of every document are kept in NumPy arrays sorted by start, so the
+    intervals started at a minute are a prefix found by binary search, and the open ones
+    among them are those not ended yet. The intervals of a document are disjoint, so a
+    document is matched at most once.
+    """
+
+    def __init__(self, documents):
+        intervals = sorted(
+            (interval['start'], interval['end'], position)
+            for position, document in enumerate(documents)
+            for interval in document.get('open_intervals') or ()
+        )
+        self.size = len(documents)
+        self.starts = [start for start, _, _ in intervals]
+        self.ends = np.array([end for _, end, _ in intervals], dtype=np.int64)
+        self.positions = np.array([position for _, _, position in intervals], dtype=np.intp)
+
+    def open_positions(self, minute):
+        """
+        Return the positions of the documents open at a minute of the week.
+        """
+        started = bisect.bisect_right(self.starts, minute)
+        return self.positions[:started][self.ends[:started] > minute]
+
+    def open_mask(self, minute):
+        """
+        Return a boolean mask over the documents, True for the ones open at a minute of the week.
+        """
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.open_positions(minute)] = True
+        return mask
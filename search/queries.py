@@ -0,0 +1,669 @@
+from bisect import bisect_right
+
+from django.conf import settings
+
+from foodTruck.pagination import encode_cursor, page_params, split_page
+from .encoders import food_truck_encoder
+from .filters import TruckFilters
+from .geo import CoordinateStore, distance_page_stages, geo_near_stage
+from .ingest import food_key
+from .models import FoodTruck
+from .open_hours import current_minute, parse_open_at
+from .streaming import STREAM_CONTENT_TYPES
+from .tiles import tile_count
+from .text_index import short_word_filter
+from .utils import batched, validate_location_params, validate_limit_param
+
+
+class InvalidParameter(ValueError):
+    """
+    Raised when a query parameter is invalid, with the message returned to the client.
+    """
+
+
+def open_minute(query_params):
+    """
+    Return the minute of the week the food trucks must be open at, or None without filter.
+
+    open_at takes an ISO 8601 datetime, taken as a local time of the food trucks when it
+    has no offset. open_now=1 is the current time.
+
+    Raises:
+        InvalidParameter: If a parameter is invalid.
+    """
+    open_at = query_params.get('open_at', None)
+    open_now = query_params.get('open_now', None)
+    if open_now not in (None, '0', '1'):
+        raise InvalidParameter("invalid open_now parameter")
+    if open_at is not None and open_now == '1':
+        raise InvalidParameter("open_at cannot be combined with open_now")
+    if open_now == '1':
+        return current_minute()
+    if open_at is None:
+        return None
+    try:
+        return parse_open_at(open_at)
+    except ValueError:
+        raise InvalidParameter("invalid open_at parameter")
+
+
+def truck_filters(query_params):
+    """
+    Return the TruckFilters of the open_at, open_now and food query parameters.
+
+    food is matched against the normalized names of the food items of the trucks, so
+    'tacos' matches trucks serving 'Tacos' but not 'Fish Tacos'.
+
+    Raises:
+        InvalidParameter: If a parameter is invalid.
+    """
+    food = query_params.get('food', None)
+    if food is not None and not food_key(food):
+        raise InvalidParameter("invalid food parameter")
+    return TruckFilters(open_at=open_minute(query_params), food=food_key(food) if food is not None else None)
+
+
+# Named sets of FoodTruck fields accepted by the fields parameter. 'full' is the default
+# output, every field but the id.
+FIELD_PRESETS = {
+    'pin': ('id', 'applicant', 'location'),
+    'card': ('id', 'applicant', 'facility_type', 'address', 'status', 'food_items', 'location'),
+    'full': food_truck_encoder.fields,
+}
+
+
+def fields_param(params):
+    """
+    Return the DocumentEncoder of the food truck fields selected by the fields parameter.
+
+    fields is a comma separated list of FoodTruck field names and FIELD_PRESETS names,
+    e.g. 'pin' or 'applicant,location,food_items'. Only the selected fields are read from
+    MongoDB and returned. Without it, every field but the id is returned.
+
+    Raises:
+        InvalidParameter: If the parameter is invalid.
+    """
+    fields = params.get('fields', None)
+    if fields is None:
+        return food_truck_encoder
+    if not isinstance(fields, str):
+        raise InvalidParameter("invalid fields parameter")
+    selected = set()
+    for name in fields.split(','):
+        name = name.strip()
+        if name in FIELD_PRESETS:
+            selected.update(FIELD_PRESETS[name])
+        elif name in FoodTruck._fields:
+            selected.add(name)
+        else:
+            raise InvalidParameter("invalid fields parameter")
+    if selected == set(food_truck_encoder.fields):
+        return food_truck_encoder
+    return food_truck_encoder.select(selected)
+
+
+class NearbyQuery:
+    """
+    Validated parameters of a nearby food trucks request.
+
+    The sync and async views share the parsing and the response data, and only differ by
+    how the geo engine is called.
+
+    Raises:
+        InvalidParameter: If a parameter is invalid.
+    """
+
+    def __init__(self, query_params):
+        latitude = query_params.get('latitude', 0)
+        longitude = query_params.get('longitude', 0)
+        limit = query_params.get('limit', None)
+        sort = query_params.get('sort', None)
+        self.paginated = limit is not None or 'cursor' in query_params
+        # Results are always nearest first. sort=distance without a radius opts into ranking
+        # the trucks at any distance, the radius defaults to 1000 meters otherwise.
+        radius = query_params.get('radius', None if sort == 'distance' else 1000)
+
+        if not validate_location_params(latitude, longitude, 0 if radius is None else radius):
+            raise InvalidParameter("invalid location filter parameter")
+        if limit is not None and not validate_limit_param(limit):
+            raise InvalidParameter("invalid limit parameter")
+        if sort not in (None, 'distance'):
+            raise InvalidParameter("invalid sort parameter")
+        try:
+            # Pages are keyed on (distance, _id) so ties at the same distance are never skipped
+            self.limit, self.after = page_params(query_params, 2)
+        except ValueError:
+            raise InvalidParameter("invalid cursor parameter")
+        self.filters = truck_filters(query_params)
+        self.encoder = fields_param(query_params)
+        self.cluster_zoom = cluster_param(query_params)
+        if self.cluster_zoom is not None and self.paginated:
+            raise InvalidParameter("cluster cannot be combined with pagination")
+        self.projection = cluster_projection(self.encoder, self.cluster_zoom)
+
+        self.longitude, self.latitude = float(longitude), float(latitude)
+        self.radius = None if radius is None else float(radius)
+
+    def response_data(self, food_trucks, clusters=None):
+        """
+        Build the response data from the geo engine results.
+
+        Args:
+            food_trucks (list): Documents returned by GeoEngine.near, or the limit + 1
+                (distance, document) pairs returned by GeoEngine.page when paginating.
+            clusters (list): Clusters returned by GeoEngine.cluster, when clustering.
+        """
+        if not self.paginated:
+            return cluster_response(self.encoder.to_list(food_trucks), clusters)
+
+        nearest, has_more = split_page(food_trucks, self.limit)
+        next_cursor = encode_cursor(nearest[-1][0], nearest[-1][1].get('_id')) if has_more else None
+        food_trucks = self.encoder.to_list(document for _, document in nearest)
+        return {'count': len(food_trucks), 'data': food_trucks, 'next': next_cursor}
+
+
+class NearbyBatchQuery:
+    """
+    Validated body of a batch nearby request, {"queries": [...]}.
+
+    Each query is an object with the latitude and longitude of a point, and optionally a
+    radius in meters (default: 1000, null for unbounded), a limit and a filters object
+    holding open_at, open_now and food. Pagination is not supported. The fields of the
+    returned food trucks are selected for the whole batch by an optional fields string.
+
+    Raises:
+        InvalidParameter: If the body or one of the queries is invalid.
+    """
+
+    def __init__(self, data):
+        queries = data.get('queries') if isinstance(data, dict) else None
+        if not isinstance(queries, list) or not queries:
+            raise InvalidParameter("queries must be a non-empty list")
+        if len(queries) > settings.NEARBY_BATCH_MAX_QUERIES:
+            raise InvalidParameter("at most {} queries are allowed".format(settings.NEARBY_BATCH_MAX_QUERIES))
+        self.queries = []
+        for position, query in enumerate(queries):
+            try:
+                self.queries.append(self.near_kwargs(query))
+            except InvalidParameter as error:
+                raise InvalidParameter("queries[{}]: {}".format(position, error))
+        self.encoder = fields_param(data)
+
+    @staticmethod
+    def near_kwargs(query):
+        """
+        Validate a query of the batch and return it as keyword arguments of GeoEngine.near.
+        """
+        if not isinstance(query, dict):
+            raise InvalidParameter("query must be an object")
+        latitude = query.get('latitude', None)
+        longitude = query.get('longitude', None)
+        radius = query.get('radius', 1000)
+        limit = query.get('limit', None)
+        filters = query.get('filters', None) or {}
+
+        if latitude is None or longitude is None or not validate_location_params(latitude, longitude, 0 if radius is None else radius):
+            raise InvalidParameter("invalid location filter parameter")
+        if limit is not None and (isinstance(limit, bool) or not validate_limit_param(limit)):
+            raise InvalidParameter("invalid limit parameter")
+        if not isinstance(filters, dict):
+            raise InvalidParameter("filters must be an object")
+
+        # The filters take the same values as the query parameters of the nearby endpoint
+        filter_params = {
+            name: str(int(value) if isinstance(value, bool) else value)
+            for name, value in filters.items()
+            if value is not None
+        }
+        return {
+            'longitude': float(longitude),
+            'latitude': float(latitude),
+            'radius': None if radius is None else float(radius),
+            'limit': None if limit is None else int(limit),
+            'filters': truck_filters(filter_params),
+        }
+
+    def response_data(self, results):
+        """
+        Build the response data from the documents returned by GeoEngine.near_many.
+        """
+        results = [self.encoder.to_list(food_trucks) for food_trucks in results]
+        return {'count': len(results), 'results': [{'count': len(data), 'data': data} for data in results]}
+
+
+def bbox_param(query_params):
+    """
+    Return the bounding box of the bbox query parameter, or None without one.
+
+    bbox is 'min_longitude,min_latitude,max_longitude,max_latitude', e.g.
+    '-122.42,37.77,-122.40,37.79'. Boxes crossing the antimeridian are not supported.
+
+    Raises:
+        InvalidParameter: If the parameter is invalid.
+    """
+    bbox = query_params.get('bbox', None)
+    if bbox is None:
+        return None
+    try:
+        min_longitude, min_latitude, max_longitude, max_latitude = (float(value) for value in bbox.split(','))
+    except ValueError:
+        raise InvalidParameter("invalid bbox parameter")
+    if not (-180 <= min_longitude < max_longitude <= 180 and -90 <= min_latitude < max_latitude <= 90):
+        raise InvalidParameter("invalid bbox parameter")
+    return min_longitude, min_latitude, max_longitude, max_latitude
+
+
+def zoom_param(zoom):
+    """
+    Return the zoom level of a map request as an int.
+
+    Raises:
+        InvalidParameter: If the zoom level is not an integer from 0 to MAP_MAX_ZOOM.
+    """
+    try:
+        zoom = int(zoom)
+    except (TypeError, ValueError):
+        raise InvalidParameter("invalid zoom parameter")
+    if not 0 <= zoom <= settings.MAP_MAX_ZOOM:
+        raise InvalidParameter("invalid zoom parameter")
+    return zoom
+
+
+def cluster_param(query_params, zoom=None):
+    """
+    Return the zoom level the food trucks are clustered at, or None without clustering.
+
+    cluster=1 merges the food trucks closer than CLUSTER_RADIUS pixels at the zoom level of
+    the map, given by the zoom parameter, or by the zoom of the tile of a tile request.
+
+    Raises:
+        InvalidParameter: If a parameter is invalid.
+    """
+    cluster = query_params.get('cluster', None)
+    if cluster not in (None, '0', '1'):
+        raise InvalidParameter("invalid cluster parameter")
+    if cluster != '1':
+        return None
+    return zoom_param(query_params.get('zoom', None)) if zoom is None else zoom
+
+
+def cluster_projection(encoder, cluster_zoom):
+    """
+    Return the projection of the food trucks of a request, with their location when they
+    are clustered.
+    """
+    projection = encoder.projection
+    if cluster_zoom is not None:
+        projection['location'] = 1
+    return projection
+
+
+def cluster_response(food_trucks, clusters=None):
+    """
+    Return the count and data of the food trucks of a response, and its clusters when
+    clustering. Food trucks merged into a cluster are only counted in the cluster.
+    """
+    data = {'count': len(food_trucks), 'data': food_trucks}
+    if clusters is not None:
+        data['clusters'] = clusters
+    return data
+
+
+class BBoxQuery:
+    """
+    Validated parameters of a bounding box request: the required bbox, the open_at, open_now
+    and food filters, the limit and cursor of a page in _id order, and the cluster and zoom
+    parameters of clustering.
+
+    Raises:
+        InvalidParameter: If a parameter is invalid.
+    """
+
+    def __init__(self, query_params):
+        self.bbox = bbox_param(query_params)
+        if self.bbox is None:
+            raise InvalidParameter("invalid bbox parameter")
+        limit = query_params.get('limit', None)
+        if limit is not None and not validate_limit_param(limit):
+            raise InvalidParameter("invalid limit parameter")
+        try:
+            self.limit, self.after = page_params(query_params, 1)
+        except ValueError:
+            raise InvalidParameter("invalid cursor parameter")
+        self.filters = truck_filters(query_params)
+        self.encoder = fields_param(query_params)
+        self.cluster_zoom = cluster_param(query_params)
+        if self.cluster_zoom is not None and self.limit is not None:
+            raise InvalidParameter("cluster cannot be combined with pagination")
+        self.projection = cluster_projection(self.encoder, self.cluster_zoom)
+
+    def inside_kwargs(self):
+        """
+        Return the keyword arguments of GeoEngine.inside.
+        """
+        kwargs = {'filters': self.filters, 'projection': self.projection}
+        if self.limit is None:
+            return kwargs
+        # One extra truck is fetched to know whether there is a next page
+        return dict(kwargs, limit=self.limit + 1, after=self.after[0] if self.after else None)
+
+    def response_data(self, food_trucks, clusters=None):
+        """
+        Build the response data from the documents returned by GeoEngine.inside, and the
+        clusters returned by GeoEngine.cluster when clustering.
+        """
+        if self.limit is None:
+            return cluster_response(self.encoder.to_list(food_trucks), clusters)
+
+        food_trucks, has_more = split_page(food_trucks, self.limit)
+        next_cursor = encode_cursor(food_trucks[-1]['_id']) if has_more else None
+        food_trucks = self.encoder.to_list(food_trucks)
+        return {'count': len(food_trucks), 'data': food_trucks, 'next': next_cursor}
+
+
+class TileQuery:
+    """
+    Validated parameters of an XYZ tile request: the zoom, x and y of the tile taken from
+    the path, the open_at, open_now and food filters, and the cluster parameter clustering
+    the food trucks at the zoom of the tile.
+
+    Raises:
+        InvalidParameter: If a parameter is invalid.
+    """
+
+    def __init__(self, zoom, x, y, query_params):
+        self.zoom = zoom_param(zoom)
+        if not (0 <= x < tile_count(self.zoom) and 0 <= y < tile_count(self.zoom)):
+            raise InvalidParameter("invalid tile coordinates")
+        self.x, self.y = x, y
+        self.filters = truck_filters(query_params)
+        self.encoder = fields_param(query_params)
+        self.cluster_zoom = cluster_param(query_params, zoom=self.zoom)
+        self.projection = cluster_projection(self.encoder, self.cluster_zoom)
+
+    def response_data(self, food_trucks, clusters=None):
+        """
+        Build the response data from the documents returned by GeoEngine.tile, and the
+        clusters returned by GeoEngine.cluster when clustering.
+        """
+        return cluster_response(self.encoder.to_list(food_trucks), clusters)
+
+
+class FacetsQuery:
+    """
+    Validated parameters of a facets request: the bbox, open_at, open_now and food filters
+    of the counted food trucks and the food_limit number of foods to return.
+
+    Raises:
+        InvalidParameter: If a parameter is invalid.
+    """
+
+    def __init__(self, query_params):
+        food_limit = query_params.get('food_limit', settings.FACET_FOOD_LIMIT)
+        if not validate_limit_param(food_limit):
+            raise InvalidParameter("invalid food_limit parameter")
+        self.food_limit = int(food_limit)
+        self.bbox = bbox_param(query_params)
+        self.filters = truck_filters(query_params)
+
+
+class DensityQuery:
+    """
+    Validated parameters of a density request: the zoom level of the tiles, and the bbox,
+    open_at, open_now and food filters of the counted food trucks.
+
+    Raises:
+        InvalidParameter: If a parameter is invalid.
+    """
+
+    def __init__(self, query_params):
+        self.zoom = zoom_param(query_params.get('zoom', None))
+        self.bbox = bbox_param(query_params)
+        self.filters = truck_filters(query_params)
+
+    def response_data(self, cells):
+        """
+        Build the response data from the cells returned by GeoEngine.density.
+        """
+        return {'zoom': self.zoom, 'count': sum(cell['count'] for cell in cells), 'cells': cells}
+
+
+class AllQuery:
+    """
+    Validated parameters of an all food trucks request.
+
+    Raises:
+        InvalidParameter: If a parameter is invalid.
+    """
+
+    def __init__(self, query_params):
+        self.stream_format = query_params.get('stream', None)
+        if self.stream_format is not None and self.stream_format not in STREAM_CONTENT_TYPES:
+            raise InvalidParameter("invalid stream parameter")
+        limit = query_params.get('limit', None)
+        if limit is not None and not validate_limit_param(limit):
+            raise InvalidParameter("invalid limit parameter")
+        try:
+            self.limit, self.after = page_params(query_params, 1)
+        except ValueError:
+            raise InvalidParameter("invalid cursor parameter")
+        if self.stream_format and self.limit is not None:
+            raise InvalidParameter("stream cannot be combined with pagination")
+        self.encoder = fields_param(query_params)
+
+    def find_args(self):
+        """
+        Return the filter and keyword arguments of the find() call reading the food trucks.
+        """
+        if self.stream_format:
+            return {}, {'projection': self.encoder.projection, 'batch_size': settings.STREAM_BATCH_SIZE}
+        if self.limit is None:
+            return {}, {'projection': self.encoder.projection}
+        # Seek past the last _id of the previous page through the _id index, so deep pages
+        # cost as much as the first one
+        query = {'_id': {'$gt': self.after[0]}} if self.after else {}
+        return query, {'projection': self.encoder.projection, 'sort': [('_id', 1)], 'limit': self.limit + 1}
+
+    def response_data(self, food_trucks):
+        """
+        Build the response data from the documents read with find_args().
+        """
+        if self.limit is None:
+            food_trucks = self.encoder.to_list(food_trucks)
+            return {'count': len(food_trucks), 'data': food_trucks}
+
+        food_trucks, has_more = split_page(food_trucks, self.limit)
+        next_cursor = encode_cursor(food_trucks[-1]['_id']) if has_more else None
+        food_trucks = self.encoder.to_list(food_trucks)
+        return {'count': len(food_trucks), 'data': food_trucks, 'next': next_cursor}
+
+
+class SearchQuery:
+    """
+    Validated parameters of a food truck search request, turned into an aggregation pipeline.
+
+    Raises:
+        InvalidParameter: If a parameter is invalid.
+    """
+
+    def __init__(self, query_params):
+        self.search_query = query_params.get('q', '')
+        self.status = query_params.get('status', None)
+        self.facility_type = query_params.get('facility_type', None)
+        latitude = query_params.get('latitude', None)
+        longitude = query_params.get('longitude', None)
+        radius = query_params.get('radius', None)
+        limit = query_params.get('limit', None)
+        sort = query_params.get('sort', None)
+        self.stream_format = query_params.get('stream', None)
+
+        if latitude and longitude:
+            if not validate_location_params(latitude, longitude, radius if radius else 0):
+                raise InvalidParameter("invalid location filter parameter")
+
+        if limit is not None and not validate_limit_param(limit):
+            raise InvalidParameter("invalid limit parameter")
+        if sort not in (None, 'distance') or (sort == 'distance' and not (latitude and longitude)):
+            raise InvalidParameter("invalid sort parameter")
+        if self.stream_format is not None and self.stream_format not in STREAM_CONTENT_TYPES:
+            raise InvalidParameter("invalid stream parameter")
+        # Without a radius, the location only orders the results when sort=distance is asked for
+        self.by_distance = bool(latitude and longitude) and bool(radius or sort == 'distance')
+        try:
+            self.page_limit, self.after = page_params(query_params, 2 if self.by_distance else 1)
+        except ValueError:
+            raise InvalidParameter("invalid cursor parameter")
+        if self.stream_format and self.after is not None:
+            raise InvalidParameter("stream cannot be combined with pagination")
+        self.limit = None if limit is None else int(limit)
+        self.paginated = self.page_limit is not None and not self.stream_format
+        self.filters = truck_filters(query_params)
+        # Search results are returned as projected by MongoDB, the encoder only validates the
+        # selection. Without fields, every model field but the id, never the ingest fields.
+        self.fields = fields_param(query_params).fields
+
+        self.longitude = float(longitude) if self.by_distance else None
+        self.latitude = float(latitude) if self.by_distance else None
+        self.radius = float(radius) if self.by_distance and radius else None
+        # With sort=distance but neither a radius nor a page size, every matching truck is
+        # returned and rank() computes the distances. Pages are read through $geoNear with a (distance, _id) keyset instead,
+        # so a deep page never loads every match.
+        self.rank_by_distance = self.by_distance and not radius and self.page_limit is None
+
+    @property
+    def streams_from_cursor(self):
+        """
+        True if a streamed response can be written while the aggregation cursor is read.
+        """
+        return bool(self.stream_format) and not self.rank_by_distance
+
+    @property
+    def result_limit(self):
+        """
+        Number of results the pipeline returns at most, None if it returns every match.
+        """
+        if self.paginated:
+            return self.page_limit + 1
+        return self.limit or None
+
+    def pipelines(self, matched_ids=None):
+        """
+        Yield the aggregation pipelines of the search, run in turn until result_limit results
+        are read.
+
+        When the results are capped and not ordered by distance, the sorted ids resolved
+        for the q parameter are sent in batches of SEARCH_ID_BATCH_SIZE, starting after the
+        cursor, so a page of a common word does not send every matching id to MongoDB.
+
+        Args:
+            matched_ids (list): Sorted ids returned by resolve_query, see pipeline.
+        """
+        if not matched_ids or self.by_distance or self.stream_format or self.result_limit is None:
+            yield self.pipeline(matched_ids)
+            return
+        if self.paginated and self.after:
+            matched_ids = matched_ids[bisect_right(matched_ids, self.after[0]):]
+        for ids in batched(matched_ids, settings.SEARCH_ID_BATCH_SIZE):
+            yield self.pipeline(ids)
+
+    def pipeline(self, matched_ids=None):
+        """
+        Build the aggregation pipeline of the search.
+
+        Args:
+            matched_ids (list): Ids of the food trucks matching the long words of the q
+                parameter, resolved with the inverted index. None if there is no q parameter
+                or it only has words shorter than MIN_PREFIX_LENGTH.
+        """
+        pipeline = []
+        match_stage = {}
+
+        if matched_ids is not None:
+            match_stage['_id'] = {'$in': matched_ids}
+
+        if self.search_query:
+            match_stage.update(short_word_filter(self.search_query))
+
+        if self.paginated and self.after and not self.by_distance:
+            match_stage.setdefault('_id', {})['$gt'] = self.after[0]
+
+        if self.status:
+            match_stage['status'] = self.status
+
+        if self.facility_type:
+            match_stage['facility_type'] = self.facility_type
+
+        match_stage.update(self.filters.query())
+
+        if self.by_distance and not self.rank_by_distance:
+            after = self.after if self.paginated else None
+            pipeline.append(geo_near_stage(self.longitude, self.latitude, radius=self.radius, after=after))
+
+        if match_stage:
+            pipeline.append({'$match': match_stage})
+
+        if self.paginated and self.by_distance:
+            # One extra truck is fetched to know whether there is a next page
+            pipeline += distance_page_stages(self.page_limit + 1, after=self.after)
+        elif self.paginated:
+            pipeline += [{'$sort': {'_id': 1}}, {'$limit': self.page_limit + 1}]
+        elif self.limit:
+            pipeline.append({'$limit': self.limit})
+
+        pipeline.append({'$project': self.projection()})
+        return pipeline
+
+    def projection(self):
+        """
+        Return the $project specification of the results.
+
+        Only FoodTruck fields are projected, so the fields stored for ingestion and querying
+        (row_hash, location_id, permit, open_intervals, food_keys) never reach the response.
+        """
+        projection = {name: 1 for name in self.fields if name != 'id'}
+        if 'id' in self.fields:
+            projection['id'] = {'$toString': '$_id'}
+        if self.by_distance:
+            projection['distance'] = 1
+        if self.rank_by_distance:
+            # rank() reads the coordinates to compute the distances
+            projection['location'] = 1
+        if not self.paginated:
+            projection['_id'] = 0
+        return projection
+
+    @staticmethod
+    def count_pipeline(pipeline):
+        """
+        Return the pipeline counting the results of a pipeline built by pipeline().
+        """
+        return pipeline[:-1] + [{'$count': 'count'}]
+
+    def rank(self, result):
+        """
+        Order the aggregation results by distance when neither a radius nor a page size was given.
+        """
+        if not self.rank_by_distance:
+            return result
+        nearest = CoordinateStore(result).nearest(self.longitude, self.latitude)
+        result = [dict(document, distance=distance) for distance, document in nearest]
+        if 'location' not in self.fields:
+            for document in result:
+                del document['location']
+        return result
+
+    def response_data(self, result):
+        """
+        Build the response data from the ranked aggregation results.
+        """
+        if not self.paginated:
+            return {"count": len(result), 'data': result}
+
+        result, has_more = split_page(result, self.page_limit)
+        next_cursor = None
+        if has_more:
+            last = result[-1]
+            next_cursor = encode_cursor(last['distance'], last.get('_id')) if self.by_distance else encode_cursor(last.get('_id'))
+        for document in result:
+            document.pop('_id', None)
+        return {"count": len(result), 'data': result, 'next': next_cursor}
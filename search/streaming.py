@@ -0,0 +1,109 @@
+from django.http import StreamingHttpResponse
+
+# Formats accepted by the stream query parameter, with their content type
+STREAM_CONTENT_TYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Size in bytes above which buffered output is flushed to the client
+CHUNK_SIZE = 64 * 1024
+
+
+def _chunked(parts):
+    """
+    Group small byte strings into chunks of about CHUNK_SIZE bytes.
+    """
+    buffer, size = [], 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _json_parts(count, documents, encode):
+    yield '{{"count": {}, "data": ['.format(count).encode('utf-8')
+    for position, document in enumerate(documents):
+        yield (b', ' if position else b'') + encode(document)
+    yield b']}'
+
+
+def _ndjson_parts(documents, encode):
+    for document in documents:
+        yield encode(document) + b'\n'
+
+
+async def _async_chunked(parts):
+    buffer, size = [], 0
+    async for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+async def _async_json_parts(count, documents, encode):
+    yield '{{"count": {}, "data": ['.format(count).encode('utf-8')
+    position = 0
+    async for document in documents:
+        yield (b', ' if position else b'') + encode(document)
+        position += 1
+    yield b']}'
+
+
+async def _async_ndjson_parts(documents, encode):
+    async for document in documents:
+        yield encode(document) + b'\n'
+
+
+def streaming_response(stream_format, count, documents, encode):
+    """
+    Build a response serializing documents while they are read from a cursor.
+
+    Args:
+        stream_format (str): 'json' for the {"count", "data"} envelope of the regular
+            responses, or 'ndjson' for one JSON document per line.
+        count (int): Total number of documents, also sent in the X-Total-Count header.
+        documents (iterable): Documents to serialize, typically a pymongo cursor. Async
+            iterables such as the cursors of the async client are streamed asynchronously.
+        encode (callable): Function encoding one document to JSON bytes.
+
+    Returns:
+        StreamingHttpResponse: Response whose memory use does not depend on the number of documents.
+    """
+    if hasattr(documents, '__aiter__'):
+        if stream_format == 'ndjson':
+            content = _async_chunked(_async_ndjson_parts(documents, encode))
+        else:
+            content = _async_chunked(_async_json_parts(count, documents, encode))
+    elif stream_format == 'ndjson':
+        content = _chunked(_ndjson_parts(documents, encode))
+    else:
+        content = _chunked(_json_parts(count, documents, encode))
+    response = StreamingHttpResponse(content, content_type=STREAM_CONTENT_TYPES[stream_format])
+    response['X-Total-Count'] = str(count)
+    return response
+
+
+def json_encoder(encoder_class, serialize=None):
+    """
+    Return a function encoding one document to JSON bytes with a JSON encoder class.
+
+    Args:
+        encoder_class (type): json.JSONEncoder subclass, e.g. the DRF or Django encoder.
+        serialize (callable): Optional function turning a raw document into serializable data.
+    """
+    dumps = encoder_class(ensure_ascii=False).encode
+
+    def encode(document):
+        return dumps(serialize(document) if serialize else document).encode('utf-8')
+
+    return encode
+
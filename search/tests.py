@@ -1,11 +1,49 @@
-from django.test import TestCase, Client
-from unittest.mock import patch
-from .views import food_truck_collection
+import csv
+import json
+import math
+import os
+import random
+import tempfile
+import numpy as np
+from datetime import datetime
+from io import StringIO
+from django.core.management import CommandError, call_command
+from asgiref.sync import async_to_sync
+from django.test import AsyncRequestFactory, TestCase, Client, override_settings
+from unittest import skipIf
+from unittest.mock import MagicMock, call, patch
+from bson import ObjectId
+from rest_framework.renderers import JSONRenderer
+from pymongo import DeleteMany, InsertOne, UpdateOne
+from pymongo.errors import ServerSelectionTimeoutError
+from foodTruck import data_version
+from foodTruck.pagination import decode_cursor, encode_cursor
+from foodTruck.response_cache import cache_response
+from foodTruck.testing import APITestCase, FakeAsyncCursor
+from . import async_views
+from .async_views import async_food_truck_collection, async_food_truck_term_collection
+from .views import food_truck_collection, food_truck_term_collection
 from .serializers import FoodTruckSerializer
-from .utils import parse_open_hours, validate_location_params
+from . import encoders, export, ingest, text_index
+from .encoders import FastJSONRenderer, dumps, food_truck_encoder
+from .utils import DAY_NAMES, OpenHoursError, parse_open_hours, validate_location_params, validate_limit_param
+from .open_hours import OpenHoursIndex, open_intervals, parse_open_at
+from .geo import CoordinateStore, GeoIndex, MongoGeoEngine, covering_polygon, haversine, get_geo_engine, top_k
+from .filters import TruckFilters
+from .tiles import tile_bbox, tile_xy
+from .clusters import ClusterIndex, cluster_documents, merge_clusters
+from .ingest import (
+    DEFAULT_CSV_PATH, batched, changed_food_trucks, food_names, food_removals, food_upserts, pandas_transform,
+    parallel_transform, read_rows, food_key, split_chunks, transform_row, write_batch,
+)
+from .text_index import (
+    document_terms, rebuild_term_index, resolve_query, short_word_filter, term_additions, term_buckets, term_removals,
+    tokenize,
+)
 
-class NearByFoodTrucksTest(TestCase):
+class NearByFoodTrucksTest(APITestCase):
     def setUp(self):
+        super().setUp()
         # Mock data for FoodTruck document
         self.mock_return_value = {
             'applicant': 'mock',
@@ -19,6 +57,8 @@ class NearByFoodTrucksTest(TestCase):
             'open_hours' : {}
         }
         self.client = Client()
+        # Make sure the in-memory geo index is rebuilt from the mocked collection
+        get_geo_engine(food_truck_collection).invalidate()
 
     @patch.object(food_truck_collection, 'find')
     def test_get_nearby_foodtrucks_should_be_successfull(self, mock_find):
@@ -53,8 +93,862 @@ class NearByFoodTrucksTest(TestCase):
         # Assert that the response status code is 400 (Bad Request)
         self.assertEqual(response.status_code, 400)
 
-class GetAllFoodTrucksTest(TestCase):
+    @patch.object(food_truck_collection, 'find')
+    def test_get_nearby_foodtrucks_should_be_ordered_by_distance(self, mock_find):
+        # Mock the MongoDB find method with trucks at increasing distances, out of order
+        far = dict(self.mock_return_value, applicant='far', location={'type': 'Point', 'coordinates': [0.005, 0]})
+        near = dict(self.mock_return_value, applicant='near', location={'type': 'Point', 'coordinates': [0.001, 0]})
+        outside = dict(self.mock_return_value, applicant='outside', location={'type': 'Point', 'coordinates': [0.5, 0]})
+        mock_find.return_value = [far, outside, near]
+
+        response = self.client.get('/api/foodtruck/nearby/', {'latitude': 0, 'longitude': 0, 'radius': 1000})
+
+        # Only the trucks within the radius are returned, nearest first
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([truck['applicant'] for truck in response.json()['data']], ['near', 'far'])
+
+    @patch.object(food_truck_collection, 'find')
+    def test_get_nearby_foodtrucks_should_fall_back_to_mongo_when_index_is_cold(self, mock_find):
+        # Loading the index fails, then the $near query succeeds
+        mock_find.side_effect = [ServerSelectionTimeoutError('down'), [self.mock_return_value]]
+
+        with self.assertLogs('search.geo', 'WARNING'):
+            response = self.client.get('/api/foodtruck/nearby/', {'latitude': 0, 'longitude': 0, 'radius': 1000})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+        self.assertIn('$near', mock_find.call_args.args[0]['location'])
+
+    @patch.object(food_truck_collection, 'find')
+    def test_get_nearby_foodtrucks_should_reload_index_when_data_version_changes(self, mock_find):
+        mock_find.return_value = [self.mock_return_value]
+        self.client.get('/api/foodtruck/nearby/', {'latitude': 0, 'longitude': 0, 'radius': 1000})
+
+        # seed_data removed the truck and bumped the data version
+        mock_find.return_value = []
+        self.mock_data_version.return_value = {'_id': 'data_version', 'value': self.data_version + 1}
+        data_version._checked_at = None
+        response = self.client.get('/api/foodtruck/nearby/', {'latitude': 0, 'longitude': 0, 'radius': 1000})
+
+        self.assertEqual(response.json()['count'], 0)
+        self.assertEqual(mock_find.call_count, 2)
+
+    @patch.object(food_truck_collection, 'find')
+    def test_get_nearby_foodtrucks_with_limit_should_keep_default_radius(self, mock_find):
+        # Three trucks, the farthest one way outside the default radius
+        mock_find.return_value = [
+            dict(self.mock_return_value, applicant=str(offset), location={'type': 'Point', 'coordinates': [offset, 0]})
+            for offset in (1.0, 0.001, 0.002)
+        ]
+
+        response = self.client.get('/api/foodtruck/nearby/', {'latitude': 0, 'longitude': 0, 'limit': 5})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([truck['applicant'] for truck in response.json()['data']], ['0.001', '0.002'])
+        self.assertIsNone(response.json()['next'])
+
+    @patch.object(food_truck_collection, 'find')
+    def test_get_nearby_foodtrucks_sorted_by_distance_without_radius(self, mock_find):
+        mock_find.return_value = [
+            dict(self.mock_return_value, applicant=str(offset), location={'type': 'Point', 'coordinates': [offset, 0]})
+            for offset in (1.0, 0.001, 0.002)
+        ]
+
+        # sort=distance without a radius ranks the trucks at any distance
+        params = {'latitude': 0, 'longitude': 0, 'sort': 'distance'}
+        response = self.client.get('/api/foodtruck/nearby/', dict(params, limit=2))
+        self.assertEqual([truck['applicant'] for truck in response.json()['data']], ['0.001', '0.002'])
+
+        response = self.client.get('/api/foodtruck/nearby/', dict(params, limit=5))
+        self.assertEqual(response.json()['count'], 3)
+        self.assertIsNone(response.json()['next'])
+
+    @patch.object(food_truck_collection, 'find')
+    def test_get_nearby_foodtrucks_pages_should_follow_cursors(self, mock_find):
+        # Pairs of trucks at the same distance, stored in _id order
+        ids = sorted(ObjectId() for _ in range(7))
+        mock_find.return_value = [
+            dict(self.mock_return_value, _id=truck_id, applicant=str(i), location={'type': 'Point', 'coordinates': [0.001 * (i // 2 + 1), 0]})
+            for i, truck_id in enumerate(ids)
+        ]
+
+        applicants, params = [], {'latitude': 0, 'longitude': 0, 'limit': 3}
+        while True:
+            body = self.client.get('/api/foodtruck/nearby/', params).json()
+            applicants += [truck['applicant'] for truck in body['data']]
+            if body['next'] is None:
+                break
+            params['cursor'] = body['next']
+
+        # Ties split across pages are neither skipped nor repeated
+        self.assertEqual(applicants, [str(i) for i in range(7)])
+
+    def test_get_nearby_foodtrucks_should_fail_with_invalid_cursor(self):
+        for cursor in ('not a cursor', encode_cursor(ObjectId())):
+            with self.subTest(cursor=cursor):
+                response = self.client.get('/api/foodtruck/nearby/', {'latitude': 0, 'longitude': 0, 'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+
+    def test_get_nearby_foodtrucks_should_fail_with_invalid_limit_or_sort(self):
+        for params in ({'limit': 0}, {'limit': 'ten'}, {'sort': 'name'}):
+            with self.subTest(params=params):
+                response = self.client.get('/api/foodtruck/nearby/', dict(params, latitude=0, longitude=0))
+                self.assertEqual(response.status_code, 400)
+
+    @override_settings(GEO_ENGINE='search.geo.MongoGeoEngine')
+    @patch.object(food_truck_collection, 'find')
+    def test_get_nearby_foodtrucks_should_use_mongo_when_index_is_disabled(self, mock_find):
+        mock_find.return_value = [self.mock_return_value]
+
+        response = self.client.get('/api/foodtruck/nearby/', {'latitude': 0, 'longitude': 0, 'radius': 1000})
+
+        # A single $near query is sent to MongoDB
+        self.assertEqual(response.status_code, 200)
+        mock_find.assert_called_once()
+        self.assertEqual(mock_find.call_args.args[0]['location']['$near']['$maxDistance'], 1000)
+
+    @patch.object(food_truck_collection, 'find')
+    def test_get_nearby_foodtrucks_open_at(self, mock_find):
+        # Open on Monday from 10AM to 2PM, and on Monday from 8PM to 2AM
+        lunch = dict(self.mock_return_value, applicant='lunch', open_intervals=[{'start': 600, 'end': 840}])
+        night = dict(self.mock_return_value, applicant='night', open_intervals=[{'start': 1200, 'end': 1560}])
+        mock_find.return_value = [lunch, night, self.mock_return_value]
+
+        for open_at, applicants in (('2024-05-06T12:30', ['lunch']), ('2024-05-07T01:00', ['night']), ('2024-05-06T15:00', [])):
+            with self.subTest(open_at=open_at):
+                response = self.client.get('/api/foodtruck/nearby/', {'latitude': 0, 'longitude': 0, 'open_at': open_at})
+                self.assertEqual([truck['applicant'] for truck in response.json()['data']], applicants)
+
+    @override_settings(GEO_ENGINE='search.geo.MongoGeoEngine')
+    @patch('search.queries.current_minute', return_value=630)
+    @patch.object(food_truck_collection, 'find')
+    def test_get_nearby_foodtrucks_open_now_with_mongo(self, mock_find, current_minute):
+        mock_find.return_value = []
+
+        response = self.client.get('/api/foodtruck/nearby/', {'latitude': 0, 'longitude': 0, 'open_now': 1})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            mock_find.call_args.args[0]['open_intervals'],
+            {'$elemMatch': {'start': {'$lte': 630}, 'end': {'$gt': 630}}},
+        )
+
+    @patch.object(food_truck_collection, 'find')
+    def test_get_nearby_foodtrucks_food(self, mock_find):
+        tacos = dict(self.mock_return_value, applicant='tacos', food_keys=['soda', 'tacos'], open_intervals=[{'start': 600, 'end': 840}])
+        fish_tacos = dict(self.mock_return_value, applicant='fish tacos', food_keys=['fish tacos'])
+        mock_find.return_value = [fish_tacos, tacos]
+
+        for params, applicants in (({'food': 'TACOS'}, ['tacos']), ({'food': 'Fish Tacos!'}, ['fish tacos']), ({'food': 'tacos', 'open_at': '2024-05-06T15:00'}, [])):
+            with self.subTest(params=params):
+                response = self.client.get('/api/foodtruck/nearby/', dict(params, latitude=0, longitude=0, limit=5))
+                self.assertEqual([truck['applicant'] for truck in response.json()['data']], applicants)
+
+    @override_settings(GEO_ENGINE='search.geo.MongoGeoEngine')
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_get_nearby_foodtrucks_food_with_mongo(self, mock_aggregate):
+        mock_aggregate.return_value = []
+
+        self.client.get('/api/foodtruck/nearby/', {'latitude': 0, 'longitude': 0, 'limit': 5, 'food': 'Tacos'})
+
+        # The filter is applied by $geoNear while it scans the index
+        self.assertEqual(mock_aggregate.call_args.args[0][0]['$geoNear']['query'], {'food_keys': 'tacos'})
+
+    def test_get_nearby_foodtrucks_should_fail_with_invalid_open_filter(self):
+        for params in ({'open_at': 'noon'}, {'open_now': 'yes'}, {'open_now': 1, 'open_at': '2024-05-06T12:30'}, {'food': '!'}):
+            with self.subTest(params=params):
+                response = self.client.get('/api/foodtruck/nearby/', dict(params, latitude=0, longitude=0))
+                self.assertEqual(response.status_code, 400)
+
+    @patch.object(food_truck_collection, 'find')
+    def test_nearby_batch(self, mock_find):
+        tacos = dict(self.mock_return_value, applicant='tacos', food_keys=['tacos'], location={'type': 'Point', 'coordinates': [0.001, 0]})
+        far = dict(self.mock_return_value, applicant='far', location={'type': 'Point', 'coordinates': [1, 0]})
+        mock_find.return_value = [tacos, far]
+        queries = [
+            {'latitude': 0, 'longitude': 0},
+            {'latitude': 0, 'longitude': 1, 'radius': 10},
+            {'latitude': 0, 'longitude': 0.6, 'radius': None, 'limit': 1},
+            {'latitude': '0', 'longitude': '0', 'radius': None, 'filters': {'food': 'Tacos', 'open_now': False}},
+            {'latitude': 0, 'longitude': 0, 'filters': {'food': 'burritos'}},
+        ]
+
+        response = self.client.post('/api/foodtruck/nearby/batch/', {'queries': queries}, content_type='application/json')
+
+        # Results are aligned with the queries, all answered from the index loaded once
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['count'], 5)
+        self.assertEqual(
+            [[truck['applicant'] for truck in result['data']] for result in body['results']],
+            [['tacos'], ['far'], ['far'], ['tacos'], []],
+        )
+        mock_find.assert_called_once()
+
+    @override_settings(GEO_ENGINE='search.geo.MongoGeoEngine', NEARBY_BATCH_CONCURRENCY=4)
+    @patch.object(food_truck_collection, 'find')
+    def test_nearby_batch_with_mongo(self, mock_find):
+        mock_find.side_effect = lambda query, projection, limit: [dict(self.mock_return_value, applicant=str(query['location']['$near']['$geometry']['coordinates'][0]))]
+        queries = [{'latitude': 0, 'longitude': longitude} for longitude in range(10)]
+
+        response = self.client.post('/api/foodtruck/nearby/batch/', {'queries': queries}, content_type='application/json')
+
+        # The concurrent $near queries are returned in the order of the queries
+        self.assertEqual([result['data'][0]['applicant'] for result in response.json()['results']], [str(float(i)) for i in range(10)])
+        self.assertEqual(mock_find.call_count, 10)
+
+    def test_nearby_batch_should_fail_with_invalid_queries(self):
+        for body, message in (
+            ({}, 'queries must be a non-empty list'),
+            ({'queries': []}, 'queries must be a non-empty list'),
+            ({'queries': [{'latitude': 0, 'longitude': 0}, {'latitude': 100, 'longitude': 0}]}, 'queries[1]: invalid location filter parameter'),
+            ({'queries': [{'latitude': 0}]}, 'queries[0]: invalid location filter parameter'),
+            ({'queries': [{'latitude': 0, 'longitude': 0, 'limit': True}]}, 'queries[0]: invalid limit parameter'),
+            ({'queries': [{'latitude': 0, 'longitude': 0, 'filters': {'open_at': 'noon'}}]}, 'queries[0]: invalid open_at parameter'),
+            ({'queries': ['nearby']}, 'queries[0]: query must be an object'),
+        ):
+            with self.subTest(body=body):
+                response = self.client.post('/api/foodtruck/nearby/batch/', body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['error_message'], message)
+
+        with override_settings(NEARBY_BATCH_MAX_QUERIES=2):
+            response = self.client.post('/api/foodtruck/nearby/batch/', {'queries': [{'latitude': 0, 'longitude': 0}] * 3}, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    @override_settings(GEO_ENGINE='search.geo.MongoGeoEngine')
+    @patch.object(food_truck_collection, 'aggregate')
+    @patch.object(food_truck_collection, 'find')
+    def test_get_nearby_foodtrucks_fields_with_mongo(self, mock_find, mock_aggregate):
+        mock_find.return_value = [dict(self.mock_return_value, _id=ObjectId())]
+        mock_aggregate.return_value = []
+
+        response = self.client.get('/api/foodtruck/nearby/', {'latitude': 0, 'longitude': 0, 'fields': 'applicant,status'})
+
+        # Only the selected fields are read from MongoDB and returned
+        self.assertEqual(response.json()['data'], [{'applicant': 'mock', 'status': 'Approved'}])
+        self.assertEqual(mock_find.call_args.kwargs['projection'], {'applicant': 1, 'status': 1})
+        self.client.get('/api/foodtruck/nearby/', {'latitude': 0, 'longitude': 0, 'limit': 5, 'fields': 'applicant,status'})
+        self.assertEqual(mock_aggregate.call_args.args[0][-1], {'$project': {'applicant': 1, 'status': 1, 'distance': 1}})
+
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_mongo_engine_pages_are_read_with_geo_near(self, mock_aggregate):
+        truck_id = ObjectId()
+        mock_aggregate.return_value = [dict(self.mock_return_value, _id=truck_id, distance=12.5)]
+
+        page = MongoGeoEngine(food_truck_collection).page(0, 0, 5, radius=100, after=[10.0, truck_id])
+
+        self.assertEqual(page, [(12.5, dict(self.mock_return_value, _id=truck_id))])
+        geo_near, keyset, sort, limit = mock_aggregate.call_args.args[0]
+        # The index skips the previous pages, ties are resolved on _id
+        self.assertEqual(geo_near['$geoNear']['minDistance'], 10.0)
+        self.assertEqual(geo_near['$geoNear']['maxDistance'], 100)
+        self.assertEqual(keyset['$match']['$or'][1], {'distance': 10.0, '_id': {'$gt': truck_id}})
+        self.assertEqual((sort, limit), ({'$sort': {'distance': 1, '_id': 1}}, {'$limit': 5}))
+
+class AggregationsTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.documents = [
+            {'applicant': 'tacos', 'status': 'APPROVED', 'facility_type': 'Truck', 'food_keys': ['soda', 'tacos'],
+             'location': {'type': 'Point', 'coordinates': [-122.4194, 37.7749]}},
+            {'applicant': 'burritos', 'status': 'APPROVED', 'facility_type': 'Push Cart', 'food_keys': ['burritos', 'soda'],
+             'location': {'type': 'Point', 'coordinates': [-122.4190, 37.7751]}},
+            {'applicant': 'coffee', 'status': 'EXPIRED', 'facility_type': 'Truck', 'food_keys': ['coffee'],
+             'location': {'type': 'Point', 'coordinates': [-122.3900, 37.7600]}},
+        ]
+        get_geo_engine(food_truck_collection).invalidate()
+
+    @patch.object(food_truck_collection, 'find')
+    def test_facets(self, mock_find):
+        mock_find.return_value = self.documents
+
+        response = self.client.get('/api/foodtruck/facets/', {'food_limit': 2})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'count': 3, 'facets': {
+            'status': [{'value': 'APPROVED', 'count': 2}, {'value': 'EXPIRED', 'count': 1}],
+            'facility_type': [{'value': 'Truck', 'count': 2}, {'value': 'Push Cart', 'count': 1}],
+            'food': [{'value': 'soda', 'count': 2}, {'value': 'burritos', 'count': 1}],
+        }})
+        # Filters apply before counting
+        response = self.client.get('/api/foodtruck/facets/', {'bbox': '-122.43,37.77,-122.41,37.78', 'food': 'tacos'})
+        self.assertEqual(response.json()['facets']['food'], [{'value': 'soda', 'count': 1}, {'value': 'tacos', 'count': 1}])
+        mock_find.assert_called_once()
+
+    @override_settings(GEO_ENGINE='search.geo.MongoGeoEngine')
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_facets_with_mongo(self, mock_aggregate):
+        mock_aggregate.return_value = [{
+            'count': [{'count': 3}],
+            'status': [{'_id': 'APPROVED', 'count': 2}, {'_id': None, 'count': 1}],
+            'facility_type': [{'_id': 'Truck', 'count': 3}],
+            'food': [{'_id': 'soda', 'count': 2}],
+        }]
+
+        response = self.client.get('/api/foodtruck/facets/', {'bbox': '-122.43,37.77,-122.41,37.78', 'food_limit': 1})
+
+        self.assertEqual(response.json()['facets']['status'], [{'value': 'APPROVED', 'count': 2}, {'value': None, 'count': 1}])
+        match, facet = mock_aggregate.call_args.args[0]
+        self.assertEqual(match['$match']['location.coordinates.0'], {'$gte': -122.43, '$lte': -122.41})
+        self.assertEqual(match['$match']['location']['$geoWithin']['$geometry']['type'], 'Polygon')
+        self.assertEqual(facet['$facet']['food'][-1], {'$limit': 1})
+
+    @patch.object(food_truck_collection, 'find')
+    def test_density(self, mock_find):
+        mock_find.return_value = self.documents
+
+        response = self.client.get('/api/foodtruck/density/', {'zoom': 12})
+
+        body = response.json()
+        self.assertEqual((body['zoom'], body['count']), (12, 3))
+        self.assertEqual([(cell['x'], cell['y'], cell['count']) for cell in body['cells']], [(655, 1583, 3)])
+        # Tiles split the downtown trucks from the third one at a higher zoom
+        cells = self.client.get('/api/foodtruck/density/', {'zoom': 15}).json()['cells']
+        self.assertEqual([cell['count'] for cell in cells], [2, 1])
+        self.assertAlmostEqual(cells[0]['longitude'], -122.4192)
+        response = self.client.get('/api/foodtruck/density/', {'zoom': 15, 'bbox': '-122.40,37.70,-122.38,37.80'})
+        self.assertEqual(response.json()['count'], 1)
+
+    @override_settings(GEO_ENGINE='search.geo.MongoGeoEngine')
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_density_with_mongo(self, mock_aggregate):
+        mock_aggregate.return_value = [{'_id': {'x': 655.0, 'y': 1583.0}, 'count': 3, 'longitude': -122.4, 'latitude': 37.7}]
+
+        response = self.client.get('/api/foodtruck/density/', {'zoom': 12, 'open_at': '2024-05-06T10:30'})
+
+        self.assertEqual(response.json()['cells'], [{'x': 655, 'y': 1583, 'count': 3, 'longitude': -122.4, 'latitude': 37.7}])
+        match, group, sort = mock_aggregate.call_args.args[0]
+        self.assertIn('open_intervals', match['$match'])
+        self.assertEqual(set(group['$group']['_id']), {'x', 'y'})
+
+    def test_invalid_parameters(self):
+        for path, params in (
+            ('/api/foodtruck/facets/', {'food_limit': 0}),
+            ('/api/foodtruck/facets/', {'bbox': '-122.41,37.77,-122.43,37.78'}),
+            ('/api/foodtruck/facets/', {'bbox': '1,2,3'}),
+            ('/api/foodtruck/density/', {}),
+            ('/api/foodtruck/density/', {'zoom': 23}),
+            ('/api/foodtruck/density/', {'zoom': 5, 'food': '!'}),
+        ):
+            with self.subTest(path=path, params=params):
+                self.assertEqual(self.client.get(path, params).status_code, 400)
+
+    def test_store_facets_match_brute_force(self):
+        random.seed(7)
+        documents = [
+            {'status': random.choice(['APPROVED', 'EXPIRED', None]), 'facility_type': random.choice(['Truck', 'Push Cart']),
+             'food_keys': sorted(random.sample(['tacos', 'soda', 'coffee', 'hot dogs'], random.randint(0, 3))),
+             'location': {'type': 'Point', 'coordinates': [random.uniform(-122.5, -122.3), random.uniform(37.7, 37.8)]}}
+            for _ in range(200)
+        ]
+        store = CoordinateStore(documents)
+        bbox = (-122.45, 37.72, -122.35, 37.78)
+        selected = [d for d in documents if bbox[0] <= d['location']['coordinates'][0] <= bbox[2] and bbox[1] <= d['location']['coordinates'][1] <= bbox[3] and 'soda' in d['food_keys']]
+
+        result = store.facets(bbox=bbox, filters=TruckFilters(food='soda'))
+
+        self.assertEqual(result['count'], len(selected))
+        for field, values in (('status', [d['status'] for d in selected]), ('food', [k for d in selected for k in d['food_keys']])):
+            with self.subTest(field=field):
+                self.assertEqual({item['value']: item['count'] for item in result['facets'][field]}, {v: values.count(v) for v in set(values)})
+        self.assertEqual(sum(cell['count'] for cell in store.density(10, bbox=bbox, filters=TruckFilters(food='soda'))), len(selected))
+
+    def test_tiles(self):
+        self.assertEqual([a.tolist() for a in tile_xy(np.array([-180.0, 0.0, 180.0]), np.array([90.0, 0.0, -90.0]), 1)], [[0, 1, 1], [0, 1, 1]])
+        for x, y, zoom in ((655, 1583, 12), (0, 0, 0), (3, 1, 2)):
+            min_longitude, min_latitude, max_longitude, max_latitude = tile_bbox(x, y, zoom)
+            center = tile_xy(np.array([(min_longitude + max_longitude) / 2]), np.array([(min_latitude + max_latitude) / 2]), zoom)
+            self.assertEqual((center[0][0], center[1][0]), (x, y))
+
+
+class MapViewportTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        # Trucks on a grid around downtown San Francisco, in _id order
+        self.documents = [
+            {'_id': ObjectId(), 'applicant': str(i), 'food_keys': ['tacos'] if i % 2 else ['coffee'],
+             'location': {'type': 'Point', 'coordinates': [-122.43 + (i % 6) * 0.005, 37.77 + (i // 6) * 0.004]}}
+            for i in range(36)
+        ]
+        self.documents.sort(key=lambda d: d['_id'])
+        get_geo_engine(food_truck_collection).invalidate()
+
+    def inside(self, bbox):
+        return [
+            d['applicant'] for d in self.documents
+            if bbox[0] <= d['location']['coordinates'][0] <= bbox[2] and bbox[1] <= d['location']['coordinates'][1] <= bbox[3]
+        ]
+
+    @patch.object(food_truck_collection, 'find')
+    def test_bbox(self, mock_find):
+        mock_find.return_value = self.documents
+        bbox = (-122.426, 37.773, -122.411, 37.785)
+
+        response = self.client.get('/api/foodtruck/bbox/', {'bbox': ','.join(map(str, bbox))})
+
+        self.assertEqual([truck['applicant'] for truck in response.json()['data']], self.inside(bbox))
+        # Pages follow the _id order
+        applicants, cursor = [], None
+        while True:
+            params = {'bbox': ','.join(map(str, bbox)), 'limit': 4, 'food': 'tacos'}
+            body = self.client.get('/api/foodtruck/bbox/', dict(params, cursor=cursor) if cursor else params).json()
+            applicants += [truck['applicant'] for truck in body['data']]
+            cursor = body['next']
+            if cursor is None:
+                break
+        self.assertEqual(applicants, [a for a in self.inside(bbox) if int(a) % 2])
+        mock_find.assert_called_once()
+
+    @patch.object(food_truck_collection, 'find')
+    def test_fields(self, mock_find):
+        mock_find.return_value = self.documents
+        document = self.documents[0]
+        x, y = tile_xy(*document['location']['coordinates'], 12)
+
+        for url, params in (
+            ('/api/foodtruck/bbox/', {'bbox': '-180,-90,180,90'}),
+            ('/api/foodtruck/tiles/12/{}/{}/'.format(x, y), {}),
+        ):
+            response = self.client.get(url, dict(params, fields='pin'))
+            self.assertEqual(response.json()['data'][0], {'applicant': document['applicant'], 'location': document['location'], 'id': str(document['_id'])})
+            response = self.client.get(url, dict(params, fields='applicant, food_items'))
+            self.assertEqual(response.json()['data'][0], {'applicant': document['applicant']})
+            for fields in ('row_hash', 'pin,', 'thumbnail'):
+                response = self.client.get(url, dict(params, fields=fields))
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error_message': 'invalid fields parameter'})
+
+    @override_settings(GEO_ENGINE='search.geo.MongoGeoEngine')
+    @patch.object(food_truck_collection, 'find')
+    def test_fields_with_mongo(self, mock_find):
+        mock_find.return_value = []
+
+        self.client.get('/api/foodtruck/bbox/', {'bbox': '-122.43,37.77,-122.41,37.79', 'fields': 'pin'})
+        self.assertEqual(mock_find.call_args.kwargs['projection'], {'applicant': 1, 'location': 1, '_id': 1})
+        self.client.get('/api/foodtruck/tiles/0/0/0/', {'fields': 'card,location_description'})
+        self.assertEqual(set(mock_find.call_args.kwargs['projection']), {
+            'applicant', 'facility_type', 'location_description', 'address', 'status', 'food_items', 'location', '_id',
+        })
+
+    @override_settings(GEO_ENGINE='search.geo.MongoGeoEngine')
+    @patch.object(food_truck_collection, 'find')
+    def test_bbox_with_mongo(self, mock_find):
+        mock_find.return_value = [self.documents[0]]
+        after = self.documents[0]['_id']
+
+        self.client.get('/api/foodtruck/bbox/', {'bbox': '-122.43,37.77,-122.41,37.79', 'limit': 5, 'cursor': encode_cursor(after), 'food': 'tacos'})
+
+        query = mock_find.call_args.args[0]
+        self.assertEqual(query['location.coordinates.1'], {'$gte': 37.77, '$lte': 37.79})
+        self.assertIn('$geometry', query['location']['$geoWithin'])
+        self.assertEqual((query['_id'], query['food_keys']), ({'$gt': after}, 'tacos'))
+        self.assertEqual(mock_find.call_args.kwargs, {'projection': food_truck_encoder.projection, 'sort': [('_id', 1)], 'limit': 6})
+        # Boxes wider than a hemisphere are matched on the coordinates only
+        self.client.get('/api/foodtruck/bbox/', {'bbox': '-170,-10,170,10'})
+        self.assertNotIn('location', mock_find.call_args.args[0])
+
+    @patch.object(food_truck_collection, 'find')
+    def test_tiles(self, mock_find):
+        mock_find.return_value = self.documents
+
+        cells = self.client.get('/api/foodtruck/density/', {'zoom': 16}).json()['cells']
+        self.assertGreater(len(cells), 1)
+        applicants = []
+        for cell in cells:
+            response = self.client.get('/api/foodtruck/tiles/16/{}/{}/'.format(cell['x'], cell['y']))
+            self.assertEqual(response.json()['count'], cell['count'])
+            self.assertEqual(response['Cache-Control'], 'max-age=300')
+            applicants += [truck['applicant'] for truck in response.json()['data']]
+        # Every truck is in exactly one tile
+        self.assertEqual(sorted(applicants), sorted(d['applicant'] for d in self.documents))
+
+        response = self.client.get('/api/foodtruck/tiles/16/{}/{}/'.format(cells[0]['x'], cells[0]['y']))
+        self.assertEqual((response['X-Cache'], response['Cache-Control']), ('HIT', 'max-age=300'))
+        self.assertEqual(self.client.get('/api/foodtruck/tiles/0/0/0/', {'food': 'coffee'}).json()['count'], 18)
+
+    @patch.object(food_truck_collection, 'find')
+    def test_tile_cache_control(self, mock_find):
+        mock_find.return_value = self.documents
+
+        response = self.client.get('/api/foodtruck/tiles/0/0/0/')
+        self.assertEqual(response['Cache-Control'], 'max-age=300')
+        # Tiles filtered by opening time are not reused by the clients
+        for params in ({'open_now': 1}, {'open_at': '2024-05-06T10:30'}):
+            response = self.client.get('/api/foodtruck/tiles/0/0/0/', params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Cache-Control'], 'no-cache')
+
+    @override_settings(GEO_ENGINE='search.geo.MongoGeoEngine')
+    @patch.object(food_truck_collection, 'find')
+    def test_tile_with_mongo(self, mock_find):
+        mock_find.return_value = []
+
+        self.client.get('/api/foodtruck/tiles/12/655/1583/', {'open_at': '2024-05-06T10:30'})
+
+        query = mock_find.call_args.args[0]
+        self.assertEqual(len(query['$expr']['$and']), 2)
+        self.assertIn('open_intervals', query)
+        self.assertIn('$geometry', query['location']['$geoWithin'])
+
+    @patch.object(food_truck_collection, 'find')
+    def test_cluster(self, mock_find):
+        # Three more trucks sharing the coordinates of the first one
+        duplicates = [
+            dict(self.documents[0], _id=ObjectId(), applicant='duplicate {}'.format(i)) for i in range(3)
+        ]
+        mock_find.return_value = self.documents + duplicates
+        bbox = '-180,-90,180,90'
+
+        # At zoom 10 the whole grid is a single cluster
+        body = self.client.get('/api/foodtruck/bbox/', {'bbox': bbox, 'cluster': 1, 'zoom': 10}).json()
+        self.assertEqual((body['count'], body['data']), (0, []))
+        self.assertEqual([cluster['count'] for cluster in body['clusters']], [39])
+        self.assertAlmostEqual(body['clusters'][0]['longitude'], np.mean([d['location']['coordinates'][0] for d in mock_find.return_value]))
+        # At the highest zoom only the trucks at the same coordinates are merged
+        body = self.client.get('/api/foodtruck/bbox/', {'bbox': bbox, 'cluster': 1, 'zoom': 22, 'fields': 'applicant'}).json()
+        self.assertEqual([truck['applicant'] for truck in body['data']], [d['applicant'] for d in self.documents[1:]])
+        self.assertEqual(body['clusters'], [{'count': 4, 'longitude': -122.43, 'latitude': 37.77}])
+        # Filters only keep the matching trucks of each cluster
+        body = self.client.get('/api/foodtruck/bbox/', {'bbox': bbox, 'cluster': 1, 'zoom': 10, 'food': 'tacos'}).json()
+        self.assertEqual([cluster['count'] for cluster in body['clusters']], [18])
+
+        # The trucks of a tile are split into its food trucks and clusters
+        for cell in self.client.get('/api/foodtruck/density/', {'zoom': 15}).json()['cells']:
+            body = self.client.get('/api/foodtruck/tiles/15/{}/{}/'.format(cell['x'], cell['y']), {'cluster': 1}).json()
+            self.assertEqual(body['count'] + sum(cluster['count'] for cluster in body['clusters']), cell['count'])
+
+        # Nearby clusters come in the order of their nearest truck
+        body = self.client.get('/api/foodtruck/nearby/', {'latitude': 37.77, 'longitude': -122.43, 'radius': 700, 'cluster': 1, 'zoom': 16}).json()
+        nearest = [d for _, d in get_geo_engine(food_truck_collection).get_index().nearest(-122.43, 37.77, radius=700)]
+        self.assertEqual(body['count'] + sum(cluster['count'] for cluster in body['clusters']), len(nearest))
+        self.assertEqual(body['clusters'][0]['count'], 4)
+        mock_find.assert_called_once()
+
+    @override_settings(GEO_ENGINE='search.geo.MongoGeoEngine')
+    @patch.object(food_truck_collection, 'find')
+    def test_cluster_with_mongo(self, mock_find):
+        mock_find.return_value = self.documents
+        params = {'bbox': '-180,-90,180,90', 'cluster': 1, 'zoom': 13, 'fields': 'applicant'}
+
+        body = self.client.get('/api/foodtruck/bbox/', params).json()
+
+        # The location is read to cluster the trucks, even when it is not returned
+        self.assertEqual(mock_find.call_args.kwargs['projection'], {'applicant': 1, 'location': 1})
+        # Clusters built on the fly match the ones of the in-memory index
+        store = CoordinateStore(self.documents)
+        data, clusters = store.cluster(store.documents, 13)
+        self.assertEqual(body['clusters'], clusters)
+        self.assertEqual([truck['applicant'] for truck in body['data']], [d['applicant'] for d in data])
+        self.assertGreater(len(clusters), 1)
+
+    def test_invalid_parameters(self):
+        for path, params in (
+            ('/api/foodtruck/bbox/', {'bbox': '-122.43,37.77,-122.41,37.79', 'cluster': 2, 'zoom': 10}),
+            ('/api/foodtruck/bbox/', {'bbox': '-122.43,37.77,-122.41,37.79', 'cluster': 1}),
+            ('/api/foodtruck/bbox/', {'bbox': '-122.43,37.77,-122.41,37.79', 'cluster': 1, 'zoom': 10, 'limit': 5}),
+            ('/api/foodtruck/nearby/', {'cluster': 1, 'zoom': 23}),
+            ('/api/foodtruck/nearby/', {'cluster': 1, 'zoom': 10, 'limit': 5}),
+            ('/api/foodtruck/bbox/', {}),
+            ('/api/foodtruck/bbox/', {'bbox': '-122.43,37.77,-122.41,37.79', 'limit': -1}),
+            ('/api/foodtruck/tiles/2/4/0/', {}),
+            ('/api/foodtruck/tiles/23/0/0/', {}),
+            ('/api/foodtruck/tiles/2/0/0/', {'open_now': 2}),
+        ):
+            with self.subTest(path=path, params=params):
+                self.assertEqual(self.client.get(path, params).status_code, 400)
+
+    def test_covering_polygon_holds_the_box(self):
+        def edge_midpoint_latitude(start, end):
+            # Latitude of the midpoint of the great circle arc between two points
+            vectors = [
+                np.array([math.cos(math.radians(lat)) * math.cos(math.radians(lon)), math.cos(math.radians(lat)) * math.sin(math.radians(lon)), math.sin(math.radians(lat))])
+                for lon, lat in (start, end)
+            ]
+            x, y, z = vectors[0] + vectors[1]
+            return math.degrees(math.atan2(z, math.hypot(x, y)))
+
+        for bbox in ((-122.5, 37.7, -122.3, 37.8), (10, 50, 80, 70), (-60, -70, 20, -40), (-30, -10, 30, 10)):
+            with self.subTest(bbox=bbox):
+                ring = covering_polygon(bbox)['coordinates'][0]
+                self.assertLessEqual(edge_midpoint_latitude(ring[0], ring[1]), bbox[1])
+                self.assertGreaterEqual(edge_midpoint_latitude(ring[2], ring[3]), bbox[3])
+        self.assertIsNone(covering_polygon((-100, 0, 100, 10)))
+        self.assertIsNone(covering_polygon((0, 80, 60, 90)))
+
+
+class AsyncViewsTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+        self.mock_return_value = {
+            '_id': ObjectId(),
+            'applicant': 'mock',
+            'facility_type': 'Truck',
+            'location_description': 'mock location description',
+            'address': "mock address",
+            'status': "Approved",
+            'food_items': [],
+            'approved_at': datetime(2024, 1, 2),
+            'location': {'type': 'Point', 'coordinates': [0, 0]},
+            'open_hours': {}
+        }
+        get_geo_engine(food_truck_collection).invalidate()
+
+    def get(self, view, path, params=None):
+        return async_to_sync(cache_response(view.as_view()))(self.factory.get(path, params or {}))
+
+    @patch.object(async_food_truck_collection, 'find')
+    def test_all_food_trucks_match_sync_view(self, mock_find):
+        mock_find.return_value = FakeAsyncCursor([self.mock_return_value])
+
+        response = self.get(async_views.AllFoodTrucks, '/api/foodtruck/all/')
+
+        self.assertEqual(response.status_code, 200)
+        with patch.object(food_truck_collection, 'find', return_value=[self.mock_return_value]):
+            self.assertEqual(response.content, self.client.get('/api/foodtruck/all/').content)
+
+    @patch.object(async_food_truck_collection, 'count_documents')
+    @patch.object(async_food_truck_collection, 'find')
+    def test_all_food_trucks_streamed_from_async_cursor(self, mock_find, mock_count_documents):
+        mock_find.return_value = FakeAsyncCursor([self.mock_return_value] * 3)
+        mock_count_documents.return_value = 3
+
+        response = self.get(async_views.AllFoodTrucks, '/api/foodtruck/all/', {'stream': 'ndjson'})
+
+        self.assertTrue(response.is_async)
+        self.assertEqual(response['X-Total-Count'], '3')
+
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        lines = async_to_sync(read)().decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], food_truck_encoder.to_list([self.mock_return_value] * 3))
+
+    @patch.object(food_truck_collection, 'find')
+    def test_nearby_food_trucks_from_index(self, mock_find):
+        far = dict(self.mock_return_value, applicant='far', location={'type': 'Point', 'coordinates': [0.005, 0]})
+        near = dict(self.mock_return_value, applicant='near', location={'type': 'Point', 'coordinates': [0.001, 0]})
+        mock_find.return_value = [far, near]
+
+        response = self.get(async_views.NearbyFoodTrucks, '/api/foodtruck/nearby/', {'latitude': 0, 'longitude': 0})
+
+        self.assertEqual([truck['applicant'] for truck in json.loads(response.content)['data']], ['near', 'far'])
+        # The cached response is served on the next request
+        response = self.get(async_views.NearbyFoodTrucks, '/api/foodtruck/nearby/', {'latitude': 0, 'longitude': 0})
+        self.assertEqual(response['X-Cache'], 'HIT')
+        mock_find.assert_called_once()
+
+    @override_settings(GEO_ENGINE='search.geo.MongoGeoEngine')
+    @patch.object(async_food_truck_collection, 'aggregate')
+    def test_nearby_food_trucks_pages_from_async_client(self, mock_aggregate):
+        mock_aggregate.return_value = FakeAsyncCursor([dict(self.mock_return_value, distance=d) for d in (1.0, 2.0)])
+
+        response = self.get(async_views.NearbyFoodTrucks, '/api/foodtruck/nearby/', {'latitude': 0, 'longitude': 0, 'limit': 1})
+
+        body = json.loads(response.content)
+        self.assertEqual(body['count'], 1)
+        self.assertEqual(decode_cursor(body['next'], 2), [1.0, self.mock_return_value['_id']])
+        self.assertIn('$geoNear', mock_aggregate.call_args.args[0][0])
+
+    @patch.object(food_truck_collection, 'find')
+    def test_nearby_batch_matches_sync_view(self, mock_find):
+        mock_find.return_value = [self.mock_return_value]
+        body = json.dumps({'queries': [{'latitude': 0, 'longitude': 0}, {'latitude': 0, 'longitude': 1}]})
+
+        request = self.factory.post('/api/foodtruck/nearby/batch/', body, content_type='application/json')
+        response = async_to_sync(async_views.NearbyFoodTrucksBatch.as_view())(request)
+
+        self.assertEqual(response.status_code, 200)
+        sync_response = self.client.post('/api/foodtruck/nearby/batch/', body, content_type='application/json')
+        self.assertEqual(response.content, sync_response.content)
+
+        request = self.factory.post('/api/foodtruck/nearby/batch/', 'not json', content_type='application/json')
+        self.assertEqual(async_to_sync(async_views.NearbyFoodTrucksBatch.as_view())(request).status_code, 400)
+
+    @override_settings(GEO_ENGINE='search.geo.MongoGeoEngine')
+    @patch.object(async_food_truck_collection, 'find')
+    def test_nearby_batch_from_async_client(self, mock_find):
+        mock_find.return_value = FakeAsyncCursor([self.mock_return_value])
+        body = json.dumps({'queries': [{'latitude': 0, 'longitude': 0}] * 3})
+
+        request = self.factory.post('/api/foodtruck/nearby/batch/', body, content_type='application/json')
+        response = async_to_sync(async_views.NearbyFoodTrucksBatch.as_view())(request)
+
+        self.assertEqual([result['count'] for result in json.loads(response.content)['results']], [1, 1, 1])
+        self.assertEqual(mock_find.call_count, 3)
+
+    @patch.object(async_food_truck_term_collection, 'find')
+    @patch.object(async_food_truck_collection, 'aggregate')
+    def test_search_food_trucks(self, mock_aggregate, mock_term_find):
+        truck_id = ObjectId()
+        mock_term_find.return_value = FakeAsyncCursor([{'ids': [truck_id]}])
+        document = dict(self.mock_return_value)
+        del document['_id']
+        mock_aggregate.return_value = FakeAsyncCursor([document])
+
+        response = self.get(async_views.SearchFoodTrucks, '/api/foodtruck/search/', {'q': 'mock'})
+
+        self.assertEqual(json.loads(response.content)['count'], 1)
+        self.assertEqual(mock_aggregate.call_args.args[0][0], {'$match': {'_id': {'$in': [truck_id]}}})
+
+    @patch.object(async_food_truck_term_collection, 'find')
+    @patch.object(async_food_truck_collection, 'aggregate')
+    def test_search_food_trucks_short_word_uses_regex(self, mock_aggregate, mock_term_find):
+        document = dict(self.mock_return_value)
+        del document['_id']
+        mock_aggregate.return_value = FakeAsyncCursor([document])
+
+        response = self.get(async_views.SearchFoodTrucks, '/api/foodtruck/search/', {'q': 'ta'})
+
+        self.assertEqual(json.loads(response.content)['count'], 1)
+        mock_term_find.assert_not_called()
+        self.assertEqual(mock_aggregate.call_args.args[0][0], {'$match': short_word_filter('ta')})
+
+    @patch.object(food_truck_collection, 'find')
+    def test_aggregations_match_sync_views(self, mock_find):
+        mock_find.return_value = [self.mock_return_value]
+
+        for view, path, params in (
+            (async_views.FoodTruckFacets, '/api/foodtruck/facets/', {'bbox': '-1,-1,1,1'}),
+            (async_views.FoodTruckDensity, '/api/foodtruck/density/', {'zoom': 3}),
+            (async_views.BBoxFoodTrucks, '/api/foodtruck/bbox/', {'bbox': '-1,-1,1,1', 'limit': 1}),
+            (async_views.BBoxFoodTrucks, '/api/foodtruck/bbox/', {'bbox': '-1,-1,1,1', 'cluster': 1, 'zoom': 3}),
+            (async_views.NearbyFoodTrucks, '/api/foodtruck/nearby/', {'cluster': 1, 'zoom': 3}),
+        ):
+            with self.subTest(path=path):
+                response = self.get(view, path, params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, self.client.get(path, params).content)
+
+    @override_settings(GEO_ENGINE='search.geo.MongoGeoEngine')
+    @patch.object(async_food_truck_collection, 'find')
+    def test_tile_from_async_client(self, mock_find):
+        mock_find.return_value = FakeAsyncCursor([self.mock_return_value])
+
+        request = self.factory.get('/api/foodtruck/tiles/1/1/0/')
+        response = async_to_sync(async_views.TileFoodTrucks.as_view())(request, zoom=1, x=1, y=0)
+
+        self.assertEqual(json.loads(response.content)['count'], 1)
+        self.assertIn('$expr', mock_find.call_args.args[0])
+
+    def test_invalid_parameters(self):
+        response = self.get(async_views.SearchFoodTrucks, '/api/foodtruck/search/', {'limit': 0})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content), {'error_message': 'invalid limit parameter'})
+
+
+class GeoIndexTest(TestCase):
+    def test_haversine(self):
+        # One degree of longitude on the equator
+        self.assertAlmostEqual(haversine(0, 0, 1, 0), 111318.8, places=0)
+        self.assertEqual(haversine(-122.4, 37.7, -122.4, 37.7), 0)
+
+    def test_within_matches_brute_force(self):
+        # Trucks on a small grid around San Francisco
+        documents = [
+            {'applicant': str(i), 'location': {'type': 'Point', 'coordinates': [-122.45 + (i % 10) * 0.007, 37.75 + (i // 10) * 0.006]}}
+            for i in range(100)
+        ]
+        index = GeoIndex(documents, cell_size=0.01)
+        for radius in (10, 500, 1500, 5000, 50000):
+            with self.subTest(radius=radius):
+                expected = sorted(
+                    (haversine(-122.42, 37.78, *d['location']['coordinates']), d['applicant'])
+                    for d in documents
+                    if haversine(-122.42, 37.78, *d['location']['coordinates']) <= radius
+                )
+                result = [(distance, d['applicant']) for distance, d in index.within(-122.42, 37.78, radius)]
+                self.assertEqual(result, expected)
+
+    def test_top_k(self):
+        distances = np.array([5.0, 1.0, 3.0, 1.0, 4.0])
+        # Ties are broken by position
+        self.assertEqual(top_k(distances, 3).tolist(), [1, 3, 2])
+        self.assertEqual(top_k(distances, None).tolist(), [1, 3, 2, 4, 0])
+        self.assertEqual(top_k(distances, 10).tolist(), [1, 3, 2, 4, 0])
+        # Including ties at the cut
+        self.assertEqual(top_k(np.zeros(50), 3).tolist(), [0, 1, 2])
+
+    def test_nearest_matches_within(self):
+        documents = [
+            {'applicant': str(i), 'location': {'type': 'Point', 'coordinates': [-122.45 + (i % 7) * 0.01, 37.75 + (i // 7) * 0.004]}}
+            for i in range(70)
+        ]
+        index = GeoIndex(documents)
+        store = CoordinateStore(documents)
+        for radius, limit in ((800, None), (800, 3), (3000, 10)):
+            with self.subTest(radius=radius, limit=limit):
+                expected = [d['applicant'] for _, d in index.within(-122.43, 37.76, radius, limit=limit)]
+                result = [d['applicant'] for _, d in store.nearest(-122.43, 37.76, limit=limit, radius=radius)]
+                self.assertEqual(result, expected)
+        # Without a radius every document is ranked
+        self.assertEqual(len(store.nearest(-122.43, 37.76)), 70)
+        self.assertEqual(len(index.nearest(-122.43, 37.76, limit=5)), 5)
+
+    def test_pages_match_full_ranking(self):
+        documents = [
+            {'_id': ObjectId(), 'applicant': str(i), 'location': {'type': 'Point', 'coordinates': [-122.45 + (i % 5) * 0.01, 37.75]}}
+            for i in range(40)
+        ]
+        index = GeoIndex(sorted(documents, key=lambda d: d['_id']))
+        for radius in (None, 2000):
+            with self.subTest(radius=radius):
+                expected = [d['applicant'] for _, d in index.nearest(-122.43, 37.75, radius=radius)]
+                result, after = [], None
+                while True:
+                    page = index.nearest(-122.43, 37.75, limit=6, radius=radius, after=after)
+                    if not page:
+                        break
+                    result += [d['applicant'] for _, d in page]
+                    after = (page[-1][0], page[-1][1]['_id'])
+                self.assertEqual(result, expected)
+
+    def test_cluster_index_matches_greedy_clustering(self):
+        rng = np.random.default_rng(0)
+        xs, ys = rng.random(200) * 0.01, rng.random(200) * 0.01
+        # A third of the points at the same coordinates
+        xs[:70], ys[:70] = xs[0], ys[0]
+        for distance in (1e-4, 1e-3, 5e-3):
+            with self.subTest(distance=distance):
+                # Each point not merged yet absorbs the points not merged yet within distance
+                leaders = [None] * len(xs)
+                for i in range(len(xs)):
+                    if leaders[i] is not None:
+                        continue
+                    for j in range(i, len(xs)):
+                        if leaders[j] is None and (xs[j] - xs[i]) ** 2 + (ys[j] - ys[i]) ** 2 <= distance ** 2:
+                            leaders[j] = i
+                labels, _, _, weights = merge_clusters(xs, ys, np.ones(len(xs)), distance)
+                self.assertEqual(labels.tolist(), np.unique(leaders, return_inverse=True)[1].tolist())
+                self.assertEqual(weights.sum(), len(xs))
+
+    def test_cluster_index_is_hierarchical(self):
+        rng = np.random.default_rng(1)
+        longitudes, latitudes = -122.45 + rng.random(300) * 0.1, 37.7 + rng.random(300) * 0.1
+        index = ClusterIndex(longitudes, latitudes, 40, 18)
+        counts = [len(np.unique(index.labels[zoom])) for zoom in range(19)]
+        self.assertEqual(counts, sorted(counts))
+        self.assertEqual(counts[0], 1)
+        for zoom in range(18):
+            # Points of a cluster are in the same cluster at the zoom level below
+            pairs = np.unique(np.stack([index.labels[zoom + 1], index.labels[zoom]]), axis=1)
+            self.assertEqual(len(np.unique(pairs[0])), pairs.shape[1])
+
+        alone, clusters = index.group(np.arange(300), 12)
+        self.assertEqual(len(alone) + sum(cluster['count'] for cluster in clusters), 300)
+        self.assertEqual(index.group(np.arange(0), 12), ([], []))
+        # Documents without a location are never clustered
+        documents = [{'location': {'type': 'Point', 'coordinates': [0, 0]}} for _ in range(2)] + [{'applicant': 'no location'}]
+        self.assertEqual(cluster_documents(documents, 5, 40, 10), ([documents[2]], [{'count': 2, 'longitude': 0.0, 'latitude': 0.0}]))
+
+    def test_documents_without_location_are_skipped(self):
+        index = GeoIndex([{'applicant': 'no location'}, {'location': {'type': 'Point', 'coordinates': [0, 0]}}])
+        self.assertEqual(len(index), 1)
+
+class GetAllFoodTrucksTest(APITestCase):
     def setUp(self):
+        super().setUp()
         # Mock data for FoodTruck document
         self.mock_return_value = {
             'applicant': 'mock',
@@ -88,10 +982,68 @@ class GetAllFoodTrucksTest(TestCase):
             'data': mock_find.return_value
         }
         self.assertEqual(response.json(), expected_data)
- 
- 
-class SearchFoodTrucksTest(TestCase):
+
+    @patch.object(food_truck_collection, 'count_documents')
+    @patch.object(food_truck_collection, 'find')
+    def test_get_all_food_trucks_streamed_as_json(self, mock_find, mock_count_documents):
+        documents = [dict(self.mock_return_value, applicant=str(i), approved_at=datetime(2024, 1, i + 1)) for i in range(3)]
+        mock_find.return_value = iter(documents)
+        mock_count_documents.return_value = 3
+
+        response = self.client.get('/api/foodtruck/all/', {'stream': 'json'})
+
+        # The streamed body matches the regular response
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['X-Total-Count'], '3')
+        body = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(body, {'count': 3, 'data': FoodTruckSerializer(documents, many=True).data})
+        self.assertIn('batch_size', mock_find.call_args.kwargs)
+
+    @patch.object(food_truck_collection, 'count_documents')
+    @patch.object(food_truck_collection, 'find')
+    def test_get_all_food_trucks_streamed_as_ndjson(self, mock_find, mock_count_documents):
+        mock_find.return_value = iter([self.mock_return_value, self.mock_return_value])
+        mock_count_documents.return_value = 2
+
+        response = self.client.get('/api/foodtruck/all/', {'stream': 'ndjson'})
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [self.mock_return_value] * 2)
+
+    def test_get_all_food_trucks_invalid_stream(self):
+        response = self.client.get('/api/foodtruck/all/', {'stream': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    @patch.object(food_truck_collection, 'find')
+    def test_get_all_food_trucks_paginated(self, mock_find):
+        ids = [ObjectId() for _ in range(3)]
+        mock_find.return_value = [dict(self.mock_return_value, _id=truck_id) for truck_id in ids]
+
+        response = self.client.get('/api/foodtruck/all/', {'limit': 2})
+
+        # One extra truck is read to tell there is a next page
+        body = response.json()
+        self.assertEqual(body['count'], 2)
+        self.assertEqual(decode_cursor(body['next'], 1), [ids[1]])
+        mock_find.assert_called_once_with({}, projection=food_truck_encoder.projection, sort=[('_id', 1)], limit=3)
+
+        # The next page seeks past the cursor instead of skipping documents
+        mock_find.return_value = [dict(self.mock_return_value, _id=ids[2])]
+        response = self.client.get('/api/foodtruck/all/', {'limit': 2, 'cursor': body['next']})
+        self.assertIsNone(response.json()['next'])
+        self.assertEqual(mock_find.call_args.args[0], {'_id': {'$gt': ids[1]}})
+
+    def test_get_all_food_trucks_pagination_errors(self):
+        for params in ({'cursor': 'x'}, {'limit': 0}, {'limit': 2, 'stream': 'json'}):
+            with self.subTest(params=params):
+                response = self.client.get('/api/foodtruck/all/', params)
+                self.assertEqual(response.status_code, 400)
+
+
+class SearchFoodTrucksTest(APITestCase):
     def setUp(self):
+        super().setUp()
         # Mock data for FoodTruck document
         self.mock_return_value = [{
             'applicant': 'mock',
@@ -171,9 +1123,224 @@ class SearchFoodTrucksTest(TestCase):
         self.assertIn('invalid location filter parameter', response.json()['error_message'])
     
     @patch.object(food_truck_collection, 'aggregate')
-    def test_search_food_trucks_no_results(self, mock_aggregate):
+    def test_search_food_trucks_sorted_by_distance_without_radius(self, mock_aggregate):
+        # Matching trucks returned by MongoDB in arbitrary order
+        mock_aggregate.return_value = [
+            dict(self.mock_return_value[0], applicant=str(offset), location={'type': 'Point', 'coordinates': [offset, 0]})
+            for offset in (3, 1, 2)
+        ]
+
+        response = self.client.get('/api/foodtruck/search/', {'latitude': 0, 'longitude': 0, 'sort': 'distance'})
+
+        # The trucks are returned nearest first with their distance, and no $geoNear stage is used
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual([truck['applicant'] for truck in data], ['1', '2', '3'])
+        self.assertAlmostEqual(data[0]['distance'], haversine(0, 0, 1, 0))
+        pipeline = mock_aggregate.call_args.args[0]
+        self.assertFalse(any('$geoNear' in stage or '$limit' in stage for stage in pipeline))
+
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_search_food_trucks_location_without_radius_or_sort(self, mock_aggregate):
+        mock_aggregate.return_value = [
+            dict(self.mock_return_value[0], applicant=str(offset), location={'type': 'Point', 'coordinates': [offset, 0]})
+            for offset in (3, 1, 2)
+        ]
+
+        response = self.client.get('/api/foodtruck/search/', {'latitude': 0, 'longitude': 0, 'limit': 5})
+
+        # The results keep their order, without distances
+        data = response.json()['data']
+        self.assertEqual([truck['applicant'] for truck in data], ['3', '1', '2'])
+        self.assertFalse(any('distance' in truck for truck in data))
+        pipeline = mock_aggregate.call_args.args[0]
+        self.assertEqual(pipeline, [{'$sort': {'_id': 1}}, {'$limit': 6}, {'$project': food_truck_encoder.projection}])
+
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_search_food_trucks_paginated_by_distance_without_radius(self, mock_aggregate):
+        ids = [ObjectId(), ObjectId()]
+        mock_aggregate.return_value = [dict(self.mock_return_value[0], _id=ids[i], distance=d) for i, d in enumerate((5.0, 6.0))]
+
+        response = self.client.get('/api/foodtruck/search/', {
+            'latitude': 0, 'longitude': 0, 'sort': 'distance', 'limit': 1, 'cursor': encode_cursor(4.0, ObjectId()),
+        })
+
+        # The page is read through $geoNear from the cursor on, not ranked over every match
+        body = response.json()
+        self.assertEqual(body['count'], 1)
+        self.assertEqual(decode_cursor(body['next'], 2), [5.0, ids[0]])
+        pipeline = mock_aggregate.call_args.args[0]
+        self.assertNotIn('maxDistance', pipeline[0]['$geoNear'])
+        self.assertEqual(pipeline[0]['$geoNear']['minDistance'], 4.0)
+        self.assertEqual(pipeline[-3:-1], [{'$sort': {'distance': 1, '_id': 1}}, {'$limit': 2}])
+
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_search_food_trucks_with_limit(self, mock_aggregate):
+        mock_aggregate.return_value = self.mock_return_value
+
+        response = self.client.get('/api/foodtruck/search/', {'limit': 5})
+
+        # The limit is pushed down to the aggregation pipeline, in _id order
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_aggregate.call_args.args[0], [{'$sort': {'_id': 1}}, {'$limit': 6}, {'$project': food_truck_encoder.projection}])
+        self.assertIsNone(response.json()['next'])
+
+    @patch.object(food_truck_term_collection, 'find')
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_search_food_trucks_next_page(self, mock_aggregate, mock_term_find):
+        ids = [ObjectId() for _ in range(3)]
+        mock_term_find.return_value = [{'ids': ids}]
+        mock_aggregate.return_value = [dict(self.mock_return_value[0], _id=ids[2])]
+
+        response = self.client.get('/api/foodtruck/search/', {'q': 'mock', 'limit': 2, 'cursor': encode_cursor(ids[1])})
+
+        # Only the matched ids after the cursor are sent and _id is not returned
+        self.assertEqual(response.json(), {'count': 1, 'data': self.mock_return_value, 'next': None})
+        match = mock_aggregate.call_args.args[0][0]['$match']
+        self.assertEqual(match['_id'], {'$in': [ids[2]], '$gt': ids[1]})
+
+    @override_settings(SEARCH_ID_BATCH_SIZE=2)
+    @patch.object(food_truck_term_collection, 'find')
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_search_food_trucks_sends_matched_ids_in_batches(self, mock_aggregate, mock_term_find):
+        ids = sorted(ObjectId() for _ in range(7))
+        mock_term_find.return_value = [{'ids': ids[::-1]}]
+        mock_aggregate.side_effect = [
+            [dict(self.mock_return_value[0], _id=ids[0])],
+            [dict(self.mock_return_value[0], _id=truck_id) for truck_id in ids[2:4]],
+        ]
+
+        response = self.client.get('/api/foodtruck/search/', {'q': 'mock', 'limit': 2})
+
+        # Batches of sorted ids are read until the page and the extra truck are found
+        body = response.json()
+        self.assertEqual(body['count'], 2)
+        self.assertEqual(decode_cursor(body['next'], 1), [ids[2]])
+        batches = [pipeline.args[0][0]['$match']['_id']['$in'] for pipeline in mock_aggregate.call_args_list]
+        self.assertEqual(batches, [ids[:2], ids[2:4]])
+
+    @patch.object(food_truck_term_collection, 'find')
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_search_food_trucks_short_word_uses_regex(self, mock_aggregate, mock_term_find):
+        mock_aggregate.return_value = self.mock_return_value
+
+        response = self.client.get('/api/foodtruck/search/', {'q': 'TA'})
+
+        # Words of one or two letters are matched anywhere, as before the term index
+        self.assertEqual(response.json()['count'], 1)
+        mock_term_find.assert_not_called()
+        self.assertEqual(mock_aggregate.call_args.args[0][0], {'$match': short_word_filter('ta')})
+
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_search_food_trucks_paginated_by_distance(self, mock_aggregate):
+        truck_id = ObjectId()
+        mock_aggregate.return_value = [dict(self.mock_return_value[0], _id=truck_id, distance=d) for d in (5.0, 6.0)]
+
+        response = self.client.get('/api/foodtruck/search/', {
+            'latitude': 0, 'longitude': 0, 'radius': 50, 'limit': 1, 'cursor': encode_cursor(4.0, ObjectId()),
+        })
+
+        body = response.json()
+        self.assertEqual(body['count'], 1)
+        self.assertEqual(decode_cursor(body['next'], 2), [5.0, truck_id])
+        pipeline = mock_aggregate.call_args.args[0]
+        self.assertEqual(pipeline[0]['$geoNear']['minDistance'], 4.0)
+        self.assertEqual(pipeline[-3:-1], [{'$sort': {'distance': 1, '_id': 1}}, {'$limit': 2}])
+
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_search_food_trucks_fields(self, mock_aggregate):
+        mock_aggregate.return_value = [{'applicant': 'mock', 'id': 'truck'}]
+
+        response = self.client.get('/api/foodtruck/search/', {'status': 'APPROVED', 'fields': 'pin'})
+
+        self.assertEqual(response.json()['data'], mock_aggregate.return_value)
+        self.assertEqual(mock_aggregate.call_args.args[0][-1], {'$project': {
+            'applicant': 1, 'location': 1, 'id': {'$toString': '$_id'}, '_id': 0,
+        }})
+        response = self.client.get('/api/foodtruck/search/', {'fields': 'approved'})
+        self.assertEqual(response.json(), {'error_message': 'invalid fields parameter'})
+
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_search_food_trucks_hides_ingest_fields(self, mock_aggregate):
+        stored = dict(
+            self.mock_return_value[0], _id=ObjectId(), row_hash='hash', location_id='1', permit='P1',
+            open_intervals=[{'start': 0, 'end': 60}], food_keys=['tacos'],
+        )
+
+        def aggregate(pipeline, **kwargs):
+            if '$count' in pipeline[-1]:
+                return [{'count': 1}]
+            # Apply the inclusion projection of the pipeline like MongoDB
+            projection = pipeline[-1]['$project']
+            return [
+                {key: value for key, value in stored.items() if projection.get(key) == 1 or (key == '_id' and projection.get('_id', 1))}
+            ]
+
+        mock_aggregate.side_effect = aggregate
+        for params in ({}, {'limit': 5}, {'q': 'mock', 'stream': 'json'}, {'latitude': 0, 'longitude': 0}):
+            with self.subTest(params=params), patch('search.views.resolve_query', return_value=[stored['_id']]):
+                response = self.client.get('/api/foodtruck/search/', params)
+                body = json.loads(b''.join(response.streaming_content)) if response.streaming else response.json()
+                for truck in body['data']:
+                    self.assertFalse({'row_hash', 'location_id', 'permit', 'open_intervals', 'food_keys', '_id'} & set(truck))
+                    self.assertEqual(truck['applicant'], 'mock')
+
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_search_food_trucks_fields_sorted_by_distance(self, mock_aggregate):
+        mock_aggregate.return_value = [
+            {'applicant': str(offset), 'location': {'type': 'Point', 'coordinates': [offset, 0]}}
+            for offset in (2, 1)
+        ]
+
+        response = self.client.get('/api/foodtruck/search/', {'latitude': 0, 'longitude': 0, 'sort': 'distance', 'fields': 'applicant'})
+
+        # The coordinates are only read to rank the trucks
+        self.assertEqual(mock_aggregate.call_args.args[0][-1], {'$project': {'applicant': 1, 'distance': 1, 'location': 1, '_id': 0}})
+        self.assertEqual([sorted(truck) for truck in response.json()['data']], [['applicant', 'distance']] * 2)
+        self.assertEqual([truck['applicant'] for truck in response.json()['data']], ['1', '2'])
+
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_search_food_trucks_open_at(self, mock_aggregate):
+        mock_aggregate.return_value = self.mock_return_value
+
+        # 7:30PM in UTC is 12:30PM on Monday in San Francisco
+        response = self.client.get('/api/foodtruck/search/', {'status': 'APPROVED', 'open_at': '2024-05-06T19:30:00+00:00'})
+
+        self.assertEqual(response.status_code, 200)
+        match = mock_aggregate.call_args.args[0][0]['$match']
+        self.assertEqual(match['status'], 'APPROVED')
+        self.assertEqual(match['open_intervals'], {'$elemMatch': {'start': {'$lte': 750}, 'end': {'$gt': 750}}})
+
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_search_food_trucks_food(self, mock_aggregate):
+        mock_aggregate.return_value = self.mock_return_value
+
+        response = self.client.get('/api/foodtruck/search/', {'food': ' Tacos'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_aggregate.call_args.args[0][0], {'$match': {'food_keys': 'tacos'}})
+
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_search_food_trucks_streamed(self, mock_aggregate):
+        # The first aggregation counts the results, the second one returns them
+        mock_aggregate.side_effect = [[{'count': 1}], iter(self.mock_return_value)]
+
+        response = self.client.get('/api/foodtruck/search/', {'status': 'APPROVED', 'stream': 'json'})
+
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), {'count': 1, 'data': self.mock_return_value})
+        count_pipeline = mock_aggregate.call_args_list[0].args[0]
+        self.assertEqual(count_pipeline, [{'$match': {'status': 'APPROVED'}}, {'$count': 'count'}])
+
+    def test_search_food_trucks_sort_by_distance_requires_location(self):
+        response = self.client.get('/api/foodtruck/search/', {'sort': 'distance'})
+        self.assertEqual(response.status_code, 400)
+
+    @patch.object(food_truck_term_collection, 'find')
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_search_food_trucks_no_results(self, mock_aggregate, mock_term_find):
         # Mock the MongoDB aggregate method to return an empty list
         mock_aggregate.return_value = []
+        mock_term_find.return_value = []
 
         # Make GET request to the endpoint with a search query that yields no results
         response = self.client.get('/api/foodtruck/search/', {'q': 'nonexistent'})
@@ -183,6 +1350,315 @@ class SearchFoodTrucksTest(TestCase):
 
         # Check that the count is 0
         self.assertEqual(response.json()['count'], 0)        
+
+    @patch.object(food_truck_term_collection, 'find')
+    @patch.object(food_truck_collection, 'aggregate')
+    def test_search_food_trucks_query_uses_term_index(self, mock_aggregate, mock_term_find):
+        truck_id = ObjectId()
+        mock_aggregate.return_value = self.mock_return_value
+        mock_term_find.return_value = [{'ids': [truck_id]}]
+
+        # Regex metacharacters in the query are not passed to MongoDB
+        response = self.client.get('/api/foodtruck/search/', {'q': 'Taco.*'})
+
+        self.assertEqual(response.status_code, 200)
+        mock_term_find.assert_called_once_with({'term': {'$regex': '^taco'}}, {'ids': 1, '_id': 0}, limit=501)
+        pipeline = mock_aggregate.call_args.args[0]
+        self.assertEqual(pipeline[0], {'$match': {'_id': {'$in': [truck_id]}}})
+
+class EncoderTest(TestCase):
+    def setUp(self):
+        self.documents = [
+            {
+                '_id': ObjectId(),
+                'applicant': 'Crêpes & Café',
+                'facility_type': 'Truck',
+                'location_description': 'mock location description',
+                'address': 'mock address',
+                'status': 'APPROVED',
+                'food_items': ['Crepes', 'Coffee'],
+                'approved_at': datetime(2024, 1, 2, 3, 4, 5, 678000),
+                'location': {'type': 'Point', 'coordinates': [-122.41, 37.77]},
+                'open_hours': {'Mo': ['10AM-2PM']},
+                'row_hash': 'not a model field',
+            },
+            # Optional fields missing or null, coordinates stored as a pair
+            {
+                'applicant': 'mock',
+                'facility_type': 'Push Cart',
+                'location_description': 'mock location description',
+                'address': 'mock address',
+                'status': 'REQUESTED',
+                'approved_at': None,
+                'location': [-122.4, 37.7],
+            },
+        ]
+
+    def test_matches_drf_serializer(self):
+        self.assertEqual(food_truck_encoder.to_list(self.documents), FoodTruckSerializer(self.documents, many=True).data)
+
+    def test_projection_reads_model_fields_only(self):
+        self.assertNotIn('id', food_truck_encoder.projection)
+        self.assertEqual(food_truck_encoder.projection['approved_at'], 1)
+
+    def test_select_fields(self):
+        encoder = food_truck_encoder.select(['location', 'id'])
+        self.assertIs(food_truck_encoder.select(['id', 'location']), encoder)
+        self.assertEqual(encoder.projection, {'location': 1, '_id': 1})
+        self.assertEqual(encoder.to_list(self.documents), [
+            {'location': self.documents[0]['location'], 'id': str(self.documents[0]['_id'])},
+            {'location': {'type': 'Point', 'coordinates': [-122.4, 37.7]}},
+        ])
+
+    def test_renderer_matches_drf_renderer(self):
+        data = {'count': 2, 'data': food_truck_encoder.to_list(self.documents)}
+        expected = JSONRenderer().render(data)
+        self.assertEqual(FastJSONRenderer().render(data), expected)
+        # Same output without orjson
+        with patch.object(encoders, 'orjson', None):
+            self.assertEqual(FastJSONRenderer().render(data), expected)
+            self.assertEqual(dumps(data), expected)
+
+    def test_nested_bson_values(self):
+        document = dict(self.documents[0], open_hours={'Mo': {'id': ObjectId('65a1b2c3d4e5f60718293a4b'), 'at': datetime(2024, 1, 1)}})
+        encoded = json.loads(food_truck_encoder.encode(document))
+        self.assertEqual(encoded['open_hours'], {'Mo': {'id': '65a1b2c3d4e5f60718293a4b', 'at': '2024-01-01T00:00:00Z'}})
+
+
+class ExportTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.documents = [
+            {
+                '_id': ObjectId(),
+                'location_id': '1',
+                'applicant': 'Tacos',
+                'status': 'APPROVED',
+                'approved_at': datetime(2024, 1, 2, 3, 4, 5),
+                'location': {'type': 'Point', 'coordinates': [-122.41, 37.77]},
+                'food_items': ['Tacos', 'Soda!'],
+                'open_intervals': [{'start': 600, 'end': 840}],
+            },
+            # Seeded before open_intervals existed, without a location
+            {'_id': ObjectId(), 'applicant': 'Coffee', 'open_hours': {'Tuesday': [{'start_time': '8AM', 'end_time': '10AM'}]}},
+        ]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache_dir = directory.name
+
+    def read(self, data, file_format='parquet'):
+        if file_format == 'parquet':
+            return export.pa.parquet.read_table(export.pa.BufferReader(data)).to_pylist()
+        return export.pa.ipc.open_file(export.pa.BufferReader(data)).read_all().to_pylist()
+
+    @skipIf(export.pa is None, 'pyarrow is not installed')
+    @patch.object(food_truck_collection, 'find')
+    def test_tables(self, mock_find):
+        mock_find.return_value = self.documents
+        ids = [str(document['_id']) for document in self.documents]
+
+        for file_format in export.EXPORT_FORMATS:
+            with override_settings(EXPORT_CACHE_DIR=os.path.join(self.cache_dir, file_format)):
+                response = self.client.get('/api/foodtruck/export/', {'format': file_format})
+                trucks = self.read(b''.join(response.streaming_content), file_format)
+                self.assertEqual(trucks[0]['longitude'], -122.41)
+                self.assertEqual(trucks[0]['approved_at'], datetime(2024, 1, 2, 3, 4, 5))
+                self.assertEqual(trucks[1], dict.fromkeys(trucks[1], None) | {'id': ids[1], 'applicant': 'Coffee', 'food_items': []})
+
+                response = self.client.get('/api/foodtruck/export/', {'format': file_format, 'table': 'food_items'})
+                self.assertEqual(self.read(b''.join(response.streaming_content), file_format), [
+                    {'truck_id': ids[0], 'food_item': 'Tacos', 'food_key': 'tacos'},
+                    {'truck_id': ids[0], 'food_item': 'Soda!', 'food_key': 'soda'},
+                ])
+
+                response = self.client.get('/api/foodtruck/export/', {'format': file_format, 'table': 'open_intervals'})
+                self.assertEqual(self.read(b''.join(response.streaming_content), file_format), [
+                    {'truck_id': ids[0], 'start': 600, 'end': 840},
+                    {'truck_id': ids[1], 'start': 1920, 'end': 2040},
+                ])
+        self.assertEqual(mock_find.call_args.kwargs['projection'], {'open_intervals': 1, 'open_hours': 1})
+
+    @skipIf(export.pa is None, 'pyarrow is not installed')
+    @patch.object(food_truck_collection, 'find')
+    def test_export_is_cached_by_data_version(self, mock_find):
+        mock_find.return_value = self.documents
+
+        with override_settings(EXPORT_CACHE_DIR=self.cache_dir):
+            for _ in range(2):
+                response = self.client.get('/api/foodtruck/export/')
+                self.assertEqual(response['Content-Disposition'], 'attachment; filename="food_truck-trucks.parquet"')
+                self.assertEqual(response['X-Data-Version'], '1')
+                self.assertEqual(len(self.read(b''.join(response.streaming_content))), 2)
+            mock_find.assert_called_once()
+
+            # A new data version writes a new file and deletes the previous one
+            self.mock_data_version.return_value = {'_id': data_version.DATA_VERSION_ID, 'value': 2}
+            data_version._checked_at = None
+            b''.join(self.client.get('/api/foodtruck/export/').streaming_content)
+            self.assertEqual(mock_find.call_count, 2)
+            self.assertEqual(os.listdir(self.cache_dir), ['food_truck-trucks-v2.parquet'])
+
+    @skipIf(export.pa is None, 'pyarrow is not installed')
+    @patch.object(food_truck_collection, 'find')
+    def test_export_in_batches(self, mock_find):
+        mock_find.return_value = self.documents * 5
+
+        path = os.path.join(self.cache_dir, 'trucks.parquet')
+        self.assertEqual(export.write_export(food_truck_collection, path, 'trucks', 'parquet', batch_size=4), 10)
+
+        # One row group per batch of documents
+        self.assertEqual(export.pa.parquet.ParquetFile(path).num_row_groups, 3)
+        self.assertEqual(mock_find.call_args.kwargs['batch_size'], 4)
+
+    @skipIf(export.pa is None, 'pyarrow is not installed')
+    @patch('search.management.commands.export_data.food_truck_collection')
+    def test_export_command(self, mock_collection):
+        mock_collection.find.return_value = self.documents
+        path = os.path.join(self.cache_dir, 'food_items.arrow')
+        out = StringIO()
+
+        call_command('export_data', '--table', 'food_items', '--format', 'arrow', '--output', path, stdout=out)
+
+        self.assertIn('Exported 2 rows', out.getvalue())
+        with open(path, 'rb') as file:
+            self.assertEqual([row['food_key'] for row in self.read(file.read(), 'arrow')], ['tacos', 'soda'])
+
+    def test_invalid_parameters(self):
+        for params, message in (
+            ({'table': 'foods'}, 'invalid table parameter'),
+            ({'format': 'csv'}, 'invalid format parameter'),
+        ):
+            response = self.client.get('/api/foodtruck/export/', params)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'error_message': message})
+
+    def test_without_pyarrow(self):
+        with patch.object(export, 'pa', None):
+            response = self.client.get('/api/foodtruck/export/')
+        self.assertEqual(response.status_code, 501)
+
+
+class TextIndexTest(TestCase):
+    def test_tokenize(self):
+        self.assertEqual(tokenize("Crêpes & Café: Hot-Dogs 2"), ['crepes', 'cafe', 'hot', 'dogs', '2'])
+        self.assertEqual(tokenize(".*"), [])
+
+    def test_term_buckets(self):
+        first, second = ObjectId(), ObjectId()
+        documents = [
+            {'_id': first, 'applicant': 'Taco Truck', 'address': '1 Market St', 'food_items': ['Tacos', 'Burritos']},
+            {'_id': second, 'applicant': 'Hot Dogs', 'address': '2 Mission St', 'food_items': []},
+        ]
+        self.assertEqual(document_terms(documents[1]), {'hot', 'dogs', '2', 'mission', 'st'})
+
+        buckets = list(term_buckets(documents))
+        self.assertIn({'term': 'st', 'bucket': 0, 'count': 2, 'ids': [first, second]}, buckets)
+        self.assertIn({'term': 'tacos', 'bucket': 0, 'count': 1, 'ids': [first]}, buckets)
+        self.assertNotIn('Taco', [bucket['term'] for bucket in buckets])
+
+    def test_term_buckets_are_bounded(self):
+        ids = [ObjectId() for _ in range(5)]
+        documents = [{'_id': truck_id, 'applicant': 'Taco'} for truck_id in ids]
+
+        # Full buckets are yielded as soon as they are full
+        self.assertEqual(list(term_buckets(documents, bucket_size=2)), [
+            {'term': 'taco', 'bucket': 0, 'count': 2, 'ids': ids[:2]},
+            {'term': 'taco', 'bucket': 1, 'count': 2, 'ids': ids[2:4]},
+            {'term': 'taco', 'bucket': 2, 'count': 1, 'ids': ids[4:]},
+        ])
+        # Partial buckets are yielded once too many ids are pending
+        documents = [{'_id': truck_id, 'applicant': 'Taco Truck'} for truck_id in ids[:3]]
+        buckets = list(term_buckets(documents, bucket_size=10, pending_limit=4))
+        self.assertCountEqual([(bucket['term'], bucket['bucket'], bucket['ids']) for bucket in buckets], [
+            ('taco', 0, ids[:2]), ('truck', 0, ids[:2]), ('taco', 1, ids[2:3]), ('truck', 1, ids[2:3]),
+        ])
+
+    def test_rebuild_term_index(self):
+        truck_id = ObjectId()
+        trucks = MagicMock()
+        trucks.find.return_value = [{'_id': truck_id, 'applicant': 'Taco Truck'}]
+        terms = MagicMock()
+        terms.name = 'food_truck_terms'
+        building = terms.database.__getitem__.return_value
+
+        self.assertEqual(rebuild_term_index(trucks, terms), 2)
+        # The index is written aside, then replaces the live one
+        terms.database.__getitem__.assert_called_once_with('food_truck_terms_rebuild')
+        building.create_index.assert_called_once_with([('term', 1), ('bucket', 1)], unique=True)
+        building.rename.assert_called_once_with('food_truck_terms', dropTarget=True)
+        self.assertCountEqual(building.bulk_write.call_args.args[0], [
+            InsertOne({'term': 'taco', 'bucket': 0, 'count': 1, 'ids': [truck_id]}),
+            InsertOne({'term': 'truck', 'bucket': 0, 'count': 1, 'ids': [truck_id]}),
+        ])
+
+    def test_term_removals(self):
+        truck_id = ObjectId()
+        self.assertEqual(term_removals([{'_id': truck_id, 'applicant': 'Taco'}]), [
+            UpdateOne({'term': 'taco', 'ids': truck_id}, {'$pull': {'ids': truck_id}, '$inc': {'count': -1}}),
+            DeleteMany({'term': 'taco', 'count': {'$lte': 0}}),
+        ])
+
+    def test_term_additions_fill_the_last_bucket(self):
+        ids = [ObjectId() for _ in range(4)]
+        terms = MagicMock()
+        terms.find.return_value = [
+            {'term': 'taco', 'bucket': 0, 'count': 2},
+            {'term': 'taco', 'bucket': 1, 'count': 1},
+            {'term': 'truck', 'bucket': 0, 'count': 2},
+        ]
+        documents = [{'_id': truck_id, 'applicant': 'Taco Truck'} for truck_id in ids[:3]] + [{'_id': ids[3], 'applicant': 'Tea'}]
+
+        self.assertEqual(term_additions(terms, documents, bucket_size=2), [
+            UpdateOne({'term': 'taco', 'bucket': 1}, {'$push': {'ids': {'$each': ids[:1]}}, '$inc': {'count': 1}}),
+            InsertOne({'term': 'taco', 'bucket': 2, 'count': 2, 'ids': ids[1:3]}),
+            InsertOne({'term': 'tea', 'bucket': 0, 'count': 1, 'ids': ids[3:]}),
+            InsertOne({'term': 'truck', 'bucket': 1, 'count': 2, 'ids': ids[:2]}),
+            InsertOne({'term': 'truck', 'bucket': 2, 'count': 1, 'ids': ids[2:3]}),
+        ])
+        terms.find.assert_called_once_with(
+            {'term': {'$in': ['taco', 'tea', 'truck']}}, {'term': 1, 'bucket': 1, 'count': 1, '_id': 0}
+        )
+
+    def test_resolve_query_intersects_words(self):
+        first, second, third = ObjectId(), ObjectId(), ObjectId()
+        postings = {'^burrit': [[first, second]], '^taco': [[second], [third]]}
+        terms = MagicMock()
+        terms.find.side_effect = lambda query, projection, **kwargs: [{'ids': ids} for ids in postings[query['term']['$regex']]]
+
+        self.assertEqual(resolve_query(terms, 'taco burrit'), [second])
+        self.assertEqual(sorted(resolve_query(terms, 'TACO')), sorted([second, third]))
+        self.assertEqual(resolve_query(terms, '***'), [])
+
+    def test_resolve_query_skips_short_words(self):
+        first, second = ObjectId(), ObjectId()
+        terms = MagicMock()
+        terms.find.return_value = [{'ids': [second]}, {'ids': [first]}]
+
+        # Short words are left to short_word_filter, a single letter is never looked up
+        self.assertIsNone(resolve_query(terms, 'a b'))
+        terms.find.assert_not_called()
+        self.assertEqual(resolve_query(terms, 'a taco'), sorted([first, second]))
+        terms.find.assert_called_once_with({'term': {'$regex': '^taco'}}, {'ids': 1, '_id': 0}, limit=501)
+
+    def test_short_word_filter(self):
+        self.assertEqual(short_word_filter('tacos'), {})
+        self.assertEqual(short_word_filter('Tacos a'), {'$and': [{'$or': [
+            {'applicant': {'$regex': 'a', '$options': 'i'}},
+            {'address': {'$regex': 'a', '$options': 'i'}},
+            {'food_items': {'$elemMatch': {'$regex': 'a', '$options': 'i'}}},
+        ]}]})
+
+    @patch.object(text_index, 'MAX_PREFIX_POSTINGS', 1)
+    def test_resolve_query_common_prefix_matches_whole_terms(self):
+        first, second = ObjectId(), ObjectId()
+        terms = MagicMock()
+        terms.find.side_effect = [[{'ids': [first]}, {'ids': [second]}], [{'ids': [first]}]]
+
+        self.assertEqual(resolve_query(terms, 'taco'), [first])
+        self.assertEqual(terms.find.call_args_list, [
+            call({'term': {'$regex': '^taco'}}, {'ids': 1, '_id': 0}, limit=2),
+            call({'term': 'taco'}, {'ids': 1, '_id': 0}),
+        ])
         
 class TestLocationValidation(TestCase):
     def test_valid_location_params(self):
@@ -201,6 +1677,13 @@ class TestLocationValidation(TestCase):
         # Test with invalid radius
         self.assertFalse(validate_location_params(37.7749, -122.4194, "not_a_number"))
 
+    def test_limit(self):
+        # Only positive integers are valid limits
+        self.assertTrue(validate_limit_param("20"))
+        self.assertFalse(validate_limit_param("0"))
+        self.assertFalse(validate_limit_param("1.5"))
+        self.assertFalse(validate_limit_param(None))
+
 class TestOpenHoursParsing(TestCase):
     def test_valid_open_hours(self):
         # Test with valid open hours string
@@ -244,4 +1727,388 @@ class TestOpenHoursParsing(TestCase):
 
         # Test with empty string
         open_hours_str = ""
-        self.assertEqual(parse_open_hours(open_hours_str), {})
\ No newline at end of file
+        self.assertEqual(parse_open_hours(open_hours_str), {})
+
+    def test_errors_are_reported(self):
+        errors = []
+        open_hours = parse_open_hours("Mo:10AM-2PM/noon;Xy:1PM-2PM;Tu-Mo", errors)
+
+        # The readable slots are kept, the rest is reported
+        self.assertEqual(open_hours, {"Monday": [{"start_time": "10AM", "end_time": "2PM"}]})
+        self.assertEqual(errors, [
+            OpenHoursError("Mo:10AM-2PM/noon", "invalid time slot 'noon'"),
+            OpenHoursError("Xy:1PM-2PM", "expected days:start-end"),
+            OpenHoursError("Tu-Mo", "expected days:start-end"),
+        ])
+
+    def test_days_of_several_schedules_keep_every_slot(self):
+        open_hours = parse_open_hours("Tu/Sa:8AM-3PM;Mo-Tu:10AM-2PM;Sa-Mo:9PM-11PM")
+        self.assertEqual(open_hours["Tuesday"], [{"start_time": "8AM", "end_time": "3PM"}, {"start_time": "10AM", "end_time": "2PM"}])
+        # Ranges wrap around the end of the week
+        self.assertEqual(sorted(open_hours), ["Monday", "Saturday", "Sunday", "Tuesday"])
+
+    def test_memoized_results_are_not_shared(self):
+        parse_open_hours("Mo:10AM-2PM")["Monday"].append("changed")
+        self.assertEqual(parse_open_hours("Mo:10AM-2PM"), {"Monday": [{"start_time": "10AM", "end_time": "2PM"}]})
+
+    def test_bundled_csv_parses_without_errors(self):
+        errors = []
+        for row in read_rows(DEFAULT_CSV_PATH):
+            parse_open_hours(row['dayshours'], errors)
+        self.assertEqual(errors, [])
+
+    def test_fuzz_corpus(self):
+        # Random strings built from the tokens of the grammar, valid or not
+        tokens = list(DAY_NAMES) + ['Xx', '12AM', '10AM', '7PM', '13PM', '0AM', 'noon', ':', '-', '/', ';', ' ', '']
+        rng = random.Random(0)
+        for _ in range(2000):
+            open_hours_str = ''.join(rng.choice(tokens) for _ in range(rng.randint(0, 12)))
+            with self.subTest(open_hours_str=open_hours_str):
+                errors = []
+                open_hours = parse_open_hours(open_hours_str, errors)
+                self.assertLessEqual(set(open_hours), set(DAY_NAMES.values()))
+                for time_slots in open_hours.values():
+                    self.assertTrue(time_slots)
+                    for time_slot in time_slots:
+                        self.assertRegex(time_slot['start_time'], r'^(1[0-2]|0?[1-9])[AP]M$')
+                        self.assertRegex(time_slot['end_time'], r'^(1[0-2]|0?[1-9])[AP]M$')
+                self.assertTrue(all(isinstance(error, OpenHoursError) for error in errors))
+                # Every non-blank schedule is either parsed or reported
+                if any(schedule.strip() for schedule in open_hours_str.split(';')) and not open_hours:
+                    self.assertTrue(errors)
+
+class OpenIntervalsTest(TestCase):
+    def test_open_intervals(self):
+        test_cases = [
+            ("Mo-Fr:3PM-4PM", [{'start': 1440 * day + 900, 'end': 1440 * day + 960} for day in range(5)]),
+            # Noon and midnight
+            ("Tu:12AM-12PM", [{'start': 1440, 'end': 2160}]),
+            # Overlapping and adjacent slots are merged
+            ("Mo:7AM-8AM/8AM-10AM/9AM-11AM", [{'start': 420, 'end': 660}]),
+            # Slots past midnight end on the next day, and Sunday night wraps to Monday
+            ("Sa/Su:8PM-2AM", [{'start': 0, 'end': 120}, {'start': 8400, 'end': 8760}, {'start': 9840, 'end': 10080}]),
+            ("Invalid format", []),
+        ]
+        for input_str, expected_output in test_cases:
+            with self.subTest(input_str=input_str):
+                self.assertEqual(open_intervals(parse_open_hours(input_str)), expected_output)
+
+    def test_unreadable_slots_are_closed(self):
+        open_hours = {'Monday': [{'start_time': '25AM', 'end_time': '2PM'}, {'start_time': '1PM', 'end_time': '2PM'}], 'Moonday': []}
+        self.assertEqual(open_intervals(open_hours), [{'start': 780, 'end': 840}])
+
+    def test_parse_open_at(self):
+        self.assertEqual(parse_open_at('2024-05-06T12:30'), 750)
+        # Datetimes with an offset are converted to the time zone of the open hours
+        self.assertEqual(parse_open_at('2024-05-06T19:30:00+00:00'), 750)
+        # 5AM on Monday in UTC is still 10PM on Sunday there
+        self.assertEqual(parse_open_at('2024-05-06T05:00:00+00:00'), 6 * 1440 + 22 * 60)
+        with self.assertRaises(ValueError):
+            parse_open_at('noon')
+
+    def test_index_matches_brute_force(self):
+        rng = np.random.default_rng(3)
+        documents = []
+        for _ in range(200):
+            starts = np.sort(rng.choice(10080, size=rng.integers(0, 4) * 2, replace=False))
+            documents.append({'open_intervals': [{'start': int(start), 'end': int(end)} for start, end in zip(starts[::2], starts[1::2])]})
+        index = OpenHoursIndex(documents)
+
+        for minute in rng.integers(0, 10080, size=50).tolist() + [0, 10079]:
+            expected = [
+                position for position, document in enumerate(documents)
+                if any(interval['start'] <= minute < interval['end'] for interval in document['open_intervals'])
+            ]
+            self.assertEqual(sorted(index.open_positions(minute).tolist()), expected)
+
+class IngestTest(TestCase):
+    def setUp(self):
+        # Row of the CSV export with only the columns used by the transform
+        self.row = {
+            'locationid': '1728067',
+            'permit': '23MFF-00008',
+            'Applicant': "Leo's Hot Dogs",
+            'FacilityType': '',
+            'LocationDescription': 'MISSION ST: 19TH ST to 20TH ST (2300 - 2399)',
+            'Address': '2301 MISSION ST',
+            'Status': 'APPROVED',
+            'FoodItems': 'Hot dogs and related toppings: non alcoholic beverages',
+            'Approved': '09/20/2023 12:00:00 AM',
+            'Latitude': '37.76008693198698',
+            'Longitude': '-122.41880648110114',
+            'dayshours': 'Mo-Fr:3PM-4PM',
+        }
+
+    def test_transform_row(self):
+        document = transform_row(self.row)
+        self.assertEqual(document['facility_type'], 'Unknown')
+        self.assertEqual(document['food_items'], ['Hot dogs and related toppings', 'non alcoholic beverages'])
+        self.assertEqual(document['food_keys'], ['hot dogs and related toppings', 'non alcoholic beverages'])
+        self.assertEqual(document['approved_at'], datetime(2023, 9, 20))
+        self.assertEqual(document['location'], {'type': 'Point', 'coordinates': [-122.41880648110114, 37.76008693198698]})
+        self.assertEqual(document['open_hours']['Friday'], [{'start_time': '3PM', 'end_time': '4PM'}])
+        self.assertEqual(document['open_intervals'][-1], {'start': 4 * 1440 + 900, 'end': 4 * 1440 + 960})
+
+    def test_row_hash_tracks_content(self):
+        document = transform_row(self.row)
+        self.assertEqual(document['location_id'], '1728067')
+        self.assertEqual(transform_row(dict(self.row))['row_hash'], document['row_hash'])
+        self.assertNotEqual(transform_row(dict(self.row, Status='EXPIRED'))['row_hash'], document['row_hash'])
+
+    def test_changed_food_trucks(self):
+        unchanged = transform_row(self.row)
+        changed = transform_row(dict(self.row, locationid='2', Status='EXPIRED'))
+        new = transform_row(dict(self.row, locationid='3'))
+        hashes = {'1728067': unchanged['row_hash'], '2': 'stale hash'}
+        self.assertEqual(changed_food_trucks([unchanged, changed, new], hashes), [changed, new])
+
+    def test_transform_bundled_csv(self):
+        documents = [transform_row(row) for row in read_rows(DEFAULT_CSV_PATH)]
+        self.assertEqual(len(documents), 481)
+
+    def test_split_chunks(self):
+        fieldnames, chunks = split_chunks(DEFAULT_CSV_PATH, 8)
+        self.assertEqual(fieldnames[:3], ['locationid', 'Applicant', 'FacilityType'])
+        self.assertEqual(len(chunks), 8)
+        # Chunks are contiguous and cover the whole file after the header
+        for (_, end), (start, _) in zip(chunks, chunks[1:]):
+            self.assertEqual(end, start)
+        self.assertEqual(chunks[-1][1], os.path.getsize(DEFAULT_CSV_PATH))
+
+    def test_parallel_transform_matches_serial_path(self):
+        serial = [transform_row(row) for row in read_rows(DEFAULT_CSV_PATH)]
+        for workers in (2, 3):
+            with self.subTest(workers=workers):
+                parallel = list(parallel_transform(DEFAULT_CSV_PATH, workers))
+                self.assertEqual(parallel, serial)
+                self.assertEqual(food_names(parallel), food_names(serial))
+
+    @skipIf(ingest.pd is None, 'pandas is not installed')
+    def test_pandas_transform_matches_serial_path(self):
+        serial = [transform_row(row) for row in read_rows(DEFAULT_CSV_PATH)]
+        for chunk_size in (100, 10000):
+            with self.subTest(chunk_size=chunk_size):
+                skipped = []
+                self.assertEqual(list(pandas_transform(DEFAULT_CSV_PATH, chunk_size, skipped=skipped)), serial)
+                self.assertEqual(skipped, [])
+
+    @skipIf(ingest.pd is None, 'pandas is not installed')
+    def test_pandas_transform_skips_invalid_coordinates(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'food-truck-data.csv')
+            rows = [self.row, dict(self.row, locationid='2', Latitude=''), dict(self.row, locationid='3', Longitude='n/a')]
+            with open(path, 'w', newline='', encoding='utf-8') as file:
+                writer = csv.DictWriter(file, fieldnames=list(self.row))
+                writer.writeheader()
+                writer.writerows(rows)
+            skipped = []
+            self.assertEqual(list(pandas_transform(path, skipped=skipped)), [transform_row(self.row)])
+        self.assertEqual(skipped, ['2', '3'])
+
+    @patch.object(ingest, 'pd', None)
+    def test_seed_data_pandas_parser_requires_pandas(self):
+        with self.assertRaisesMessage(CommandError, 'pandas is not installed'):
+            call_command('seed_data', '--parser', 'pandas', stdout=StringIO())
+
+    def test_batched(self):
+        self.assertEqual(list(batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(batched([], 2)), [])
+
+    def test_food_upserts_deduplicate_names(self):
+        food_trucks = [{'food_items': ['tacos', ' Tacos', 'burritos']}, {'food_items': ['', 'TACOS']}, {'food_items': []}]
+        # A truck listing a food twice is counted once
+        self.assertEqual(food_upserts(food_trucks), [
+            UpdateOne({'name': 'Burritos'}, {'$setOnInsert': {'key': 'burritos'}, '$inc': {'truck_count': 1}}, upsert=True),
+            UpdateOne({'name': 'Tacos'}, {'$setOnInsert': {'key': 'tacos'}, '$inc': {'truck_count': 2}}, upsert=True),
+        ])
+
+    def test_food_removals(self):
+        food_trucks = [{'food_items': ['Tacos', 'soda']}, {'food_items': ['tacos']}]
+        self.assertEqual(food_removals(food_trucks), [
+            UpdateOne({'name': 'Soda'}, {'$inc': {'truck_count': -1}}),
+            UpdateOne({'name': 'Tacos'}, {'$inc': {'truck_count': -2}}),
+        ])
+
+    def test_food_key(self):
+        self.assertEqual(food_key(' Fish TACOS!'), 'fish tacos')
+        self.assertEqual(food_key('Crêpes'), 'crepes')
+        self.assertEqual(food_key(' & '), '')
+
+    def test_write_batch_uses_unordered_bulk_writes(self):
+        food_trucks, foods = MagicMock(), MagicMock()
+        batch = [transform_row(self.row)]
+
+        write_batch(batch, food_trucks, foods)
+
+        food_trucks.insert_many.assert_called_once_with(batch, ordered=False)
+        upserts = foods.bulk_write.call_args.args[0]
+        self.assertEqual(len(upserts), 2)
+        self.assertEqual(upserts[0]._doc['$inc'], {'truck_count': 1})
+        self.assertFalse(foods.bulk_write.call_args.kwargs['ordered'])
+
+    @patch('search.management.commands.ensure_indexes.db')
+    def test_ensure_indexes_command(self, db):
+        collections = {}
+        db.__getitem__.side_effect = lambda name: collections.setdefault(name, MagicMock())
+        out = StringIO()
+
+        call_command('ensure_indexes', stdout=out)
+
+        geo_index = collections['food_truck'].create_indexes.call_args.args[0][0]
+        self.assertEqual(geo_index.document['key'], {'location': '2dsphere'})
+        self.assertTrue(collections['food'].create_indexes.call_args.args[0][0].document['unique'])
+        self.assertIn('food_truck_terms', collections)
+        self.assertIn('Indexes created', out.getvalue())
+
+    @patch('search.management.commands.seed_data.bump_data_version')
+    @patch('search.management.commands.seed_data.food_truck_term_collection')
+    @patch('search.management.commands.seed_data.food_collection')
+    @patch('search.management.commands.seed_data.food_truck_collection')
+    def test_seed_data_command(self, food_trucks, foods, terms, bump_data_version):
+        food_trucks.find.return_value = []
+        out = StringIO()
+
+        call_command('seed_data', '--path', DEFAULT_CSV_PATH, '--batch-size', '100', stdout=out)
+
+        # The bundled CSV is written in 5 batches of at most 100 rows
+        self.assertEqual(food_trucks.insert_many.call_count, 5)
+        self.assertEqual(sum(len(call.args[0]) for call in food_trucks.insert_many.call_args_list), 481)
+        self.assertIn('481 rows processed', out.getvalue())
+        self.assertIn('Data seeded successfully', out.getvalue())
+        # Caches and indexes of the running servers are invalidated
+        bump_data_version.assert_called_once_with()
+
+    @patch('search.management.commands.seed_data.bump_data_version')
+    @patch('search.management.commands.seed_data.food_truck_term_collection')
+    @patch('search.management.commands.seed_data.food_collection')
+    @patch('search.management.commands.seed_data.food_truck_collection')
+    def test_seed_data_incremental_command(self, food_trucks, foods, terms, bump_data_version):
+        documents = [transform_row(row) for row in read_rows(DEFAULT_CSV_PATH)]
+        # The database holds every row but one changed row and one row missing from the CSV
+        stored = [{'location_id': d['location_id'], 'row_hash': d['row_hash']} for d in documents[1:]]
+        stored[0]['row_hash'] = 'stale hash'
+        stored.append({'location_id': 'removed', 'row_hash': 'hash'})
+        changed_id, removed_id = ObjectId(), ObjectId()
+        changed = {'_id': changed_id, 'location_id': documents[1]['location_id'], 'food_items': ['Stale Tacos']}
+        removed = {'_id': removed_id, 'food_items': ['Soda']}
+
+        def find(query, projection, **kwargs):
+            if '$exists' in query.get('location_id', {}):
+                return stored
+            if '$in' in query.get('location_id', {}):
+                return [changed] if changed['location_id'] in query['location_id']['$in'] else []
+            return [removed] if '$or' in query else []
+
+        food_trucks.find.side_effect = find
+        food_trucks.delete_many.return_value.deleted_count = 1
+        out = StringIO()
+
+        call_command('seed_data', '--mode', 'incremental', stdout=out)
+
+        # Nothing is cleared, only the new and the changed row are upserted
+        food_trucks.delete_many.assert_called_once_with({'_id': {'$in': [removed_id]}})
+        upserts = food_trucks.bulk_write.call_args.args[0]
+        self.assertEqual(len(upserts), 2)
+        # The changed truck keeps its id
+        self.assertEqual(upserts[1]._doc['_id'], changed_id)
+        food_trucks.insert_many.assert_not_called()
+        self.assertIn('1 inserted, 1 updated, 1 deleted', out.getvalue())
+        # Only the foods of the changed and deleted trucks are updated, foods left with no truck are deleted
+        updates = [update for call in foods.bulk_write.call_args_list for update in call.args[0]]
+        self.assertIn(UpdateOne({'name': 'Stale Tacos'}, {'$inc': {'truck_count': -1}}), updates)
+        self.assertIn(UpdateOne({'name': 'Soda'}, {'$inc': {'truck_count': -1}}), updates)
+        self.assertEqual(len(updates), 2 + len(food_names(documents[:2])))
+        foods.delete_many.assert_called_once_with({'truck_count': {'$lte': 0}})
+        # The terms of the changed and deleted trucks are updated in place, the index is not rebuilt
+        removals = [request for call in terms.bulk_write.call_args_list if call.kwargs['ordered'] for request in call.args[0]]
+        self.assertIn(UpdateOne({'term': 'stale', 'ids': changed_id}, {'$pull': {'ids': changed_id}, '$inc': {'count': -1}}), removals)
+        self.assertIn(UpdateOne({'term': 'soda', 'ids': removed_id}, {'$pull': {'ids': removed_id}, '$inc': {'count': -1}}), removals)
+        terms.database.__getitem__.assert_not_called()
+        bump_data_version.assert_called_once_with()
+
+    @patch('search.management.commands.seed_data.bump_data_version')
+    @patch('search.management.commands.seed_data.food_truck_term_collection')
+    @patch('search.management.commands.seed_data.food_collection')
+    @patch('search.management.commands.seed_data.food_truck_collection')
+    def test_seed_data_incremental_command_updated_truck_drops_food(self, food_trucks, foods, terms, bump_data_version):
+        documents = [transform_row(row) for row in read_rows(DEFAULT_CSV_PATH)]
+        stored = [{'location_id': d['location_id'], 'row_hash': d['row_hash']} for d in documents]
+        stored[0]['row_hash'] = 'stale hash'
+        truck_id = ObjectId()
+        # The stored version of the updated truck is the only one serving this food
+        previous = {'_id': truck_id, 'location_id': documents[0]['location_id'], 'food_items': ['Only Food']}
+
+        def find(query, projection, **kwargs):
+            if '$exists' in query.get('location_id', {}):
+                return stored
+            if '$in' in query.get('location_id', {}):
+                return [previous]
+            return []
+
+        food_trucks.find.side_effect = find
+        out = StringIO()
+
+        call_command('seed_data', '--mode', 'incremental', stdout=out)
+
+        self.assertIn('0 inserted, 1 updated, 0 deleted', out.getvalue())
+        updates = [update for call in foods.bulk_write.call_args_list for update in call.args[0]]
+        self.assertIn(UpdateOne({'name': 'Only Food'}, {'$inc': {'truck_count': -1}}), updates)
+        # The food no truck serves anymore is deleted although no truck was
+        foods.delete_many.assert_called_once_with({'truck_count': {'$lte': 0}})
+
+    @patch('search.management.commands.seed_data.bump_data_version')
+    @patch('search.management.commands.seed_data.food_truck_term_collection')
+    @patch('search.management.commands.seed_data.food_collection')
+    @patch('search.management.commands.seed_data.food_truck_collection')
+    def test_seed_data_incremental_command_without_changes(self, food_trucks, foods, terms, bump_data_version):
+        documents = [transform_row(row) for row in read_rows(DEFAULT_CSV_PATH)]
+        stored = [{'location_id': d['location_id'], 'row_hash': d['row_hash']} for d in documents]
+        food_trucks.find.side_effect = lambda query, projection, **kwargs: stored if 'location_id' in query else []
+        out = StringIO()
+
+        call_command('seed_data', '--mode', 'incremental', stdout=out)
+
+        # Nothing is written, rebuilt or invalidated
+        food_trucks.bulk_write.assert_not_called()
+        food_trucks.delete_many.assert_not_called()
+        foods.bulk_write.assert_not_called()
+        foods.delete_many.assert_not_called()
+        terms.bulk_write.assert_not_called()
+        terms.database.__getitem__.assert_not_called()
+        bump_data_version.assert_not_called()
+        self.assertIn('0 inserted, 0 updated, 0 deleted', out.getvalue())
+
+    @patch('search.management.commands.seed_data.bump_data_version')
+    @patch('search.management.commands.seed_data.food_truck_term_collection')
+    @patch('search.management.commands.seed_data.food_collection')
+    @patch('search.management.commands.seed_data.food_truck_collection')
+    def test_seed_data_incremental_command_builds_missing_term_index(self, food_trucks, foods, terms, bump_data_version):
+        documents = [transform_row(row) for row in read_rows(DEFAULT_CSV_PATH)]
+        stored = [{'location_id': d['location_id'], 'row_hash': d['row_hash']} for d in documents]
+        food_trucks.find.side_effect = lambda query, projection, **kwargs: stored if 'location_id' in query else []
+        terms.name = 'food_truck_terms'
+        terms.find_one.return_value = None
+
+        call_command('seed_data', '--mode', 'incremental', stdout=StringIO())
+
+        terms.database.__getitem__.return_value.rename.assert_called_once_with('food_truck_terms', dropTarget=True)
+        bump_data_version.assert_called_once_with()
+
+    @patch('search.management.commands.seed_data.bump_data_version')
+    @patch('search.management.commands.seed_data.food_truck_term_collection')
+    @patch('search.management.commands.seed_data.db')
+    @patch('search.management.commands.seed_data.food_collection')
+    @patch('search.management.commands.seed_data.food_truck_collection')
+    def test_seed_data_shadow_command(self, food_trucks, foods, db, terms, bump_data_version):
+        food_trucks.name, foods.name = 'food_truck', 'food'
+        food_trucks.find.return_value = []
+        shadows = {}
+        db.__getitem__.side_effect = lambda name: shadows.setdefault(name, MagicMock())
+
+        call_command('seed_data', '--mode', 'shadow', stdout=StringIO())
+
+        # The live collections are never cleared, the loaded shadows replace them
+        food_trucks.delete_many.assert_not_called()
+        self.assertEqual(sum(len(call.args[0]) for call in shadows['food_truck_shadow'].insert_many.call_args_list), 481)
+        shadows['food_truck_shadow'].rename.assert_called_once_with('food_truck', dropTarget=True)
+        shadows['food_shadow'].rename.assert_called_once_with('food', dropTarget=True)
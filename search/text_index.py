@@ -0,0 +1,341 @@
+import re
+import unicodedata
+from collections import defaultdict
+
+from pymongo import ASCENDING, DeleteMany, InsertOne, UpdateOne
+
+from .utils import batched
+
+# Fields of the food truck documents whose words are searchable with the q parameter
+INDEXED_FIELDS = ('applicant', 'address', 'food_items')
+
+# Number of term documents written per bulk write when rebuilding the index
+WRITE_BATCH_SIZE = 1000
+
+# Maximum number of ids of a term document. The posting list of a common term is split
+# into several buckets, far below the 16 MB limit of a BSON document.
+TERM_BUCKET_SIZE = 1000
+
+# Number of ids held in memory while rebuilding the index. Once reached, the partial
+# buckets of every term are written, so memory does not grow with the collection.
+PENDING_IDS_LIMIT = 100000
+
+# Words shorter than this are not looked up in the term index, as the prefix of a letter
+# or two expands to a large part of the vocabulary. They are matched with regexes instead.
+MIN_PREFIX_LENGTH = 3
+
+# Maximum number of term documents read for the prefix of a word. A word whose prefix
+# expands to more term documents only matches whole terms.
+MAX_PREFIX_POSTINGS = 500
+
+# Suffix of the collection a new index is written to before it replaces the live one
+REBUILD_SUFFIX = '_rebuild'
+
+_word_pattern = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    """
+    Split a text into normalized search terms.
+
+    Accents are stripped and the text is lowercased before splitting it on every
+    non-alphanumeric character, so "Crêpes & Café" yields ['crepes', 'cafe'].
+
+    Args:
+        text (str): Text to tokenize.
+
+    Returns:
+        list: The terms of the text, in order of appearance.
+    """
+    folded = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii')
+    return _word_pattern.findall(folded.lower())
+
+
+def document_terms(document):
+    """
+    Return the set of search terms of a food truck document.
+    """
+    terms = set()
+    for field in INDEXED_FIELDS:
+        value = document.get(field)
+        if not value:
+            continue
+        for text in value if isinstance(value, list) else [value]:
+            terms.update(tokenize(text))
+    return terms
+
+
+def build_postings(documents):
+    """
+    Build the posting lists of an inverted index over food truck documents.
+
+    Args:
+        documents (iterable): Food truck documents with an '_id'.
+
+    Returns:
+        dict: Mapping of each term to the list of ids of the documents containing it.
+    """
+    postings = defaultdict(list)
+    for document in documents:
+        for term in document_terms(document):
+            postings[term].append(document['_id'])
+    return postings
+
+
+def term_buckets(documents, bucket_size=TERM_BUCKET_SIZE, pending_limit=PENDING_IDS_LIMIT):
+    """
+    Stream the bucketed posting lists of an inverted index over food truck documents.
+
+    A bucket is written as soon as it is full, and the partial buckets of every term once
+    pending_limit ids are held, so a term may have several partial buckets.
+
+    Args:
+        documents (iterable): Food truck documents with an '_id'.
+        bucket_size (int): Maximum number of ids of a bucket.
+        pending_limit (int): Number of ids held before the partial buckets are yielded.
+
+    Yields:
+        dict: Term documents {'term': str, 'bucket': int, 'count': int, 'ids': [ObjectId, ...]},
+            buckets of a term being numbered from 0.
+    """
+    pending = defaultdict(list)
+    next_bucket = defaultdict(int)
+    pending_count = 0
+
+    def bucket(term, ids):
+        number = next_bucket[term]
+        next_bucket[term] += 1
+        return {'term': term, 'bucket': number, 'count': len(ids), 'ids': ids}
+
+    for document in documents:
+        for term in document_terms(document):
+            ids = pending[term]
+            ids.append(document['_id'])
+            pending_count += 1
+            if len(ids) >= bucket_size:
+                yield bucket(term, pending.pop(term))
+                pending_count -= bucket_size
+        if pending_count >= pending_limit:
+            for term, ids in pending.items():
+                yield bucket(term, ids)
+            pending.clear()
+            pending_count = 0
+    for term, ids in pending.items():
+        yield bucket(term, ids)
+
+
+def rebuild_term_index(food_truck_collection, term_collection):
+    """
+    Rebuild the term collection from the documents of the food truck collection.
+
+    Term documents are the buckets of term_buckets, with a unique index on (term, bucket)
+    so prefix lookups are index range scans. They are written while the food trucks are
+    read, to a separate collection that then atomically replaces the live one, so searches
+    never see a partial index.
+
+    Returns:
+        int: Number of term documents written.
+    """
+    projection = {field: 1 for field in INDEXED_FIELDS}
+    documents = food_truck_collection.find({}, projection, sort=[('_id', 1)])
+
+    building = term_collection.database[term_collection.name + REBUILD_SUFFIX]
+    building.drop()
+    building.create_index([('term', ASCENDING), ('bucket', ASCENDING)], unique=True)
+    written = 0
+    for requests in batched((InsertOne(bucket) for bucket in term_buckets(documents)), WRITE_BATCH_SIZE):
+        building.bulk_write(requests, ordered=False)
+        written += len(requests)
+    building.rename(term_collection.name, dropTarget=True)
+    return written
+
+
+def term_removals(documents):
+    """
+    Build the writes removing food truck documents from the term index, before they are
+    replaced or deleted.
+
+    An id is in a single bucket of each of its terms, and the buckets left empty are
+    deleted afterwards, so the writes must be ordered.
+    """
+    requests = []
+    for term, ids in sorted(build_postings(documents).items()):
+        requests.extend(UpdateOne({'term': term, 'ids': id_}, {'$pull': {'ids': id_}, '$inc': {'count': -1}}) for id_ in ids)
+        requests.append(DeleteMany({'term': term, 'count': {'$lte': 0}}))
+    return requests
+
+
+def term_additions(term_collection, documents, bucket_size=TERM_BUCKET_SIZE):
+    """
+    Build the writes adding stored food truck documents to the term index.
+
+    The ids of a term first fill the last bucket of the term, then new buckets, so the
+    buckets stay within bucket_size ids as the index is updated.
+
+    Args:
+        term_collection (Collection): Term collection built by rebuild_term_index.
+        documents (list): Food truck documents with an '_id'.
+        bucket_size (int): Maximum number of ids of a bucket.
+
+    Returns:
+        list: Unordered writes of the term collection.
+    """
+    postings = build_postings(documents)
+    last_buckets = {}
+    projection = {'term': 1, 'bucket': 1, 'count': 1, '_id': 0}
+    for bucket in term_collection.find({'term': {'$in': sorted(postings)}}, projection):
+        last = last_buckets.get(bucket['term'])
+        if last is None or bucket['bucket'] > last['bucket']:
+            last_buckets[bucket['term']] = bucket
+
+    requests = []
+    for term, ids in sorted(postings.items()):
+        last = last_buckets.get(term)
+        number = 0
+        if last is not None:
+            free = max(bucket_size - last['count'], 0)
+            if free and ids:
+                added = ids[:free]
+                requests.append(UpdateOne(
+                    {'term': term, 'bucket': last['bucket']},
+                    {'$push': {'ids': {'$each': added}}, '$inc': {'count': len(added)}},
+                ))
+                ids = ids[free:]
+            number = last['bucket'] + 1
+        for start in range(0, len(ids), bucket_size):
+            bucket_ids = ids[start:start + bucket_size]
+            requests.append(InsertOne({'term': term, 'bucket': number, 'count': len(bucket_ids), 'ids': bucket_ids}))
+            number += 1
+    return requests
+
+
+def query_tokens(query):
+    """
+    Return the distinct words of a query, longest first since they match the fewest terms.
+    """
+    return sorted(set(tokenize(query)), key=len, reverse=True)
+
+
+def short_word_filter(query):
+    """
+    Return the filter of the words of a query shorter than MIN_PREFIX_LENGTH.
+
+    Each of them must appear, case-insensitively, in the applicant, the address or one of
+    the food items, as with the regex search the term index replaced. Empty if the query
+    has no short word.
+    """
+    clauses = []
+    for token in query_tokens(query):
+        if len(token) < MIN_PREFIX_LENGTH:
+            regex = {'$regex': re.escape(token), '$options': 'i'}
+            clauses.append({'$or': [
+                {'applicant': regex},
+                {'address': regex},
+                {'food_items': {'$elemMatch': regex}},
+            ]})
+    return {'$and': clauses} if clauses else {}
+
+
+def prefix_filter(token):
+    """
+    Return the filter of the terms starting with a word.
+
+    Anchored, case-sensitive regexes on normalized terms are served by the 'term' index.
+    """
+    return {'term': {'$regex': '^' + re.escape(token)}}
+
+
+def term_filter(token):
+    """
+    Return the filter of the term equal to a word.
+    """
+    return {'term': token}
+
+
+def posting_ids(postings):
+    """
+    Return the set of ids of term documents.
+    """
+    ids = set()
+    for posting in postings:
+        ids.update(posting['ids'])
+    return ids
+
+
+def query_ids(tokens, candidates):
+    """
+    Return the result of resolve_query from the words of a query and the ids matching its
+    long words, sorted so the search can read them page by page in _id order.
+    """
+    if candidates is None:
+        return None if tokens else []
+    return sorted(candidates)
+
+
+def resolve_token(term_collection, token):
+    """
+    Return the ids of the food trucks with a term starting with a word.
+
+    Words whose prefix expands to more than MAX_PREFIX_POSTINGS term documents only match
+    whole terms, which bounds the number of ids read for a very common prefix.
+    """
+    postings = list(term_collection.find(prefix_filter(token), {'ids': 1, '_id': 0}, limit=MAX_PREFIX_POSTINGS + 1))
+    if len(postings) <= MAX_PREFIX_POSTINGS:
+        return posting_ids(postings)
+    return posting_ids(term_collection.find(term_filter(token), {'ids': 1, '_id': 0}))
+
+
+async def aresolve_token(term_collection, token):
+    """
+    Async variant of resolve_token, for a term collection of the async client.
+    """
+    cursor = term_collection.find(prefix_filter(token), {'ids': 1, '_id': 0}, limit=MAX_PREFIX_POSTINGS + 1)
+    postings = await cursor.to_list(None)
+    if len(postings) <= MAX_PREFIX_POSTINGS:
+        return posting_ids(postings)
+    return posting_ids(await term_collection.find(term_filter(token), {'ids': 1, '_id': 0}).to_list(None))
+
+
+def resolve_query(term_collection, query):
+    """
+    Resolve a search query to the ids of the matching food trucks.
+
+    Every word of the query must be a prefix of at least one term of a food truck for it
+    to match, which gives type-ahead behavior on partially typed words. Very common words
+    only match whole terms, see resolve_token. Words shorter than MIN_PREFIX_LENGTH are
+    left to short_word_filter.
+
+    Args:
+        term_collection (Collection): Term collection built by rebuild_term_index.
+        query (str): Raw search query.
+
+    Returns:
+        list: Sorted ids of the matching food trucks. Empty if the query contains no words,
+            None if it only contains short words.
+    """
+    tokens = query_tokens(query)
+    candidates = None
+    for token in tokens:
+        if len(token) < MIN_PREFIX_LENGTH:
+            continue
+        ids = resolve_token(term_collection, token)
+        candidates = ids if candidates is None else candidates & ids
+        if not candidates:
+            return []
+    return query_ids(tokens, candidates)
+
+
+async def aresolve_query(term_collection, query):
+    """
+    Async variant of resolve_query, for a term collection of the async client.
+    """
+    tokens = query_tokens(query)
+    candidates = None
+    for token in tokens:
+        if len(token) < MIN_PREFIX_LENGTH:
+            continue
+        ids = await aresolve_token(term_collection, token)
+        candidates = ids if candidates is None else candidates & ids
+        if not candidates:
+            return []
+    return query_ids(tokens, candidates)
@@ -0,0 +1,104 @@
+import math
+
+import numpy as np
+
+# Latitude limit of the Web Mercator projection, where the map is square.
+MAX_LATITUDE = 85.05112878
+
+# Degrees added around the box of a tile when selecting its points, for rounding.
+TILE_MARGIN = 1e-9
+
+# Width in pixels of a map tile, the unit of the pixel distances of clustering.
+TILE_SIZE = 256
+
+
+def tile_count(zoom):
+    """
+    Return the number of tiles along each axis of the map at a zoom level.
+    """
+    return 1 << zoom
+
+
+def mercator_xy(longitudes, latitudes):
+    """
+    Return the Web Mercator coordinates of points, from 0 to 1 from the north-west corner of the map.
+
+    Multiplied by the tile count of a zoom level, they are the tile coordinates of the points.
+    """
+    phis = np.radians(np.clip(latitudes, -MAX_LATITUDE, MAX_LATITUDE))
+    xs = (np.asarray(longitudes, dtype=np.float64) + 180) / 360
+    ys = (1 - np.arcsinh(np.tan(phis)) / math.pi) / 2
+    return xs, ys
+
+
+def tile_xy(longitudes, latitudes, zoom):
+    """
+    Return the XYZ tile coordinates of points in the Web Mercator tiling used by web maps.
+
+    Tile (0, 0) is the north-west corner of the map. Latitudes beyond MAX_LATITUDE fall in
+    the first or last row of tiles.
+
+    Args:
+        longitudes (numpy.ndarray): Longitudes of the points in degrees.
+        latitudes (numpy.ndarray): Latitudes of the points in degrees.
+        zoom (int): Zoom level, the map is 2 ** zoom tiles wide.
+
+    Returns:
+        tuple: numpy.ndarray of the x and of the y tile coordinates.
+    """
+    count = tile_count(zoom)
+    xs, ys = mercator_xy(longitudes, latitudes)
+    xs, ys = np.floor(xs * count), np.floor(ys * count)
+    # Longitude 180 and the clipped poles land one tile past the edge
+    return np.clip(xs, 0, count - 1).astype(np.int64), np.clip(ys, 0, count - 1).astype(np.int64)
+
+
+def tile_xy_expression(zoom, coordinates='$location.coordinates'):
+    """
+    Return the aggregation expressions computing the same tile coordinates as tile_xy.
+
+    Args:
+        zoom (int): Zoom level.
+        coordinates (str): Path of the [longitude, latitude] array of the documents.
+
+    Returns:
+        dict: {'x': expression, 'y': expression}.
+    """
+    count = tile_count(zoom)
+    longitude = {'$arrayElemAt': [coordinates, 0]}
+    latitude = {'$max': [{'$min': [{'$arrayElemAt': [coordinates, 1]}, MAX_LATITUDE]}, -MAX_LATITUDE]}
+    mercator = {'$asinh': {'$tan': {'$degreesToRadians': latitude}}}
+    x = {'$floor': {'$multiply': [{'$divide': [{'$add': [longitude, 180]}, 360]}, count]}}
+    y = {'$floor': {'$multiply': [{'$divide': [{'$subtract': [1, {'$divide': [mercator, math.pi]}]}, 2]}, count]}}
+    return {
+        'x': {'$max': [{'$min': [x, count - 1]}, 0]},
+        'y': {'$max': [{'$min': [y, count - 1]}, 0]},
+    }
+
+
+def tile_bbox(x, y, zoom):
+    """
+    Return the (min_longitude, min_latitude, max_longitude, max_latitude) box of a tile.
+    """
+    count = tile_count(zoom)
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / count))))
+
+    return (x / count * 360 - 180, latitude(y + 1), (x + 1) / count * 360 - 180, latitude(y))
+
+
+def tile_search_bbox(x, y, zoom):
+    """
+    Return a box holding every point that tile_xy puts in a tile.
+
+    It is the box of the tile widened by a small margin for rounding, and stretched to the
+    pole for the first and last rows, which hold the points beyond MAX_LATITUDE.
+    """
+    min_longitude, min_latitude, max_longitude, max_latitude = tile_bbox(x, y, zoom)
+    return (
+        max(min_longitude - TILE_MARGIN, -180),
+        -90 if y == tile_count(zoom) - 1 else min_latitude - TILE_MARGIN,
+        min(max_longitude + TILE_MARGIN, 180),
+        90 if y == 0 else max_latitude + TILE_MARGIN,
+    )
@@ -1,8 +1,27 @@
+from django.conf import settings
 from django.urls import path
-from .views import NearbyFoodTrucks, AllFoodTrucks, SearchFoodTrucks
+from foodTruck.response_cache import cache_response, client_cache_control
+from . import async_views, views
+from .export import export_view
+
+# The async views are served instead of the sync ones when ASYNC_VIEWS is enabled
+read_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
-    path('nearby/', NearbyFoodTrucks.as_view(),name='nearByFoodTrucks'),
-    path('all/', AllFoodTrucks.as_view(),name='allFoodTrucks'),   
-    path('search/', SearchFoodTrucks.as_view(),name='searchFoodTrucks'),
-]
\ No newline at end of file
+    path('nearby/', cache_response(read_views.NearbyFoodTrucks.as_view()),name='nearByFoodTrucks'),
+    path('nearby/batch/', read_views.NearbyFoodTrucksBatch.as_view(), name='nearByFoodTrucksBatch'),
+    path('bbox/', cache_response(read_views.BBoxFoodTrucks.as_view()), name='bboxFoodTrucks'),
+    # Tiles are also cached by the clients, which then only request the tiles new to a viewport.
+    # Tiles filtered by opening time are revalidated instead.
+    path(
+        'tiles/<int:zoom>/<int:x>/<int:y>/',
+        client_cache_control(settings.TILE_CACHE_MAX_AGE)(cache_response(read_views.TileFoodTrucks.as_view())),
+        name='tileFoodTrucks',
+    ),
+    path('facets/', cache_response(read_views.FoodTruckFacets.as_view()), name='foodTruckFacets'),
+    path('density/', cache_response(read_views.FoodTruckDensity.as_view()), name='foodTruckDensity'),
+    path('all/', cache_response(read_views.AllFoodTrucks.as_view()),name='allFoodTrucks'),   
+    path('search/', cache_response(read_views.SearchFoodTrucks.as_view()),name='searchFoodTrucks'),
+    # Cached as files by data version instead of through the response cache
+    path('export/', export_view, name='exportFoodTrucks'),
+]
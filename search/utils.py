@@ -1,3 +1,36 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+from itertools import islice
+
+# Full day names by abbreviation, in week order
+DAY_NAMES = {
+    "Mo": "Monday", "Tu": "Tuesday", "We": "Wednesday",
+    "Th": "Thursday", "Fr": "Friday", "Sa": "Saturday", "Su": "Sunday"
+}
+DAY_ABBREVIATIONS = tuple(DAY_NAMES)
+DAY_INDEXES = {day: index for index, day in enumerate(DAY_ABBREVIATIONS)}
+
+# Grammar of a schedule of the 'dayshours' column, e.g. 'Mo-Fr:7AM-8AM/10AM-11AM' or 'Su/We/Sa:11AM-3PM'
+_DAY = r'(?:{})'.format('|'.join(DAY_ABBREVIATIONS))
+_TIME = r'(?:1[0-2]|0?[1-9])[AP]M'
+SCHEDULE_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<first_day>{day})\s*-\s*(?P<last_day>{day})      # Range of days
+        | (?P<days>{day}(?:\s*/\s*{day})*)                  # List of days
+    )
+    \s*:\s*(?P<slots>.*?)\s*
+""".format(day=_DAY), re.VERBOSE)
+SLOT_PATTERN = re.compile(r'\s*({time})\s*-\s*({time})\s*'.format(time=_TIME))
+
+# Number of distinct 'dayshours' strings whose parsing is memoized. Schedules repeat
+# heavily across permits, so a few thousand cover every row of an export.
+OPEN_HOURS_CACHE_SIZE = 4096
+
+# Problem found in a schedule of an open hours string. The schedule is left out of the result.
+OpenHoursError = namedtuple('OpenHoursError', ['schedule', 'message'])
+
+
 def validate_location_params(latitude, longitude, radius):
     """
     Validate latitude, longitude, and radius parameters for location filtering.
@@ -24,53 +57,99 @@ def validate_location_params(latitude, longitude, radius):
     return True
 
 
-def parse_open_hours(open_hours_str):
+def validate_limit_param(limit):
+    """
+    Validate the limit parameter used to cap the number of returned food trucks.
+
+    Parameters:
+    - limit: Limit to be validated.
+
+    Returns:
+    - bool: True if the limit is a positive integer, False otherwise.
+    """
+    try:
+        return int(limit) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+def _schedule_days(match):
+    """
+    Return the day abbreviations of a matched schedule, in week order for ranges.
+    """
+    if match.group('days') is not None:
+        return [day.strip() for day in match.group('days').split('/')]
+    first, last = DAY_INDEXES[match.group('first_day')], DAY_INDEXES[match.group('last_day')]
+    # Ranges like 'Fr-Mo' wrap around the end of the week
+    return [DAY_ABBREVIATIONS[index % 7] for index in range(first, last + 1 if last >= first else last + 8)]
+
+
+@lru_cache(maxsize=OPEN_HOURS_CACHE_SIZE)
+def _compile_open_hours(open_hours_str):
+    """
+    Parse an open hours string into immutable tuples, memoized on the raw string.
+
+    Returns:
+        tuple: ((day name, ((start time, end time), ...)), ...) in the order days are
+            first seen, and a tuple of OpenHoursError.
+    """
+    slots_by_day = {}
+    errors = []
+    for schedule in open_hours_str.split(';'):
+        if not schedule.strip():
+            continue
+        match = SCHEDULE_PATTERN.fullmatch(schedule)
+        if match is None:
+            errors.append(OpenHoursError(schedule.strip(), 'expected days:start-end'))
+            continue
+
+        time_slots = []
+        for time_slot in match.group('slots').split('/'):
+            slot_match = SLOT_PATTERN.fullmatch(time_slot)
+            if slot_match is None:
+                errors.append(OpenHoursError(schedule.strip(), 'invalid time slot {!r}'.format(time_slot.strip())))
+            else:
+                time_slots.append(slot_match.groups())
+
+        # Days listed by several schedules keep the time slots of all of them
+        for day in _schedule_days(match):
+            slots_by_day.setdefault(DAY_NAMES[day], []).extend(time_slots)
+
+    open_hours = tuple((day, tuple(time_slots)) for day, time_slots in slots_by_day.items() if time_slots)
+    return open_hours, tuple(errors)
+
+
+def parse_open_hours(open_hours_str, errors=None):
     """
     Parse the string representation of open hours into a dictionary.
 
+    Malformed schedules and time slots never raise: they are left out of the result and
+    reported through `errors`. Parsing is memoized on the raw string.
+
     Args:
         open_hours_str (str): String containing the open hours data in the format:
             "Day1-Day5:Start_Time1-End_Time1/Start_Time2-End_Time2;Day2/Day3/Day4:Start_Time1-End_Time1/Start_Time2-End_Time2;..."
+        errors (list): If given, an OpenHoursError is appended for each part that could not be parsed.
 
     Returns:
         dict: A dictionary representing the parsed open hours data.
             The keys are the days of the week, and the values are lists of time slots.
             Each time slot is represented by a dictionary with 'start_time' and 'end_time'.
     """
-    # Mapping of abbreviated days to full day names
-    day_mapping = {
-        "Mo": "Monday", "Tu": "Tuesday", "We": "Wednesday", 
-        "Th": "Thursday", "Fr": "Friday", "Sa": "Saturday", "Su": "Sunday"
+    open_hours, parse_errors = _compile_open_hours(open_hours_str or '')
+    if errors is not None:
+        errors.extend(parse_errors)
+    # A new dict every call, the memoized tuples must not be shared with callers
+    return {
+        day: [{"start_time": start_time, "end_time": end_time} for start_time, end_time in time_slots]
+        for day, time_slots in open_hours
     }
-    open_hours = {}
-
-    for schedule in open_hours_str.split(';'):
-        parts = schedule.split(':')
-        if len(parts) != 2:
-            continue
-
-        day_part, hour_part = parts[0].strip(), parts[1].strip()
-        
-        days = set()
-        if '/' in day_part:
-            for day in day_part.split('/'):
-                days.add(day_mapping.get(day, day))
-        elif '-' in day_part:
-            start_day, end_day = day_part.split('-')
-            start_index = list(day_mapping.keys()).index(start_day)
-            end_index = list(day_mapping.keys()).index(end_day)
-            for index in range(start_index, end_index + 1):
-                days.add(list(day_mapping.values())[index])
-        else:
-            days.add(day_mapping.get(day_part, day_part))
-        
-        time_slots = []
-        
-        for time_slot in hour_part.split('/'):
-            start_time, end_time = time_slot.split('-')
-            time_slots.append({"start_time": start_time, "end_time": end_time})
 
-        for day in days:
-            open_hours[day] = time_slots
 
-    return open_hours
+def batched(iterable, size):
+    """
+    Yield lists of up to size consecutive items of an iterable.
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
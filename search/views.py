@@ -1,13 +1,22 @@
 from rest_framework import status as http_status
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from .serializers import FoodTruckSerializer
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.http import JsonResponse
-from foodTruck.db_connection import db
-from .utils import validate_location_params
+from foodTruck.db_connection import read_db
+from foodTruck.metrics import timed
+from .geo import get_geo_engine
+from .text_index import resolve_query
+from .encoders import FastJSONRenderer
+from .queries import AllQuery, BBoxQuery, DensityQuery, FacetsQuery, InvalidParameter, NearbyBatchQuery, NearbyQuery, SearchQuery, TileQuery
+from .streaming import json_encoder, streaming_response
 
 # get food truck collection
-food_truck_collection = db['food_truck']
+food_truck_collection = read_db['food_truck']
+# get the inverted index of the searchable food truck words
+food_truck_term_collection = read_db['food_truck_terms']
 
 class NearbyFoodTrucks(APIView):
     """
@@ -16,49 +25,235 @@ class NearbyFoodTrucks(APIView):
     Expected Query Parameters:
         - latitude: Latitude coordinate of the center point for the search (default: 0).
         - longitude: Longitude coordinate of the center point for the search (default: 0).
-        - radius: Search radius in meters (default: 1000).
+        - radius: Search radius in meters (default: 1000, unbounded with sort=distance).
+        - limit: Page size, nearest first.
+        - cursor: 'next' cursor of the previous page.
+        - sort: 'distance' without a radius to rank the trucks at any distance, nearest first.
+        - open_at: ISO 8601 datetime, only return the food trucks open at that time.
+        - open_now: '1' to only return the food trucks open now.
+        - food: Only return the food trucks serving this food, e.g. 'tacos'.
+        - fields: Comma separated FoodTruck fields and presets (pin, card, full) to return,
+          e.g. 'pin' or 'applicant,location' (default: full, every field but the id).
+        - cluster: '1' to merge the food trucks closer than CLUSTER_RADIUS pixels at the zoom
+          level, cannot be combined with pagination.
+        - zoom: Zoom level of the map the food trucks are clustered for, from 0 to MAP_MAX_ZOOM.
 
     Returns:
-        - JSON response containing count and data of nearby food trucks.
+        - JSON response containing count and data of nearby food trucks, and the cursor of
+          the next page (null on the last one) when paginating. When clustering, data only
+          holds the food trucks alone in their cluster, and clusters the count and mean
+          longitude and latitude of the food trucks of the other clusters.
     """
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def get(self, request):
+        try:
+            query = NearbyQuery(request.query_params)
+        except InvalidParameter as error:
+            return Response({'error_message': str(error)}, status=http_status.HTTP_400_BAD_REQUEST)
+
+        geo_engine = get_geo_engine(food_truck_collection)
+        if query.paginated:
+            # One extra truck is fetched to know whether there is a next page
+            food_trucks = geo_engine.page(query.longitude, query.latitude, query.limit + 1, radius=query.radius, after=query.after, filters=query.filters, projection=query.projection)
+        else:
+            food_trucks = geo_engine.near(query.longitude, query.latitude, radius=query.radius, filters=query.filters, projection=query.projection)
+        clusters = None
+        if query.cluster_zoom is not None:
+            food_trucks, clusters = geo_engine.cluster(food_trucks, query.cluster_zoom)
+        return Response(query.response_data(food_trucks, clusters))
+
+
+class NearbyFoodTrucksBatch(APIView):
+    """
+    API endpoint answering many nearby queries in one request.
+
+    Expected Body:
+        - queries: List of objects with the latitude, longitude, radius (default: 1000, null
+          for unbounded) and limit of a nearby query, and a filters object holding its
+          open_at, open_now and food parameters. At most NEARBY_BATCH_MAX_QUERIES queries.
+        - fields: Fields of the returned food trucks, taking the same values as the fields
+          query parameter of the nearby endpoint.
+
+    Returns:
+        - JSON response containing the count of queries and their results, in the order of
+          the queries, each with the count and data of its nearby food trucks.
+    """
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def post(self, request):
+        try:
+            query = NearbyBatchQuery(request.data)
+        except InvalidParameter as error:
+            return Response({'error_message': str(error)}, status=http_status.HTTP_400_BAD_REQUEST)
+
+        results = get_geo_engine(food_truck_collection).near_many(query.queries, projection=query.encoder.projection)
+        return Response(query.response_data(results))
+
+
+class BBoxFoodTrucks(APIView):
+    """
+    API endpoint to retrieve the food trucks inside a map viewport.
+
+    Expected Query Parameters:
+        - bbox: 'min_longitude,min_latitude,max_longitude,max_latitude' of the viewport.
+        - limit: Page size, in _id order.
+        - cursor: 'next' cursor of the previous page.
+        - open_at: ISO 8601 datetime, only return the food trucks open at that time.
+        - open_now: '1' to only return the food trucks open now.
+        - food: Only return the food trucks serving this food, e.g. 'tacos'.
+        - fields: Comma separated FoodTruck fields and presets (pin, card, full) to return,
+          e.g. 'pin' or 'applicant,location' (default: full, every field but the id).
+        - cluster: '1' to merge the food trucks closer than CLUSTER_RADIUS pixels at the zoom
+          level, cannot be combined with pagination.
+        - zoom: Zoom level of the map the food trucks are clustered for, from 0 to MAP_MAX_ZOOM.
+
+    Returns:
+        - JSON response containing count and data of the food trucks inside the box, and the
+          cursor of the next page (null on the last one) when paginating. When clustering,
+          the clusters are returned as by the nearby endpoint.
+    """
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
     def get(self, request):
-        query_params = request.query_params
-        latitude = query_params.get('latitude', 0)
-        longitude = query_params.get('longitude', 0)
-        radius = query_params.get('radius', 1000)
-
-        is_valid = validate_location_params(latitude, longitude, radius)
-        if not is_valid:
-            return Response({'error_message': "invalid location filter parameter"}, status=http_status.HTTP_400_BAD_REQUEST)
-
-        location = [float(longitude), float(latitude)]
-        query = {
-            'location': {
-                '$near': {
-                    '$geometry': {
-                        'type': 'Point',
-                        'coordinates': location
-                    },
-                    '$maxDistance': float(radius)
-                }
-            }
-        }
-        nearby_foodtrucks = food_truck_collection.find(query)
-        serializer = FoodTruckSerializer(nearby_foodtrucks, many=True)
-        return Response({'count': len(serializer.data), 'data': serializer.data})
+        try:
+            query = BBoxQuery(request.query_params)
+        except InvalidParameter as error:
+            return Response({'error_message': str(error)}, status=http_status.HTTP_400_BAD_REQUEST)
+
+        geo_engine = get_geo_engine(food_truck_collection)
+        food_trucks = geo_engine.inside(query.bbox, **query.inside_kwargs())
+        clusters = None
+        if query.cluster_zoom is not None:
+            food_trucks, clusters = geo_engine.cluster(food_trucks, query.cluster_zoom)
+        return Response(query.response_data(food_trucks, clusters))
+
+
+class TileFoodTrucks(APIView):
+    """
+    API endpoint to retrieve the food trucks of an XYZ (Web Mercator) map tile.
+
+    The tile is given by the zoom, x and y of the path. Tiles do not overlap, so the
+    responses of the tiles covering a viewport are cached and shared by every viewport
+    overlapping them.
+
+    Expected Query Parameters:
+        - open_at: ISO 8601 datetime, only return the food trucks open at that time.
+        - open_now: '1' to only return the food trucks open now.
+        - food: Only return the food trucks serving this food, e.g. 'tacos'.
+        - fields: Comma separated FoodTruck fields and presets (pin, card, full) to return,
+          e.g. 'pin' or 'applicant,location' (default: full, every field but the id).
+        - cluster: '1' to merge the food trucks closer than CLUSTER_RADIUS pixels at the zoom
+          level of the tile. Clusters only hold food trucks of the tile.
+
+    Returns:
+        - JSON response containing count and data of the food trucks of the tile. When
+          clustering, the clusters are returned as by the nearby endpoint.
+    """
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def get(self, request, zoom, x, y):
+        try:
+            query = TileQuery(zoom, x, y, request.query_params)
+        except InvalidParameter as error:
+            return Response({'error_message': str(error)}, status=http_status.HTTP_400_BAD_REQUEST)
+
+        geo_engine = get_geo_engine(food_truck_collection)
+        food_trucks = geo_engine.tile(query.zoom, query.x, query.y, filters=query.filters, projection=query.projection)
+        clusters = None
+        if query.cluster_zoom is not None:
+            food_trucks, clusters = geo_engine.cluster(food_trucks, query.cluster_zoom)
+        return Response(query.response_data(food_trucks, clusters))
+
+
+class FoodTruckFacets(APIView):
+    """
+    API endpoint counting the food trucks by status, facility type and food.
+
+    Expected Query Parameters:
+        - bbox: 'min_longitude,min_latitude,max_longitude,max_latitude', only count the food
+          trucks inside this box.
+        - open_at: ISO 8601 datetime, only count the food trucks open at that time.
+        - open_now: '1' to only count the food trucks open now.
+        - food: Only count the food trucks serving this food, e.g. 'tacos'.
+        - food_limit: Number of foods to return, most served first (default: FACET_FOOD_LIMIT).
+
+    Returns:
+        - JSON response containing the count of food trucks and, by facet, the count of food
+          trucks of each value, most frequent first.
+    """
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def get(self, request):
+        try:
+            query = FacetsQuery(request.query_params)
+        except InvalidParameter as error:
+            return Response({'error_message': str(error)}, status=http_status.HTTP_400_BAD_REQUEST)
+
+        geo_engine = get_geo_engine(food_truck_collection)
+        return Response(geo_engine.facets(bbox=query.bbox, filters=query.filters, food_limit=query.food_limit))
+
+
+class FoodTruckDensity(APIView):
+    """
+    API endpoint counting the food trucks by map tile.
+
+    Expected Query Parameters:
+        - zoom: Zoom level of the XYZ (Web Mercator) tiles, from 0 to MAP_MAX_ZOOM.
+        - bbox: 'min_longitude,min_latitude,max_longitude,max_latitude', only count the food
+          trucks inside this box.
+        - open_at: ISO 8601 datetime, only count the food trucks open at that time.
+        - open_now: '1' to only count the food trucks open now.
+        - food: Only count the food trucks serving this food, e.g. 'tacos'.
+
+    Returns:
+        - JSON response containing the zoom level, the count of food trucks and the cells of
+          the tiles holding food trucks, with their x, y, count and the mean longitude and
+          latitude of their food trucks.
+    """
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def get(self, request):
+        try:
+            query = DensityQuery(request.query_params)
+        except InvalidParameter as error:
+            return Response({'error_message': str(error)}, status=http_status.HTTP_400_BAD_REQUEST)
+
+        geo_engine = get_geo_engine(food_truck_collection)
+        return Response(query.response_data(geo_engine.density(query.zoom, bbox=query.bbox, filters=query.filters)))
 
 
 class AllFoodTrucks(APIView):
     """
     API endpoint to retrieve all food trucks from the database.
 
+    Expected Query Parameters:
+        - limit: Page size, in _id order.
+        - cursor: 'next' cursor of the previous page.
+        - stream: 'json' or 'ndjson' to stream the food trucks while they are read from MongoDB.
+          Cannot be combined with pagination.
+        - fields: Comma separated FoodTruck fields and presets (pin, card, full) to return,
+          e.g. 'pin' or 'applicant,location' (default: full, every field but the id).
+
     Returns:
-        - JSON response containing count and data of all food trucks.
+        - JSON response containing count and data of all food trucks, and the cursor of the
+          next page (null on the last one) when paginating.
     """
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
     def get(self, request):
-        all_food_trucks = food_truck_collection.find()
-        serializer = FoodTruckSerializer(all_food_trucks, many=True)
-        return Response({'count': len(serializer.data), 'data': serializer.data})
+        try:
+            query = AllQuery(request.query_params)
+        except InvalidParameter as error:
+            return Response({'error_message': str(error)}, status=http_status.HTTP_400_BAD_REQUEST)
+
+        query_filter, find_kwargs = query.find_args()
+        if query.stream_format:
+            # The count comes from a separate query so the cursor is never materialized
+            count = food_truck_collection.count_documents(query_filter)
+            food_trucks = food_truck_collection.find(query_filter, **find_kwargs)
+            return streaming_response(query.stream_format, count, food_trucks, query.encoder.encode)
+        return Response(query.response_data(food_truck_collection.find(query_filter, **find_kwargs)))
 
 
 class SearchFoodTrucks(APIView):
@@ -66,63 +261,55 @@ class SearchFoodTrucks(APIView):
     API endpoint to search for food trucks based on various filters.
 
     Expected Query Parameters:
-        - q: Search query string.
+        - q: Search query string. Every word must prefix a word of the applicant, address or food items,
+          words of one or two letters may appear anywhere in them.
         - status: Filter by status.
         - facility_type: Filter by facility type.
+        - open_at: ISO 8601 datetime, only return the food trucks open at that time.
+        - open_now: '1' to only return the food trucks open now.
+        - food: Only return the food trucks serving this food, e.g. 'tacos'.
         - latitude: Latitude coordinate for geospatial search.
         - longitude: Longitude coordinate for geospatial search.
         - radius: Search radius in meters for geospatial search.
+        - limit: Page size. When streaming, the maximum number of food trucks to return.
+        - cursor: 'next' cursor of the previous page.
+        - sort: 'distance' to order the results by distance to latitude/longitude.
+        - stream: 'json' or 'ndjson' to stream the food trucks while they are read from MongoDB.
+        - fields: Comma separated FoodTruck fields and presets (pin, card, full) to return,
+          e.g. 'pin' or 'applicant,location' (default: full, every field but the id).
+
+    With sort=distance and no radius, the matching trucks are ordered by distance regardless
+    of how far they are. Without a radius or sort=distance, the location is ignored. Pages are
+    in distance order when the results are, and in _id order otherwise.
 
     Returns:
-        - JSON response containing count and data of searched food trucks.
+        - JSON response containing count and data of searched food trucks, and the cursor of
+          the next page (null on the last one) when paginating.
     """
     def get(self, request):
-        query_params = request.query_params
-        search_query = query_params.get('q', '')
-        status = query_params.get('status', None)
-        facility_type = query_params.get('facility_type', None)
-        latitude = query_params.get('latitude', None)
-        longitude = query_params.get('longitude', None)
-        radius = query_params.get('radius', None)
-
-        if latitude and longitude:
-            is_valid = validate_location_params(latitude, longitude, radius)
-            if not is_valid:
-                return Response({'error_message': "invalid location filter parameter"}, status=http_status.HTTP_400_BAD_REQUEST)
-
-        pipeline = []
-        match_stage = {}
-
-        if search_query:
-            match_stage['$or'] = [
-                {'applicant': {'$regex': search_query, '$options': 'i'}},
-                {'address': {'$regex': search_query, '$options': 'i'}},
-                {'food_items': {'$elemMatch': {'$regex': search_query, '$options': 'i'}}}
-            ]
-
-        if status:
-            match_stage['status'] = status
-
-        if facility_type:
-            match_stage['facility_type'] = facility_type
-
-        if latitude and longitude and radius:
-            pipeline.append({
-                '$geoNear': {
-                    'near': {
-                        'type': 'Point',
-                        'coordinates': [float(longitude), float(latitude)]
-                    },
-                    'distanceField': 'distance',
-                    'maxDistance': float(radius),
-                    'spherical': True
-                }
-            })
-
-        if match_stage:
-            pipeline.append({'$match': match_stage})
-
-        pipeline.append({'$project': {'_id': 0}})
-        result = food_truck_collection.aggregate(pipeline)
-        result = list(result)
-        return JsonResponse({"count": len(result), 'data': result}, safe=False)
+        try:
+            query = SearchQuery(request.query_params)
+        except InvalidParameter as error:
+            return Response({'error_message': str(error)}, status=http_status.HTTP_400_BAD_REQUEST)
+
+        # Resolve the words to candidate ids with the inverted index instead of scanning with regexes
+        matched_ids = resolve_query(food_truck_term_collection, query.search_query) if query.search_query else None
+
+        if query.streams_from_cursor:
+            # Count with a separate aggregation, then stream the documents from the cursor
+            pipeline = query.pipeline(matched_ids)
+            counted = list(food_truck_collection.aggregate(query.count_pipeline(pipeline)))
+            count = counted[0]['count'] if counted else 0
+            result = food_truck_collection.aggregate(pipeline, batchSize=settings.STREAM_BATCH_SIZE)
+            return streaming_response(query.stream_format, count, result, json_encoder(DjangoJSONEncoder))
+
+        result = []
+        for pipeline in query.pipelines(matched_ids):
+            result += food_truck_collection.aggregate(pipeline)
+            if query.result_limit is not None and len(result) >= query.result_limit:
+                break
+        result = query.rank(result[:query.result_limit])
+        if query.stream_format:
+            return streaming_response(query.stream_format, len(result), result, json_encoder(DjangoJSONEncoder))
+        with timed('render'):
+            return JsonResponse(query.response_data(result), safe=False)